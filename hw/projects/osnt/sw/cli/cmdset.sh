@@ -1,12 +1,10 @@
 [ -e axitrack.txt ] && rm axitrack.txt
+[ -e axitrack.bin ] && rm axitrack.bin
 
 DIR="$(dirname "${BASH_SOURCE[0]}")" 
 DIR="$(realpath "${DIR}")"  
 SCRIPTPATH=$DIR
 
-#mkdir -p $SCRIPTPATH/../pickle
-mkdir -p $SCRIPTPATH/pickle
-
 python3 osnt-tool-cmd.py -new
 #python3 osnt-tool-cmd.py -ifp0 ../sample_traces/256.cap -rpn0 100 -ipg0 0 #-rxs0 26 -txs0 16
 python3 osnt-tool-cmd.py -ifp1 ../sample_traces/256.cap -rpn1 2 -ipg1 0
@@ -29,18 +29,18 @@
 ################################################################################
 
 from datetime import datetime
-import pickle # update
 import os, sys, math, argparse
 sys.path.insert(0, "./../lib")
-from libaxi import *
 from time import gmtime, strftime, sleep
-#from monitor import *
-#from monitor_cli_lib import *
-from generator import *
-from generator_cli_lib import *
-#from timestamp_capture_cli_lib import *
+from generator_client import connect_daemon
+from config_store import ConfigStore
 
 input_arg = argparse.ArgumentParser()
+input_arg.add_argument("-local", action="store_true", help="OSNT PLUS drive the generator from this process even if the generator daemon runs. eg. -local")
+input_arg.add_argument("-reload", action="store_true", help="OSNT PLUS forget what was applied to the card and load everything on -run. eg. -reload")
+input_arg.add_argument("-profile", type=str, help="OSNT PLUS switch to a settings profile, created from the current one if new. eg. -profile <name>")
+input_arg.add_argument("-profiles", action="store_true", help="OSNT PLUS list the settings profiles. eg. -profiles")
+input_arg.add_argument("-rmprofile", type=str, help="OSNT PLUS delete a settings profile. eg. -rmprofile <name>")
 # Generator flags
 input_arg.add_argument("-new", action="store_true", help="new command set (clear old parameters) eg. -new")
 input_arg.add_argument("-ifp0", type=str, help="OSNT PLUS generator load packet into port 0. eg. -if0 <pcap file>")
@@ -75,6 +75,22 @@ input_arg.add_argument("-run", action="store_true", help="OSNT PLUS generator tr
 
 args = input_arg.parse_args()
 
+# With the generator daemon running (../lib/generator_daemon.py) this is a
+# thin client and the generator modules are never imported here.
+client = None
+if not args.local:
+    client = connect_daemon()
+if client is None:
+    from libaxi import *
+    #from monitor import *
+    #from monitor_cli_lib import *
+    from generator import *
+    from generator_cli_lib import *
+    from generator_session import GeneratorSession
+    #from timestamp_capture_cli_lib import *
+    # generator_cli_lib exports the datetime module under the same name
+    from datetime import datetime
+
 # 1. Generator only
 # 2. Monitor only
 # 3. Latency only
@@ -83,33 +99,24 @@ args = input_arg.parse_args()
 
 ## ==============================================
 
-nullstr = "nullstr"
+# all settings live in one store, see ../lib/config_store.py
+store = ConfigStore()
 
-if (args.new):
+if (args.profile):
+    store.use_profile(args.profile)
+    print("  ")
+    print("[CLI: Using profile " + store.profile + "]\n")
 
-    # load pcap file
-    pickle.dump(nullstr, open("./pickle/pcapfile_0.p", "wb"))
-    pickle.dump(nullstr, open("./pickle/pcapfile_1.p", "wb"))
-    
-    # load pcap file with timestamp
-    pickle.dump(nullstr, open("./pickle/pcapfilets_0.p", "wb"))
-    pickle.dump(nullstr, open("./pickle/pcapfilets_1.p", "wb"))
+if (args.rmprofile):
+    store.delete_profile(args.rmprofile)
 
-    # replay count
-    pickle.dump(0, open("./pickle/rpn_0.p", "wb"))
-    pickle.dump(0, open("./pickle/rpn_1.p", "wb"))
+if (args.profiles):
+    for name in store.profiles():
+        print(("* " if name == store.profile else "  ") + name)
 
-    # delays
-    pickle.dump(0, open("./pickle/delay_0.p", "wb"))
-    pickle.dump(0, open("./pickle/delay_1.p", "wb"))
+if (args.new):
 
-#    # rx timestamp position
-#    pickle.dump(nullstr, open("./pickle/rxtsps_0.p", "wb"))
-#    pickle.dump(nullstr, open("./pickle/rxtsps_1.p", "wb"))
-#
-#    # tx timestamp position
-#    pickle.dump(nullstr, open("./pickle/txtsps_0.p", "wb"))
-#    pickle.dump(nullstr, open("./pickle/txtsps_1.p", "wb"))
+    store.reset()
 
     print("  ")
     print("[CLI: Previous Configuration Cleared!]\n")
@@ -151,31 +158,33 @@ if (args.new):
 
 # Load pcap file
 if (args.ifp0):
-    pickle.dump(args.ifp0, open("./pickle/pcapfile_0.p", "wb"))
+    store.set("nf0", "pcap", args.ifp0)
 
 if (args.ifp1):
-    pickle.dump(args.ifp1, open("./pickle/pcapfile_1.p", "wb"))
+    store.set("nf1", "pcap", args.ifp1)
 
 # Load pcap file
 if (args.ifpt0):
-    pickle.dump(args.ifpt0, open("./pickle/pcapfilets_0.p", "wb"))
+    store.set("nf0", "pcap_ts", args.ifpt0)
 
 if (args.ifpt1):
-    pickle.dump(args.ifpt1, open("./pickle/pcapfilets_1.p", "wb"))
+    store.set("nf1", "pcap_ts", args.ifpt1)
 
 # Set packet replay number
 if (args.rpn0 or args.rpn0 == 0):
-    pickle.dump(args.rpn0, open("./pickle/rpn_0.p", "wb"))
+    store.set("nf0", "replay_cnt", args.rpn0)
 
 if (args.rpn1 or args.rpn1 == 0):
-    pickle.dump(args.rpn1, open("./pickle/rpn_1.p", "wb"))
+    store.set("nf1", "replay_cnt", args.rpn1)
 
 # Set inter packet gap dealy
 if (args.ipg0):
-   pickle.dump(args.ipg0, open("./pickle/delay_0.p", "wb"))
+   store.set("nf0", "ipg", args.ipg0)
 
 if (args.ipg1):
-   pickle.dump(args.ipg1, open("./pickle/delay_1.p", "wb"))
+   store.set("nf1", "ipg", args.ipg1)
+
+store.save()
 
 # Set TX timestamp position (preparation)
 #if (args.txs0):
@@ -231,56 +240,64 @@ if (args.run):
 #    txtss = {}
 
     # load generator parameters
-    pickle_fname_suffix = ".p"
+    settings = store.settings()
     # ### load pcap file ###
-    pickle_fname_prefix = "./pickle/pcapfile_"
     mypcaps = {}
-    change = 0
     for i in range(2):
-        pickle_fname_str = pickle_fname_prefix + str(i) + pickle_fname_suffix
-        v = pickle.load(open(pickle_fname_str, "rb"))
-        if v != nullstr:
-            change = 1
-            portstr = "nf" + str(i)
+        portstr = "nf" + str(i)
+        v = settings[portstr]["pcap"]
+        if v is not None:
             mypcaps[portstr] = v
             pcaps[i] = v
         else:
             pcaps[i] = "n/a"                 
-    if change == 1:
-        set_load_pcap(mypcaps)  
     # ### load pcap file with timestamp ###
-    # pickle_fname_prefix = "./pickle/pcapfilets_"
     # flag_pcapfilets = 0
     # mypcaps = {}
-    # change = 0
     # for i in range(2):
-    #     pickle_fname_str = pickle_fname_prefix + str(i) + pickle_fname_suffix
-    #     v = pickle.load(open(pickle_fname_str, "rb"))
-    #     if v != nullstr:
-    #         change = 1
+    #     portstr = "nf" + str(i)
+    #     v = settings[portstr]["pcap_ts"]
+    #     if v is not None:
     #         flag_pcapfilets = 1
-    #         portstr = "nf" + str(i)
     #         mypcaps[portstr] = v
     #         pcaps_ts[i] = v
     #     else:
     #         pcaps_ts[i] = "n/a"        
-    # if change == 1:
-    #     set_load_pcap_ts(mypcaps)  
     # ### set packet replay number ###
-    pickle_fname_prefix = "./pickle/rpn_"
     values = [0, 0]
     for i in range(2):
-        pickle_fname_str = pickle_fname_prefix + str(i) + pickle_fname_suffix
-        values[i] = pickle.load(open(pickle_fname_str, "rb"))
-        #print('copied replay number: ' + str(i) + ' with value: ' + str(values[i]))
-        replays[i] = pickle.load(open(pickle_fname_str, "rb"))
-    set_replay_cnt(values)
+        values[i] = settings["nf" + str(i)]["replay_cnt"]
+        replays[i] = values[i]
+    # the session reloads traces and rewrites registers only on change,
+    # against the state kept in the store or held by the daemon
+    config = {}
+    for i in range(2):
+        portstr = "nf" + str(i)
+        config[portstr] = {'replay_cnt':values[i]}
+        if portstr in mypcaps:
+            config[portstr]['pcap'] = os.path.abspath(mypcaps[portstr])
+    if client is None:
+        session = GeneratorSession(initgcli.device)
+        if not args.reload:
+            session.restore(store.applied)
+        try:
+            result = session.apply(config)
+        finally:
+            store.applied = session.state()
+            store.save()
+    else:
+        # the daemon changes the card behind the stored state
+        store.applied = None
+        store.save()
+        if args.reload:
+            client.call('forget')
+        result = client.call('apply', config=config)
+    print("  ")
+    print("[CLI: Applied " + str(result['writes']) + " register writes, loaded " + (", ".join(result['loaded']) or "no ports") + "]")
     # ### set inter packet delays ###   
-    # pickle_fname_prefix = "./pickle/delay_"
     # values = [0, 0]
     # for i in range(2):
-    #     pickle_fname_str = pickle_fname_prefix + str(i) + pickle_fname_suffix
-    #     values[i] = pickle.load(open(pickle_fname_str, "rb"))
+    #     values[i] = settings["nf" + str(i)]["ipg"]
     #     delays[i] = values[i]
     #     #print('copied interpacket delay: ' + str(i) + ' with value: ' + str(values[i]))
     # if flag_pcapfilets == 1:
@@ -315,7 +332,10 @@ if (args.run):
 #        if values[i] != nullstr:
 #            set_tx_ts(i, values[i])
     # actual run        
-    initgcli.pcap_engine.run()
+    if client is None:
+        session.run()
+    else:
+        client.call('run')
     print("  ")
     print("[CLI: Start packet generator...!]\n")
     
@@ -329,7 +349,7 @@ if (args.run):
     for i in range(2):
         port_name = " [nf"+str(i)+"]"
         pcap_local = pcaps[i]
-        pcap_ts_local = pcaps_ts[i]
+        pcap_ts_local = pcaps_ts.get(i, "n/a")
         if pcap_local == "n/a" and pcap_ts_local == "n/a":
             pcap_print = "     n/a"
         else: 
@@ -345,7 +365,7 @@ if (args.run):
 #        if txtss[i] == "nullstr":
 #            txtss[i] = "-"
 #        print((port_name+"   "+ str(replays[i])+"           "+str(delays[i])+"         "+str(rxtss[i])+"        "+str(txtss[i])+"      " + pcap_print))
-        print((port_name+"   "+ str(replays[i])+"           "+str(delays[i])+"        n/a""        n/a""      " + pcap_print))
+        print((port_name+"   "+ str(replays[i])+"           "+str(delays.get(i, "n/a"))+"        n/a""        n/a""      " + pcap_print))
         print("                                 ")
     
     print((datetime.now()))
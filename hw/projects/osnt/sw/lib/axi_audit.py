@@ -0,0 +1,146 @@
+#
+# Copyright (c) 2016-2017 University of Cambridge
+# Copyright (c) 2016-2017 Jong Hun Han
+# Copyright (c) 2022 Gianni Antichi
+# All rights reserved.
+#
+# This software was developed by University of Cambridge Computer Laboratory
+# under the ENDEAVOUR project (grant agreement 644960) as part of
+# the European Union's Horizon 2020 research and innovation programme.
+#
+# @NETFPGA_LICENSE_HEADER_START@
+#
+# Licensed to NetFPGA Open Systems C.I.C. (NetFPGA) under one or more
+# contributor license agreements. See the NOTICE file distributed with this
+# work for additional information regarding copyright ownership. NetFPGA
+# licenses this file to you under the NetFPGA Hardware-Software License,
+# Version 1.0 (the License); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at:
+#
+# http://www.netfpga-cic.org
+#
+# Unless required by applicable law or agreed to in writing, Work distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# @NETFPGA_LICENSE_HEADER_END@
+################################################################################
+#
+#  Description:
+#        Register access audit trail. Records are kept in a fixed-size
+#        in-memory ring and written to a binary file by a background thread,
+#        so register accesses do not pay for file I/O. Use
+#        tools/axitrack_decode.py to turn the file back into text or CSV.
+#
+#        File layout: AUDIT_MAGIC followed by AUDIT_RECORD entries of
+#        (timestamp_ns, op, addr, value), little endian.
+
+import os, time, threading, atexit
+from struct import Struct
+
+AUDIT_MAGIC = b'OSNTAXI1'
+AUDIT_RECORD = Struct('<QB3xII')
+
+AUDIT_OP_READ = 0
+AUDIT_OP_WRITE = 1
+
+class AxiAuditLog:
+
+    def __init__(self, path="axitrack.bin", ring_size=4096, flush_interval=0.1):
+        self.path = path
+        self.ring_size = ring_size
+        self.flush_interval = flush_interval
+        self.ring = bytearray(ring_size*AUDIT_RECORD.size)
+        # head counts records produced, tail counts records written out
+        self.head = 0
+        self.tail = 0
+        self.closed = False
+        self.lock = threading.Lock()
+        self.not_full = threading.Condition(self.lock)
+        self.wakeup = threading.Condition(self.lock)
+
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.f = open(path, "ab")
+        if new_file:
+            self.f.write(AUDIT_MAGIC)
+            self.f.flush()
+
+        self.thread = threading.Thread(target=self._run, name="axi-audit")
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.close)
+
+    def record(self, op, addr, value):
+        ts = time.time_ns()
+        with self.lock:
+            # the audit trail must not lose records, so wait for the
+            # flusher if it has fallen a full ring behind
+            while self.head - self.tail >= self.ring_size and not self.closed:
+                self.wakeup.notify()
+                self.not_full.wait()
+            slot = (self.head % self.ring_size)*AUDIT_RECORD.size
+            AUDIT_RECORD.pack_into(self.ring, slot, ts, op, addr & 0xffffffff, value & 0xffffffff)
+            self.head += 1
+            if self.head - self.tail >= self.ring_size//2:
+                self.wakeup.notify()
+
+    # Copies out pending records under the lock, writes them without it.
+    def _drain(self):
+        with self.lock:
+            head = self.head
+            tail = self.tail
+            first = (tail % self.ring_size)*AUDIT_RECORD.size
+            last = (head % self.ring_size)*AUDIT_RECORD.size
+            if head == tail:
+                chunk = b''
+            elif first < last:
+                chunk = bytes(self.ring[first:last])
+            else:
+                chunk = bytes(self.ring[first:]) + bytes(self.ring[:last])
+        if chunk:
+            self.f.write(chunk)
+            self.f.flush()
+        with self.lock:
+            self.tail = head
+            self.not_full.notify_all()
+
+    def _run(self):
+        while True:
+            with self.lock:
+                if not self.closed and self.head == self.tail:
+                    self.wakeup.wait(self.flush_interval)
+                closed = self.closed
+            self._drain()
+            if closed:
+                return
+
+    def flush(self):
+        self._drain()
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.wakeup.notify()
+            self.not_full.notify_all()
+        self.thread.join()
+        self._drain()
+        self.f.close()
+
+# Yields (timestamp_ns, op, addr, value) from an audit file.
+def read_audit(path):
+    f = open(path, "rb")
+    magic = f.read(len(AUDIT_MAGIC))
+    if magic != AUDIT_MAGIC:
+        f.close()
+        raise ValueError(path+" is not an OSNT register audit file")
+    while True:
+        data = f.read(AUDIT_RECORD.size*1024)
+        if not data:
+            break
+        usable = len(data) - len(data) % AUDIT_RECORD.size
+        for record in AUDIT_RECORD.iter_unpack(data[:usable]):
+            yield record
+    f.close()
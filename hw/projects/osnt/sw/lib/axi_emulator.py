@@ -0,0 +1,123 @@
+#
+# Copyright (c) 2016-2017 University of Cambridge
+# Copyright (c) 2016-2017 Jong Hun Han
+# Copyright (c) 2022 Gianni Antichi
+# All rights reserved.
+#
+# This software was developed by University of Cambridge Computer Laboratory
+# under the ENDEAVOUR project (grant agreement 644960) as part of
+# the European Union's Horizon 2020 research and innovation programme.
+#
+# @NETFPGA_LICENSE_HEADER_START@
+#
+# Licensed to NetFPGA Open Systems C.I.C. (NetFPGA) under one or more
+# contributor license agreements. See the NOTICE file distributed with this
+# work for additional information regarding copyright ownership. NetFPGA
+# licenses this file to you under the NetFPGA Hardware-Software License,
+# Version 1.0 (the License); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at:
+#
+# http://www.netfpga-cic.org
+#
+# Unless required by applicable law or agreed to in writing, Work distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# @NETFPGA_LICENSE_HEADER_END@
+################################################################################
+#
+#  Description:
+#        In-memory register file that stands in for the card, so the
+#        generator classes and tools can run on any Linux box. Select it
+#        with OSNT_AXI_BACKEND=emulator or set_backend(generator_emulator()).
+
+# Register map of the generator modules, as addressed by generator.py.
+# Base addresses match PCAP_ENGINE_BASE_ADDR, INTER_PKT_DELAY_BASE_ADDR,
+# RATE_LIMITER_BASE_ADDR and DELAY_HEADER_EXTRACTOR_BASE_ADDR.
+EMU_PCAP_ENGINE_BASE_ADDR = 0x12000
+EMU_PCAP_ENGINE_REGS = 14 # ctrl0 - ctrl13
+EMU_INTER_PKT_DELAY_BASE_ADDR = [0x13000, 0x13030]
+EMU_INTER_PKT_DELAY_REGS = 4 # reset, enable, use_reg, delay
+EMU_RATE_LIMITER_BASE_ADDR = [0x14000, 0x14024]
+EMU_RATE_LIMITER_REGS = 3 # reset, enable, rate
+EMU_DELAY_HEADER_EXTRACTOR_BASE_ADDR = 0x10000
+EMU_DELAY_HEADER_EXTRACTOR_REGS = 2 # reset, enable
+
+class AxiEmulator:
+
+    def __init__(self):
+        self.regs = {}
+        self.defaults = {}
+        # counters cleared when read
+        self.clear_on_read = set()
+        # reset register -> registers returned to their defaults when it is
+        # written with a non-zero value
+        self.resets = {}
+        self.reads = 0
+        self.writes = 0
+
+    def add_register(self, addr, default=0):
+        self.defaults[addr] = default
+        self.regs[addr] = default
+
+    def add_counter(self, addr, clear_on_read=True):
+        self.add_register(addr)
+        if clear_on_read:
+            self.clear_on_read.add(addr)
+
+    def add_reset(self, addr, targets):
+        self.resets.setdefault(addr, []).extend(targets)
+
+    # Test hook standing in for the datapath: advances a counter.
+    def count(self, addr, n=1):
+        self.regs[addr] = (self.regs.get(addr, 0) + n) & 0xffffffff
+
+    # FPGA reset: every register back to its default.
+    def reset(self):
+        self.regs = dict(self.defaults)
+
+    def read(self, addr):
+        self.reads += 1
+        value = self.regs.get(addr, 0)
+        if addr in self.clear_on_read:
+            self.regs[addr] = 0
+        return value
+
+    def write(self, addr, value):
+        self.writes += 1
+        self.regs[addr] = value & 0xffffffff
+        if value and addr in self.resets:
+            for target in self.resets[addr]:
+                if target != addr:
+                    self.regs[target] = self.defaults.get(target, 0)
+
+    def batch(self, ops):
+        results = []
+        for op, addr, value in ops:
+            if op == 'r':
+                results.append(self.read(addr))
+            else:
+                self.write(addr, value)
+                results.append(None)
+        return results
+
+    def close(self):
+        pass
+
+# Returns an emulator populated with the generator register map. The control
+# registers of these modules are plain read/write registers in hardware;
+# their software resets do not clear them, so no reset targets are set.
+def generator_emulator():
+    emu = AxiEmulator()
+    for i in range(EMU_PCAP_ENGINE_REGS):
+        emu.add_register(EMU_PCAP_ENGINE_BASE_ADDR + 4*i)
+    for base in EMU_INTER_PKT_DELAY_BASE_ADDR:
+        for i in range(EMU_INTER_PKT_DELAY_REGS):
+            emu.add_register(base + 4*i)
+    for base in EMU_RATE_LIMITER_BASE_ADDR:
+        for i in range(EMU_RATE_LIMITER_REGS):
+            emu.add_register(base + 4*i)
+    for i in range(EMU_DELAY_HEADER_EXTRACTOR_REGS):
+        emu.add_register(EMU_DELAY_HEADER_EXTRACTOR_BASE_ADDR + 4*i)
+    return emu
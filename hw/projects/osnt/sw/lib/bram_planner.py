@@ -0,0 +1,211 @@
+#
+# Copyright (c) 2016-2017 University of Cambridge
+# Copyright (c) 2016-2017 Jong Hun Han
+# Copyright (c) 2022 Gianni Antichi
+# All rights reserved.
+#
+# This software was developed by University of Cambridge Computer Laboratory
+# under the ENDEAVOUR project (grant agreement 644960) as part of
+# the European Union's Horizon 2020 research and innovation programme.
+#
+# @NETFPGA_LICENSE_HEADER_START@
+#
+# Licensed to NetFPGA Open Systems C.I.C. (NetFPGA) under one or more
+# contributor license agreements. See the NOTICE file distributed with this
+# work for additional information regarding copyright ownership. NetFPGA
+# licenses this file to you under the NetFPGA Hardware-Software License,
+# Version 1.0 (the License); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at:
+#
+# http://www.netfpga-cic.org
+#
+# Unless required by applicable law or agreed to in writing, Work distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# @NETFPGA_LICENSE_HEADER_END@
+################################################################################
+#
+#  Description:
+#        Checks whether a trace fits the generator memory and plans how to
+#        make it fit. Every port of osnt_bram_pcap_replay_uengine stores its
+#        frames in a 2^MEM_DEPTH deep BRAM of 64 byte words, one frame taking
+#        ceil(len/64) words. Writes start at address 1 and the load-done pulse
+#        adds an end marker word, so 2046 words are usable. Frames past that
+#        wrap around and overwrite the trace without any error. In timestamp
+#        mode every packet also takes one word for its timestamp frame.
+#
+#        Strategies:
+#          truncate  keep the longest prefix that fits
+#          sample    keep evenly spaced packets, preserving the length
+#                    distribution, as many as fit
+#          period    keep the shortest exactly repeating period of the trace
+#                    (trace_period.py) and multiply replay_cnt by the number
+#                    of repetitions
+
+import numpy as np
+from trace_index import trace_index, TRACE_WORD_BYTES
+from trace_period import analyze
+from pcap_reader import open_trace, PcapWriter
+
+# MEM_DEPTH of osnt_bram_pcap_replay_uengine
+GEN_BRAM_DEPTH = 11
+GEN_BRAM_WORDS = 1 << GEN_BRAM_DEPTH
+# address 0 is never written and wr_done takes one word
+GEN_BRAM_CAPACITY = GEN_BRAM_WORDS - 2
+TS_FRAME_WORDS = 1
+
+PLAN_STRATEGIES = ('truncate', 'sample', 'period')
+
+# Memory words taken by every packet of a trace with these frame lengths.
+def frame_words(lengths, ts=False):
+    words = (lengths.astype(np.int64) + (TRACE_WORD_BYTES-1))//TRACE_WORD_BYTES
+    if ts:
+        words = words + TS_FRAME_WORDS
+    return words
+
+# Packets of pcap to load and the replay_cnt multiplier that reproduces the
+# trace with them.
+class TracePlan:
+
+    def __init__(self, pcap, strategy, indices, words, capacity, pkts, replay_mult=1, first_gap_ns=None):
+        self.pcap = pcap
+        self.strategy = strategy
+        self.indices = indices
+        self.words = words
+        self.capacity = capacity
+        self.pkts = pkts
+        self.replay_mult = replay_mult
+        # gap to give the first packet in timestamp mode, None for the
+        # default. The generator applies it at the start of every replay,
+        # so a period plan uses the gap between two periods.
+        self.first_gap_ns = first_gap_ns
+
+    def fits(self):
+        return self.words <= self.capacity
+
+    def stats(self):
+        return {'strategy':self.strategy,
+                'pkts':self.pkts,
+                'pkts_kept':len(self.indices),
+                'words':self.words,
+                'capacity':self.capacity,
+                'replay_mult':self.replay_mult}
+
+    # Writes the planned packets, with their original timestamps, to path.
+    def write(self, path):
+        keep = np.zeros(self.pkts, dtype=bool)
+        keep[self.indices] = True
+        keep = keep.tolist()
+        reader = open_trace(self.pcap)
+        writer = PcapWriter(path)
+        try:
+            for i, (ts_ns, frame) in enumerate(reader):
+                if i >= len(keep):
+                    break
+                if keep[i]:
+                    writer.write(ts_ns, frame)
+        finally:
+            reader.close()
+            writer.close()
+        return path
+
+class CapacityPlanner:
+
+    def __init__(self, capacity=GEN_BRAM_CAPACITY):
+        self.capacity = capacity
+
+    # Words pcap takes in the generator memory.
+    def footprint(self, pcap, ts=False):
+        return int(frame_words(trace_index(pcap).lengths, ts).sum())
+
+    def fits(self, pcap, ts=False):
+        return self.footprint(pcap, ts) <= self.capacity
+
+    def whole(self, pcap, ts=False):
+        index = trace_index(pcap)
+        words = frame_words(index.lengths, ts)
+        return TracePlan(pcap, 'whole', np.arange(index.count), int(words.sum()), self.capacity, index.count)
+
+    def truncate(self, pcap, ts=False):
+        index = trace_index(pcap)
+        used = np.cumsum(frame_words(index.lengths, ts))
+        keep = int(np.searchsorted(used, self.capacity, side='right'))
+        words = int(used[keep-1]) if keep else 0
+        return TracePlan(pcap, 'truncate', np.arange(keep), words, self.capacity, index.count)
+
+    def sample(self, pcap, ts=False):
+        index = trace_index(pcap)
+        words = frame_words(index.lengths, ts)
+        n = index.count
+        def pick(k):
+            return np.arange(k, dtype=np.int64)*n//k if k else np.zeros(0, dtype=np.int64)
+        # largest evenly spaced sample that fits
+        low, high = 0, n
+        while low < high:
+            k = (low + high + 1)//2
+            if int(words[pick(k)].sum()) <= self.capacity:
+                low = k
+            else:
+                high = k - 1
+        indices = pick(low)
+        return TracePlan(pcap, 'sample', indices, int(words[indices].sum()), self.capacity, n)
+
+    # One period of pcap, see trace_period.py. In timestamp mode the gaps
+    # must repeat too, in ticks at frequency Hz. Returns None when the trace
+    # does not repeat.
+    def period(self, pcap, ts=False, frequency=None):
+        result = analyze(pcap, ts, frequency)
+        if result['replay_cnt'] < 2:
+            return None
+        index = trace_index(pcap)
+        p = result['period']
+        words = int(frame_words(index.lengths[:p], ts).sum())
+        return TracePlan(pcap, 'period', np.arange(p), words, self.capacity, index.count,
+                         result['replay_cnt'], result['repeat_gap_ns'])
+
+    # Plans pcap for the generator memory. A repeating trace is reduced to
+    # one period when that fits, which also shortens the load; otherwise a
+    # trace that fits is kept whole. Anything else uses strategy, or with
+    # None samples. frequency is the datapath clock, needed with ts.
+    def plan(self, pcap, ts=False, strategy=None, frequency=None):
+        period = None
+        if strategy in (None, 'period'):
+            period = self.period(pcap, ts, frequency)
+            if period is not None and period.fits():
+                return period
+        whole = self.whole(pcap, ts)
+        if whole.fits():
+            return whole
+        if strategy == 'truncate':
+            return self.truncate(pcap, ts)
+        if strategy == 'sample':
+            return self.sample(pcap, ts)
+        if strategy == 'period':
+            return period
+        if strategy is not None:
+            raise ValueError("Unknown strategy "+str(strategy)+", expected one of "+', '.join(PLAN_STRATEGIES))
+        return self.sample(pcap, ts)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Fit traces to the OSNT generator memory")
+    parser.add_argument("pcap", help="pcap or pcapng trace")
+    parser.add_argument("--ts", action="store_true", help="timestamp mode")
+    parser.add_argument("--capacity", type=int, default=GEN_BRAM_CAPACITY, help="usable memory words per port")
+    parser.add_argument("--strategy", choices=PLAN_STRATEGIES, help="fitting strategy")
+    parser.add_argument("--frequency", type=int, help="datapath clock in Hz for gaps, needed with --ts")
+    parser.add_argument("-o", "--output", help="write the planned trace here")
+    args = parser.parse_args()
+    if args.ts and args.frequency is None:
+        parser.error("--ts needs --frequency")
+    planner = CapacityPlanner(args.capacity)
+    plan = planner.plan(args.pcap, args.ts, args.strategy, args.frequency)
+    if plan is None:
+        print(args.pcap+': no repeating period')
+    else:
+        for key, value in plan.stats().items():
+            print(key+': '+str(value))
+        if args.output:
+            plan.write(args.output)
@@ -0,0 +1,168 @@
+#
+# Copyright (c) 2016-2017 University of Cambridge
+# Copyright (c) 2016-2017 Jong Hun Han
+# Copyright (c) 2022 Gianni Antichi
+# All rights reserved.
+#
+# This software was developed by University of Cambridge Computer Laboratory
+# under the ENDEAVOUR project (grant agreement 644960) as part of
+# the European Union's Horizon 2020 research and innovation programme.
+#
+# @NETFPGA_LICENSE_HEADER_START@
+#
+# Licensed to NetFPGA Open Systems C.I.C. (NetFPGA) under one or more
+# contributor license agreements. See the NOTICE file distributed with this
+# work for additional information regarding copyright ownership. NetFPGA
+# licenses this file to you under the NetFPGA Hardware-Software License,
+# Version 1.0 (the License); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at:
+#
+# http://www.netfpga-cic.org
+#
+# Unless required by applicable law or agreed to in writing, Work distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# @NETFPGA_LICENSE_HEADER_END@
+################################################################################
+#
+#  Description:
+#        Generator settings of osnt-tool-cmd in one versioned JSON file,
+#        read once per invocation and replaced atomically on save. Every
+#        change is appended to a journal next to it, <path>.journal, one
+#        JSON line each. Settings are kept in named profiles, so saved
+#        experiment setups can be switched between. The file also holds
+#        the state a GeneratorSession last applied, for diff-based apply
+#        across invocations.
+#
+#        Only the standard library is imported, so the thin client path of
+#        osnt-tool-cmd stays fast.
+
+import os, json, copy
+from datetime import datetime
+
+CONFIG_VERSION = 1
+CONFIG_PATH = os.environ.get('OSNT_CONFIG', 'osnt_config.json')
+CONFIG_PORTS = ('nf0', 'nf1')
+DEFAULT_PROFILE = 'default'
+
+# settings of a port in a fresh profile
+PORT_SETTINGS = {'pcap' : None,
+                 'pcap_ts' : None,
+                 'replay_cnt' : 0,
+                 'ipg' : 0}
+
+def default_profile():
+    return dict((port, dict(PORT_SETTINGS)) for port in CONFIG_PORTS)
+
+class ConfigStore:
+
+    def __init__(self, path=CONFIG_PATH):
+        self.path = path
+        self.journal_path = path+'.journal'
+        # journal entries not saved yet
+        self.pending = []
+        try:
+            f = open(path)
+            try:
+                data = json.load(f)
+            finally:
+                f.close()
+        except IOError:
+            data = None
+        if data is None:
+            data = {'version':CONFIG_VERSION,
+                    'profile':DEFAULT_PROFILE,
+                    'profiles':{DEFAULT_PROFILE:default_profile()},
+                    'applied':None}
+        elif data.get('version') != CONFIG_VERSION:
+            raise ValueError(path+" has config version "+str(data.get('version'))+", expected "+str(CONFIG_VERSION))
+        self.data = data
+
+    @property
+    def profile(self):
+        return self.data['profile']
+
+    # Settings of the current profile, by port.
+    def settings(self):
+        return self.data['profiles'][self.profile]
+
+    def get(self, port, key):
+        return self.settings()[port][key]
+
+    def set(self, port, key, value):
+        if key not in PORT_SETTINGS:
+            raise ValueError("Unknown port setting "+key)
+        old = self.settings()[port][key]
+        if old != value:
+            self.settings()[port][key] = value
+            self.record('set', port=port, key=key, old=old, new=value)
+
+    # Back to the defaults, for the current profile only.
+    def reset(self):
+        self.data['profiles'][self.profile] = default_profile()
+        self.record('reset')
+
+    def profiles(self):
+        return sorted(self.data['profiles'])
+
+    # Makes name the current profile, starting it as a copy of the current
+    # settings when it does not exist yet.
+    def use_profile(self, name):
+        if name == self.profile:
+            return
+        profiles = self.data['profiles']
+        if name not in profiles:
+            profiles[name] = copy.deepcopy(self.settings())
+            self.record('create', from_profile=self.profile, profile=name)
+        self.data['profile'] = name
+        self.record('use', profile=name)
+
+    def delete_profile(self, name):
+        if name == self.profile:
+            raise ValueError("Cannot delete the current profile "+name)
+        if name not in self.data['profiles']:
+            raise ValueError("No profile "+name)
+        del self.data['profiles'][name]
+        self.record('delete', profile=name)
+
+    # State last applied by a GeneratorSession, see GeneratorSession.state.
+    @property
+    def applied(self):
+        return self.data['applied']
+
+    @applied.setter
+    def applied(self, state):
+        if state != self.data['applied']:
+            self.data['applied'] = state
+            self.record('applied')
+
+    def record(self, op, **fields):
+        entry = {'time':datetime.now().isoformat(), 'op':op}
+        if 'profile' not in fields:
+            entry['profile'] = self.profile
+        entry.update(fields)
+        self.pending.append(entry)
+
+    # Writes the store if anything changed, then appends the journal.
+    def save(self):
+        if not self.pending:
+            return
+        tmp = self.path+'.tmp'+str(os.getpid())
+        f = open(tmp, "w")
+        try:
+            json.dump(self.data, f, indent=1, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+            os.replace(tmp, self.path)
+        except BaseException:
+            f.close()
+            os.unlink(tmp)
+            raise
+        f = open(self.journal_path, "a")
+        for entry in self.pending:
+            f.write(json.dumps(entry, sort_keys=True)+'\n')
+        f.close()
+        self.pending = []
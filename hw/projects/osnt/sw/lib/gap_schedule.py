@@ -0,0 +1,124 @@
+#
+# Copyright (c) 2016-2017 University of Cambridge
+# Copyright (c) 2016-2017 Jong Hun Han
+# Copyright (c) 2022 Gianni Antichi
+# All rights reserved.
+#
+# This software was developed by University of Cambridge Computer Laboratory
+# under the ENDEAVOUR project (grant agreement 644960) as part of
+# the European Union's Horizon 2020 research and innovation programme.
+#
+# @NETFPGA_LICENSE_HEADER_START@
+#
+# Licensed to NetFPGA Open Systems C.I.C. (NetFPGA) under one or more
+# contributor license agreements. See the NOTICE file distributed with this
+# work for additional information regarding copyright ownership. NetFPGA
+# licenses this file to you under the NetFPGA Hardware-Software License,
+# Version 1.0 (the License); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at:
+#
+# http://www.netfpga-cic.org
+#
+# Unless required by applicable law or agreed to in writing, Work distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# @NETFPGA_LICENSE_HEADER_END@
+################################################################################
+#
+#  Description:
+#        Inter-packet gap schedules for timestamp mode. A schedule is a
+#        vector of per-packet gaps drawn with NumPy from a seeded generator,
+#        so the same seed gives the same traffic. The gaps are converted to
+#        datapath ticks the same way trace timestamps are (see
+#        TraceIndex.gap_ticks) and replace the trace's own gaps in the
+#        timestamp frames sent by OSNTGeneratorPcapEngine.load_pcap_ts.
+#
+#        gaps[0] is the gap before the first packet, which is also the gap
+#        taken when the replay wraps around, so it is drawn like any other.
+
+import numpy as np
+from trace_index import trace_index, TS_TICK_MAX
+
+SCHEDULE_KINDS = ('constant', 'poisson', 'onoff', 'pareto', 'empirical')
+
+class GapSchedule:
+
+    def __init__(self, seed=None):
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+
+    # Fixed gap_ns between packets.
+    def constant(self, n, gap_ns):
+        return np.full(n, float(gap_ns))
+
+    # Poisson arrivals at rate_pps: exponential gaps.
+    def poisson(self, n, rate_pps):
+        if rate_pps <= 0:
+            raise ValueError("rate_pps must be positive")
+        return self.rng.exponential(1e9/rate_pps, n)
+
+    # Bursts of geometric length with mean burst_pkts, sent gap_ns apart,
+    # separated by exponential off periods with mean off_ns.
+    def onoff(self, n, burst_pkts, gap_ns, off_ns):
+        if burst_pkts < 1:
+            raise ValueError("burst_pkts must be at least 1")
+        gaps = np.full(n, float(gap_ns))
+        # a packet starts a new burst with probability 1/burst_pkts
+        starts = np.flatnonzero(self.rng.random(n) < 1.0/burst_pkts)
+        gaps[starts] += self.rng.exponential(off_ns, len(starts))
+        return gaps
+
+    # Heavy-tailed Pareto gaps with shape alpha > 1 and mean mean_ns.
+    def pareto(self, n, mean_ns, alpha):
+        if alpha <= 1:
+            raise ValueError("alpha must be above 1 for a finite mean")
+        scale = mean_ns*(alpha - 1)/alpha
+        return scale*(1 + self.rng.pareto(alpha, n))
+
+    # Gaps drawn from the empirical distribution of the gaps of a capture,
+    # by inverse transform with linear interpolation between samples.
+    def empirical(self, n, pcap):
+        ts_ns = trace_index(pcap).ts_ns
+        if len(ts_ns) < 2:
+            raise ValueError(pcap+" has too few packets for a gap distribution")
+        samples = np.sort(np.diff(ts_ns).clip(0)).astype(np.float64)
+        u = self.rng.random(n)*(len(samples) - 1)
+        return np.interp(u, np.arange(len(samples)), samples)
+
+# Gaps in ns to datapath ticks at frequency Hz. Ticks are taken from the
+# cumulative time, so rounding does not accumulate; gaps beyond the 32-bit
+# delay field become TS_TICK_MAX. Returns (ticks, oversized) with ticks a
+# uint32 array.
+def gaps_to_ticks(gaps_ns, frequency):
+    offset = np.cumsum(gaps_ns, dtype=np.float64)
+    ticks = np.floor(offset*(frequency/1e9)).astype(np.int64)
+    gaps = np.empty(len(ticks), dtype=np.int64)
+    if len(ticks):
+        gaps[0] = ticks[0]
+        np.subtract(ticks[1:], ticks[:-1], out=gaps[1:])
+    oversized = int(np.count_nonzero(gaps > TS_TICK_MAX))
+    np.clip(gaps, 0, TS_TICK_MAX, out=gaps)
+    return gaps.astype(np.uint32), oversized
+
+# A tick vector given by the caller as a uint32 array.
+def as_ticks(ticks):
+    ticks = np.asarray(ticks)
+    if len(ticks) and (ticks.min() < 0 or ticks.max() > TS_TICK_MAX):
+        raise ValueError("Gaps must fit the 32-bit delay field")
+    return ticks.astype(np.uint32)
+
+# Ticks for n packets from a schedule spec, a dict naming the kind, the
+# seed and the arguments of the GapSchedule method, e.g.
+# {'kind':'poisson', 'rate_pps':1000000, 'seed':1}.
+def schedule_ticks(spec, n, frequency):
+    spec = dict(spec)
+    kind = spec.pop('kind', None)
+    if kind not in SCHEDULE_KINDS:
+        raise ValueError("Unknown schedule kind "+str(kind))
+    schedule = GapSchedule(spec.pop('seed', None))
+    ticks, oversized = gaps_to_ticks(getattr(schedule, kind)(n, **spec), frequency)
+    if oversized:
+        print('Warning: '+kind+' schedule: clamped '+str(oversized)+' oversized packet gaps')
+    return ticks
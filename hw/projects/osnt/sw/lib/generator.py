@@ -36,27 +36,104 @@
 
 import os, sys, binascii
 from libaxi import *
-from time import sleep
+from pcap_reader import open_trace
+from pkt_tx import open_tx, TX_BATCH_SIZE
+from trace_index import trace_index
+from replay_image import ReplayImage, compile_image
+from bram_planner import CapacityPlanner, GEN_BRAM_CAPACITY
+from rate_table import rate_table
+from rate_calibration import load_calibration
+from gap_schedule import schedule_ticks, as_ticks
+from time import sleep, monotonic
 from scapy import *
 from scapy.all import *
 from math import ceil
+from struct import Struct
 from subprocess import Popen, PIPE
+from concurrent.futures import ThreadPoolExecutor
 
 #TO ADJUST BASED ON HW:
 DATAPATH_FREQUENCY = 250000000
 
-PCAP_ENGINE_BASE_ADDR = "0x12000"
+PCAP_ENGINE_BASE_ADDR = 0x12000
+
+INTER_PKT_DELAY_BASE_ADDR = {"nf0" : 0x13000,
+                             "nf1" : 0x13030}
+
+RATE_LIMITER_BASE_ADDR = {"nf0" : 0x14000,
+                          "nf1" : 0x14024}
+
+DELAY_HEADER_EXTRACTOR_BASE_ADDR = 0x10000
+
+# Control register offsets of each module, served from the libaxi shadow
+# cache when it is on. Counters and status registers are left out so they
+# are always read from the hardware.
+PCAP_ENGINE_CONTROL_OFFSETS = [0x0, 0x4, 0x0C, 0x10] # reset, begin_replay, replay counts
+INTER_PKT_DELAY_CONTROL_OFFSETS = [0x0, 0x4, 0x8, 0xc] # reset, enable, use_reg, delay
+RATE_LIMITER_CONTROL_OFFSETS = [0x0, 0x4, 0x8] # reset, enable, rate
+DELAY_HEADER_EXTRACTOR_CONTROL_OFFSETS = [0x0, 0x4] # reset, enable
+
+def control_registers():
+    addrs = [PCAP_ENGINE_BASE_ADDR + offset for offset in PCAP_ENGINE_CONTROL_OFFSETS]
+    for base in INTER_PKT_DELAY_BASE_ADDR.values():
+        addrs += [base + offset for offset in INTER_PKT_DELAY_CONTROL_OFFSETS]
+    for base in RATE_LIMITER_BASE_ADDR.values():
+        addrs += [base + offset for offset in RATE_LIMITER_CONTROL_OFFSETS]
+    addrs += [DELAY_HEADER_EXTRACTOR_BASE_ADDR + offset for offset in DELAY_HEADER_EXTRACTOR_CONTROL_OFFSETS]
+    return addrs
+
+add_shadow_registers(control_registers())
+
+
+TS_SIGNATURE = b'\xde\xad\xbe\xef\x00\x00\x00\x00'
+# timestamp frame: TS_SIGNATURE then the big endian delay in ticks
+TS_FRAME = Struct('>8sQ')
+TS_DELAY = Struct('>Q')
+
+# Packets sent to load the generator must have left the host before the
+# load-done pulse. Progress is read from the interface tx_packets counter;
+# without it we fall back to a fixed settle time.
+LOAD_TX_TIMEOUT = 5.0
+LOAD_SETTLE_TIME = 1.0
+# tx_packets only counts frames the driver has handed off. In ST0_WR of
+# osnt_bram_pcap_replay_uengine wr_done wins over a valid frame, so frames
+# still on their way to the BRAM when it is pulsed are lost; this margin
+# covers them.
+LOAD_SETTLE_MARGIN = 0.5
+# sw_rst is a level reset with nothing to poll for completion; it is held
+# asserted this long before being released.
+RESET_HOLD_TIME = 0.1
+
+def tx_packets(iface):
+    try:
+        f = open('/sys/class/net/'+iface+'/statistics/tx_packets')
+        value = int(f.read())
+        f.close()
+        return value
+    except (IOError, ValueError):
+        return None
+
+# Builds the timestamp frame sent ahead of every packet in timestamp mode.
+# The frame lives in one preallocated buffer; only the delay is repacked per
+# packet, so the load path creates no per-packet objects for it.
+class TsFrameBuilder:
 
-INTER_PKT_DELAY_BASE_ADDR = {"nf0" : "0x13000",
-                             "nf1" : "0x13030"}
-
-RATE_LIMITER_BASE_ADDR = {"nf0" : "0x14000",
-                          "nf1" : "0x14024"}
-
-DELAY_HEADER_EXTRACTOR_BASE_ADDR = "0x10000"
-
-
-TS_SIGNATURE = '\xde\xad\xbe\xef\x00\x00\x00\x00'
+    def __init__(self):
+        self.buf = bytearray(TS_FRAME.size)
+        TS_FRAME.pack_into(self.buf, 0, TS_SIGNATURE, 0)
+        self.frame = memoryview(self.buf)
+
+    # Yields (timestamp frame, frame) for every (ts_ns, frame) in frames,
+    # with the delays taken from ticks. The timestamp frame is the same
+    # buffer every time and must be sent before the next pair is taken.
+    def pairs(self, frames, ticks):
+        buf = self.buf
+        view = self.frame
+        pack_delay = TS_DELAY.pack_into
+        offset = len(TS_SIGNATURE)
+        for (ts_ns, frame), tick in zip(frames, ticks):
+            pack_delay(buf, offset, tick)
+            yield view, frame
 
 class DelayField(LongField):
 
@@ -89,24 +166,34 @@ class DelayHeader(Packet):
 
 class OSNTDelayHeaderExtractor:
 
-    def __init__(self):
+    def __init__(self, device=None):
+        if device is None:
+            device = get_device()
+        self.device = device
         self.module_base_addr = DELAY_HEADER_EXTRACTOR_BASE_ADDR
 
-        self.reset_reg_offset = "0x0"
-        self.enable_reg_offset = "0x4"
+        self.reset_reg_offset = 0x0
+        self.enable_reg_offset = 0x4
+
+        # absolute register addresses
+        self.reset_reg = self.reg_addr(self.reset_reg_offset)
+        self.enable_reg = self.reg_addr(self.enable_reg_offset)
 
         self.enable = False
         self.reset = False
 
-        self.get_enable()
-        self.get_reset()
+        t = self.device.transaction()
+        t.read(self.enable_reg)
+        t.read(self.reset_reg)
+        enable, reset = t.commit()
+        self.enable = (enable != 0)
+        self.reset = (reset != 0)
 
     def get_status(self):
         return 'OSNTDelayHeaderExtractor: Enable: '+str(self.enable)+' Reset: '+str(self.reset)
 
     def get_reset(self):
-        value = rdaxi(self.reg_addr(self.reset_reg_offset))
-        value = int(value, 16)
+        value = self.device.read(self.reset_reg)
         if value == 0:
             self.reset = False
         else:
@@ -119,12 +206,13 @@ class OSNTDelayHeaderExtractor:
         else:
             value = 0
 
-        wraxi(self.reg_addr(self.reset_reg_offset), hex(value))
-        self.get_reset()
+        t = self.device.transaction()
+        t.write(self.reset_reg, value)
+        t.read(self.reset_reg)
+        self.reset = (t.commit()[1] != 0)
 
     def get_enable(self):
-        value = rdaxi(self.reg_addr(self.enable_reg_offset))
-        value = int(value, 16)
+        value = self.device.read(self.enable_reg)
         if value == 0:
             self.enable = False
         else:
@@ -135,26 +223,56 @@ class OSNTDelayHeaderExtractor:
             value = 1
         else:
             value = 0
-        wraxi(self.reg_addr(self.enable_reg_offset), hex(value))
-        self.get_enable()
+        t = self.device.transaction()
+        t.write(self.enable_reg, value)
+        t.read(self.enable_reg)
+        self.enable = (t.commit()[1] != 0)
 
     def reg_addr(self, offset):
-        return add_hex(self.module_base_addr, offset)
+        return self.module_base_addr + to_int(offset)
 
 class OSNTGeneratorPcapEngine:
 
-    def __init__(self):
+    def __init__(self, device=None):
+        if device is None:
+            device = get_device()
+        self.device = device
+
+        self.reset_reg_offset = 0x0
+        self.begin_replay_reg_offset = 0x4 # simultaneously triggers 2 tx to generate
+        self.replay_cnt_reg_offsets = [0x0C, 0x10]
+        # q0_wr_done/q1_wr_done, pulsed once a port's packets are loaded
+        self.wr_done_reg_offsets = {"nf0" : 0x2C, "nf1" : 0x30}
 
-        self.reset_reg_offset = "0x0"
-        self.begin_replay_reg_offset = "0x4" # simultaneously triggers 2 tx to generate
-        self.replay_cnt_reg_offsets = ["0x0C", "0x10"]
+        self.reset = False
+        self.begin_replay = False
+        self.replay_cnt = [0, 0]
+        # usable memory words per port, see bram_planner.py
+        self.capacity = GEN_BRAM_CAPACITY
+        # replay_cnt is multiplied by these for traces loaded as one period
+        # of a repeating trace
+        self.replay_mult = [1, 1]
+
+        # frames handed to the kernel per send() while loading
+        self.tx_batch_size = TX_BATCH_SIZE
+        # wait between the host sending a port's last frame and wr_done
+        self.settle_margin = LOAD_SETTLE_MARGIN
+        # content hash of the replay image loaded on each port. The card
+        # cannot report what it holds, so this is only known for loads made
+        # through this object and is dropped on every reset.
+        self.resident = {}
 
         # use axi.get_base_addr for better extensibility
         self.module_base_addr = PCAP_ENGINE_BASE_ADDR
+
+        # absolute register addresses
+        self.reset_reg = self.reg_addr(self.reset_reg_offset)
+        self.begin_replay_reg = self.reg_addr(self.begin_replay_reg_offset)
+        self.replay_cnt_regs = [self.reg_addr(offset) for offset in self.replay_cnt_reg_offsets]
+        self.wr_done_regs = dict((iface, self.reg_addr(offset)) for iface, offset in self.wr_done_reg_offsets.items())
         
     def get_reset(self):
-        value = rdaxi(self.reg_addr(self.reset_reg_offset))
-        value = int(value, 16)
+        value = self.device.read(self.reset_reg)
         if value == 0:
             self.reset = False
         else:
@@ -164,25 +282,32 @@ class OSNTGeneratorPcapEngine:
     def set_reset(self, reset):
         if(reset):
             value = 1
+            self.resident = {}
         else:
             value = 0
 
-        wraxi(self.reg_addr(self.reset_reg_offset), hex(value))
-        self.get_reset()
+        t = self.device.transaction()
+        t.write(self.reset_reg, value)
+        t.read(self.reset_reg)
+        self.reset = (t.commit()[1] != 0)
 
+    # Reads back the counts as set_replay_cnt was given them, without the
+    # replay_mult of a period load.
     def get_replay_cnt(self):
+        t = self.device.transaction()
         for i in range(2):
-            replay_cnt = rdaxi(self.reg_addr(self.replay_cnt_reg_offsets[i]))
-            self.replay_cnt[i] = int(replay_cnt, 16)
+            t.read(self.replay_cnt_regs[i])
+        self.replay_cnt = [value//mult for value, mult in zip(t.commit(), self.replay_mult)]
 
     #replay_cnt is an integer array with size 2
     def set_replay_cnt(self, replay_cnt):
+        t = self.device.transaction()
         for i in range(2):
-            wraxi(self.reg_addr(self.replay_cnt_reg_offsets[i]), hex(replay_cnt[i]))
+            t.write(self.replay_cnt_regs[i], min(replay_cnt[i]*self.replay_mult[i], 0xffffffff))
+        t.commit()
 
     def get_begin_replay(self):
-        value = rdaxi(self.reg_addr(self.begin_replay_reg_offset)) # use 0x4 to trigger all ports
-        value = int(value,16)
+        value = self.device.read(self.begin_replay_reg) # use 0x4 to trigger all ports
         if value == 0:
             self.begin_replay = False
         else:
@@ -194,189 +319,328 @@ class OSNTGeneratorPcapEngine:
             value = 1
         else:
             value = 0
-        wraxi(self.reg_addr(self.begin_replay_reg_offset), hex(value))
+        self.device.write(self.begin_replay_reg, value)
 
+    # The engine starts on a rising edge of begin_replay, which may still
+    # be 1 from the last run when nothing was reloaded since, so it is
+    # dropped first in the same batch.
     def run(self):
-        self.set_begin_replay(True)
-        # sleep(0.1)
-        # self.set_begin_replay(False)
+        t = self.device.transaction()
+        t.write(self.begin_replay_reg, 0)
+        t.write(self.begin_replay_reg, 1)
+        t.commit()
+        self.begin_replay = True
 
     def clear(self):
-        # reset
-        self.set_reset(True)
-        self.set_begin_replay(False)
-        self.set_replay_cnt([0, 0])
+        # reset, stop replay and zero the replay counters in one batch
+        t = self.device.transaction()
+        t.write(self.reset_reg, 1)
+        t.read(self.reset_reg)
+        t.write(self.begin_replay_reg, 0)
+        for i in range(2):
+            t.write(self.replay_cnt_regs[i], 0)
+        self.reset = (t.commit()[1] != 0)
+        self.begin_replay = False
+        self.replay_cnt = [0, 0]
+        self.resident = {}
 
-        sleep(0.1)
+        sleep(RESET_HOLD_TIME)
         self.set_reset(False)
 
+    # Waits until the host has handed sent frames to the card, judged by the
+    # interface tx_packets counter, then settle_margin more for them to
+    # reach the generator memory. Falls back to a fixed settle time when
+    # the counter is not available. iface is the host interface.
+    def wait_tx_done(self, iface, tx_start, sent):
+        if tx_start is None:
+            sleep(LOAD_SETTLE_TIME)
+            return
+        count = [0]
+        def done():
+            value = tx_packets(iface)
+            count[0] = None if value is None else value - tx_start
+            return count[0] is None or count[0] >= sent
+        finished = poll_until(done, LOAD_TX_TIMEOUT)
+        if count[0] is None:
+            sleep(LOAD_SETTLE_TIME)
+            return
+        if not finished:
+            print('Warning: '+iface+' sent '+str(count[0])+' of '+str(sent)+' frames before timeout')
+        sleep(self.settle_margin)
+
+    def load_done(self, iface):
+        self.device.pulse(self.wr_done_regs[iface])
+
+    # Loads one port and finishes with its own load-done handshake. Frames
+    # are streamed from the pcap as raw bytes and never dissected, so memory
+    # use is independent of the trace size; the averages come from the
+    # trace index. With ts every packet is preceded by a timestamp frame
+    # carrying its gap to the previous packet. verbose prints a scapy
+    # dissection of every packet, which is slow on large traces. Safe to run
+    # for both ports at once. With ts, schedule replaces the trace's gaps:
+    # a tick vector with one gap per packet or a spec for gap_schedule.py.
+    def load_port(self, iface, pcap, ts=False, verbose=False, schedule=None):
+        start = monotonic()
+        index = trace_index(pcap)
+        if ts and schedule is not None:
+            if isinstance(schedule, dict):
+                ticks = schedule_ticks(schedule, index.count, DATAPATH_FREQUENCY)
+            else:
+                ticks = as_ticks(schedule)
+            if len(ticks) != index.count:
+                raise ValueError(iface+': schedule has '+str(len(ticks))+' gaps for '+str(index.count)+' packets')
+        elif ts:
+            # gap to the previous packet in datapath clock ticks, 1s before
+            # the first
+            ticks, negative, oversized = index.gap_ticks(DATAPATH_FREQUENCY)
+            if negative or oversized:
+                print('Warning: '+pcap+': clamped '+str(negative)+' negative and '+str(oversized)+' oversized packet gaps')
+        host_iface = self.device.port_iface(iface)
+        tx_start = tx_packets(host_iface)
+        tx = open_tx(host_iface, self.tx_batch_size)
+        send = tx.send
+        reader = open_trace(pcap)
+        try:
+            frames = reader
+            if verbose:
+                frames = self.show_frames(frames)
+            if ts:
+                for ts_frame, frame in TsFrameBuilder().pairs(frames, ticks.tolist()):
+                    send(ts_frame)
+                    send(frame)
+            else:
+                for ts_ns, frame in frames:
+                    send(frame)
+        finally:
+            reader.close()
+            tx.close()
+
+        self.wait_tx_done(host_iface, tx_start, tx.sent)
+        self.load_done(iface)
+
+        return {'average_pkt_len':index.mean_len,
+                'average_word_cnt':index.mean_words,
+                'pkts_loaded':index.count,
+                'tx_stats':tx.stats(),
+                'load_time':monotonic() - start}
+
+    def show_frames(self, frames):
+        for ts_ns, frame in frames:
+            print(Ether(bytes(frame)).show(dump=True))
+            yield ts_ns, frame
+
+    # Loads one port from a replay image, sending the frames straight out of
+    # the mapped file.
+    def load_image_port(self, iface, path):
+        start = monotonic()
+        host_iface = self.device.port_iface(iface)
+        tx_start = tx_packets(host_iface)
+        image = ReplayImage(path)
+        tx = open_tx(host_iface, self.tx_batch_size)
+        send = tx.send
+        try:
+            for frame in image.frames():
+                send(frame)
+        finally:
+            tx.close()
+            image.close()
+
+        self.wait_tx_done(host_iface, tx_start, tx.sent)
+        self.load_done(iface)
+
+        result = image.stats()
+        return {'average_pkt_len':result['average_pkt_len'],
+                'average_word_cnt':result['average_word_cnt'],
+                'pkts_loaded':result['pkts'],
+                'tx_stats':tx.stats(),
+                'load_time':monotonic() - start,
+                'content_hash':image.content_hash}
+
+    # Loads every port in pcaps in parallel, one worker per port, with
+    # loader (load_port by default). Returns a dict of per-port dicts
+    # ({'pkts_loaded':{'nf0':..., 'nf1':...}, ...}), including each port's
+    # 'load_time'. The first failing port raises.
+    def load_ports(self, pcaps, ts=False, verbose=False, loader=None):
+        if loader is None:
+            loader = lambda iface, pcap: self.load_port(iface, pcap, ts, verbose)
+        ifaces = ['nf'+str(i) for i in range(2) if 'nf'+str(i) in pcaps]
+        results = {'average_pkt_len':{}, 'average_word_cnt':{}, 'pkts_loaded':{}, 'tx_stats':{}, 'load_time':{}}
+        if not ifaces:
+            return results
+        with ThreadPoolExecutor(max_workers=len(ifaces)) as pool:
+            futures = dict((iface, pool.submit(loader, iface, pcaps[iface])) for iface in ifaces)
+            for iface in ifaces:
+                for key, value in futures[iface].result().items():
+                    results.setdefault(key, {})[iface] = value
+        return results
+
     def load_pcap_only(self, pcaps):
         # reset
         self.set_reset(True)
-        sleep(0.1)
+        sleep(RESET_HOLD_TIME)
         # load packets
-        for iface in pcaps:
-            pkt = rdpcap(pcaps[iface])
-            sendp(pkt, iface=iface, verbose=False)
-
-            sleep(1)
-            if iface == 'nf0':
-                print(iface)
-                wraxi("0x1202C", 0x1)
-                wraxi("0x1202C", 0x0)
-            if iface == 'nf1':
-                print(iface)
-                wraxi("0x12030", 0x1)
-                wraxi("0x12030", 0x0)
-
+        for iface in self.load_ports(pcaps)['pkts_loaded']:
+            print(iface)
 
-    def load_pcap(self, pcaps):
+    def load_pcap(self, pcaps, verbose=False):
         # reset
-        self.set_reset(True)
-        self.set_begin_replay(False)
-        sleep(0.1)
+        t = self.device.transaction()
+        t.write(self.reset_reg, 1)
+        t.write(self.begin_replay_reg, 0)
+        t.commit()
+        self.resident = {}
+        sleep(RESET_HOLD_TIME)
         self.set_reset(False)
 
-        # read packets in
-        pkts = {}
-        pkt_time = {}
-
-        pkts_loaded = {}
-        for i in range(2):
-            iface = 'nf'+str(i)
-            if ('nf'+str(i)) in pcaps:
-                self.begin_replay = True
-                pkts.update({'nf'+str(i): rdpcap(pcaps['nf'+str(i)])})
-                pkts_loaded[iface] = 0
-                for pkt in pkts['nf'+str(i)]:
-                    pkts_loaded[iface] = pkts_loaded[iface] + 1
-
-                pkt_time['nf'+str(i)] = [pkt.time for pkt in pkts['nf'+str(i)]]
-
-        average_pkt_len = {}
-        average_word_cnt = {}
-
-        for iface in pkts:
-            average_pkt_len[iface] = 0
-            average_word_cnt[iface] = 0
-            s = conf.L2socket(iface = iface)
-            for i in range(min(len(pkts[iface]), pkts_loaded[iface])):
-                pkt = pkts[iface][i]
-                average_pkt_len[iface] = average_pkt_len[iface] + len(pkt)
-                average_word_cnt[iface] = average_word_cnt[iface] + ceil(len(pkt)/64.0)
-                print(pkt.show(dump=True))
-                s.send(pkt)
-
-            average_pkt_len[iface] = float(average_pkt_len[iface])/len(pkts[iface])
-            average_word_cnt[iface] = float(average_word_cnt[iface])/len(pkts[iface])
-        
-            sleep(1)
-            if iface == 'nf0':
-                wraxi("0x1202C", 0x1)
-                sleep(0.5)
-                wraxi("0x1202C", 0x0)
-            if iface == 'nf1':
-                wraxi("0x12030", 0x1)
-                sleep(0.5)
-                wraxi("0x12030", 0x0)
-
-        return {'average_pkt_len':average_pkt_len, 'average_word_cnt':average_word_cnt, 'pkts_loaded':pkts_loaded}
-
-    def load_pcap_ts(self, pcaps):
-       # reset
-        self.set_reset(True)
-
-        # read packets in
-        pkts = {}
-        pkt_time = {}
+        words = self.check_capacity(pcaps, False)
+        self.replay_mult = [1, 1]
+        results = self.load_ports(pcaps, False, verbose)
+        results['words'] = words
+        if results['pkts_loaded']:
+            self.begin_replay = True
+        return results
+
+    # schedules optionally maps ports to gap schedules replacing the trace
+    # timestamps, see load_port.
+    def load_pcap_ts(self, pcaps, verbose=False, schedules=None):
+        # reset
+        t = self.device.transaction()
+        t.write(self.reset_reg, 1)
+        t.write(self.begin_replay_reg, 0)
+        t.commit()
         self.begin_replay = False
-
-        self.set_begin_replay()
-
+        self.resident = {}
+        sleep(RESET_HOLD_TIME)
         self.set_reset(False)
 
-        pkts_loaded = {}
-        for i in range(2):
-            iface = 'nf'+str(i)
-            if ('nf'+str(i)) in pcaps:
-                self.begin_replay = True
-                pkts.update({'nf'+str(i): rdpcap(pcaps['nf'+str(i)])})
-                pkts_loaded[iface] = 0
-                for pkt in pkts['nf'+str(i)]:
-                    pkts_loaded[iface] = pkts_loaded[iface] + 1
-
-                pkt_time['nf'+str(i)] = [pkt.time for pkt in pkts['nf'+str(i)]]
+        words = self.check_capacity(pcaps, True)
+        self.replay_mult = [1, 1]
+        loader = None
+        if schedules:
+            loader = lambda iface, pcap: self.load_port(iface, pcap, True, verbose, schedules.get(iface))
+        results = self.load_ports(pcaps, True, verbose, loader)
+        results['words'] = words
+        if results['pkts_loaded']:
+            self.begin_replay = True
+        return results
+
+    # Loads replay images, images mapping ports to image files (see
+    # replay_image.py). When the card already holds exactly these images,
+    # by content hash, nothing is reset or sent and the result has
+    # 'skipped' set; force reloads anyway.
+    def load_image(self, images, force=False):
+        hashes = {}
+        stats = {}
+        for iface in images:
+            with ReplayImage(images[iface]) as image:
+                hashes[iface] = image.content_hash
+                stats[iface] = image.stats()
+        # a load resets both ports, so skipping is only equivalent when the
+        # card holds exactly these images
+        if not force and images and self.resident == hashes:
+            return {'average_pkt_len':dict((iface, stats[iface]['average_pkt_len']) for iface in images),
+                    'average_word_cnt':dict((iface, stats[iface]['average_word_cnt']) for iface in images),
+                    'pkts_loaded':dict((iface, stats[iface]['pkts']) for iface in images),
+                    'tx_stats':{}, 'load_time':{}, 'content_hash':hashes, 'skipped':True}
 
-        average_pkt_len = {}
-        average_word_cnt = {}
-        pkt_time_diff = {} 
+        # reset
+        t = self.device.transaction()
+        t.write(self.reset_reg, 1)
+        t.write(self.begin_replay_reg, 0)
+        t.commit()
+        self.begin_replay = False
+        self.resident = {}
+        sleep(RESET_HOLD_TIME)
+        self.set_reset(False)
 
-        for i in range(2):
-            iface = 'nf'+str(i)
-            if ('nf'+str(i)) in pkt_time:
-                temp_pkt_time_0 = pkt_time[iface]
-                temp_pkt_time_1 = list(range(len(pkt_time[iface]))) 
-                for pkt_no in range(len(pkt_time[iface])):
-                    if (pkt_no != 0):
-                        temp_pkt_time_1[pkt_no] = float(temp_pkt_time_0[pkt_no]) - float(temp_pkt_time_0[pkt_no-1])
-
-                temp_pkt_time_1[0]=1
-                pkt_time_diff[iface]=[int(10**9*ts_value/4.00) for ts_value in temp_pkt_time_1]
-
-        for iface in pkts:
-            average_pkt_len[iface] = 0
-            average_word_cnt[iface] = 0
-            s = conf.L2socket(iface = iface)
-            for i in range(min(len(pkts[iface]), pkts_loaded[iface])):
-                pkt = pkts[iface][i]
-                average_pkt_len[iface] = average_pkt_len[iface] + len(pkt)
-                average_word_cnt[iface] = average_word_cnt[iface] + ceil(len(pkt)/64.0)
-                
-                pkt_stamp= "{0:0{1}x}".format(pkt_time_diff[iface][i],16)
-                ts_pkt_out = TS_SIGNATURE+binascii.unhexlify(pkt_stamp)
-                s.send(Raw(str(ts_pkt_out)))
-                test_pkt_out_2 = Raw(str(pkt))
-                s.send(test_pkt_out_2)
-
-            average_pkt_len[iface] = float(average_pkt_len[iface])/len(pkts[iface])
-            average_word_cnt[iface] = float(average_word_cnt[iface])/len(pkts[iface])
-
-            sleep(1)
-            if iface == 'nf0':
-                wraxi("0x1202C", 0x1)
-                sleep(0.5)
-                wraxi("0x1202C", 0x0)
-            if iface == 'nf1':
-                wraxi("0x12030", 0x1)
-                sleep(0.5)
-                wraxi("0x12030", 0x0)
-
-        return {'average_pkt_len':average_pkt_len, 'average_word_cnt':average_word_cnt, 'pkts_loaded':pkts_loaded}
+        results = self.load_ports(images, loader=self.load_image_port)
+        self.resident = dict(results.get('content_hash', {}))
+        results['skipped'] = False
+        if results['pkts_loaded']:
+            self.begin_replay = True
+        return results
+
+    # Compiles the pcaps into replay images (reusing up to date ones) and
+    # loads those.
+    def load_pcap_image(self, pcaps, ts=False, force=False):
+        images = dict((iface, compile_image(pcaps[iface], ts=ts, frequency=DATAPATH_FREQUENCY)) for iface in pcaps)
+        self.replay_mult = [1, 1]
+        return self.load_image(images, force)
+
+    # Returns the memory words every trace in pcaps takes and warns about
+    # those the generator would wrap around.
+    def check_capacity(self, pcaps, ts=False):
+        planner = CapacityPlanner(self.capacity)
+        words = {}
+        for iface in pcaps:
+            words[iface] = planner.footprint(pcaps[iface], ts)
+            if words[iface] > self.capacity:
+                print('Warning: '+iface+': '+pcaps[iface]+' needs '+str(words[iface])+' memory words, only '+
+                      str(self.capacity)+' fit; the replay will be corrupted. Use load_pcap_planned to fit it.')
+        return words
+
+    # Fits every trace to the generator memory with bram_planner (strategy
+    # truncate, sample or period; None picks one) and loads the result as a
+    # replay image. Reduced traces are written next to the originals. A
+    # period plan multiplies later set_replay_cnt values so the whole trace
+    # is replayed.
+    def load_pcap_planned(self, pcaps, ts=False, strategy=None, force=False):
+        planner = CapacityPlanner(self.capacity)
+        images = {}
+        plans = {}
+        mult = [1, 1]
+        for iface in pcaps:
+            plan = planner.plan(pcaps[iface], ts, strategy, DATAPATH_FREQUENCY)
+            if plan is None:
+                raise ValueError(pcaps[iface]+": no repeating period")
+            pcap = pcaps[iface]
+            if plan.strategy != 'whole':
+                pcap = plan.write(pcaps[iface]+'.'+plan.strategy+'.pcap')
+            first_gap_ns = plan.first_gap_ns if plan.first_gap_ns is not None else 1000000000
+            images[iface] = compile_image(pcap, ts=ts, frequency=DATAPATH_FREQUENCY, first_gap_ns=first_gap_ns)
+            plans[iface] = plan.stats()
+            mult[int(iface[2:])] = plan.replay_mult
+        results = self.load_image(images, force)
+        self.replay_mult = mult
+        results['plan'] = plans
+        return results
 
     def reg_addr(self, offset):
-        return add_hex(self.module_base_addr, offset)
+        return self.module_base_addr + to_int(offset)
 
 class OSNTRateLimiter:
 
-    def __init__(self, iface):
+    def __init__(self, iface, device=None):
+        if device is None:
+            device = get_device()
+        self.device = device
         self.iface = iface
         self.module_base_addr = RATE_LIMITER_BASE_ADDR[iface]
-        self.rate_reg_offset = "0x8"
-        self.reset_reg_offset = "0x0"
-        self.enable_reg_offset = "0x4"
+        self.rate_reg_offset = 0x8
+        self.reset_reg_offset = 0x0
+        self.enable_reg_offset = 0x4
+
+        # absolute register addresses
+        self.rate_reg = self.reg_addr(self.rate_reg_offset)
+        self.reset_reg = self.reg_addr(self.reset_reg_offset)
+        self.enable_reg = self.reg_addr(self.enable_reg_offset)
 
         self.rate = 0
         self.enable = False
         self.reset = False
 
-        self.get_rate()
-        self.get_enable()
-        self.get_reset()
+        t = self.device.transaction()
+        t.read(self.rate_reg)
+        t.read(self.enable_reg)
+        t.read(self.reset_reg)
+        rate, enable, reset = t.commit()
+        self.rate = rate
+        self.enable = (enable != 0)
+        self.reset = (reset != 0)
 
     # rate is stored as an integer value
     def get_rate(self):
-        rate = rdaxi(self.reg_addr(self.rate_reg_offset))
-        self.rate = int(rate, 16)
+        self.rate = self.device.read(self.rate_reg)
 
     def to_string(self, average_pkt_len, average_word_cnt):
         #average_pkt_len + 4 -> 4 is 4B FCS
@@ -399,14 +663,59 @@ class OSNTRateLimiter:
         else:
             return '{0:.2f}'.format(rate)+'bps '+percentage
 
+    # Rate of the current setting for the trace at pcap, from its index.
+    def trace_to_string(self, pcap):
+        index = trace_index(pcap)
+        return self.to_string(index.mean_len, index.mean_words)
+
+    # Sets the limiter for a target rate in gbps or pps on a trace, given
+    # as a pcap path, a TraceIndex or a dict with average_pkt_len. With
+    # delay, the OSNTDelay of this port, the inter-packet delay register is
+    # used for finer steps; this replaces the trace timestamps with a fixed
+    # gap. A pcap path uses its stored calibration, see rate_calibration.py.
+    # Returns the setting, the achieved rate and its relative error.
+    def set_target_rate(self, gbps=None, pps=None, trace_stats=None, delay=None):
+        result = self.target_setting(gbps, pps, trace_stats, fine=delay is not None)
+        self.apply_setting(result['shift'], result['delay_ticks'], delay)
+        return result
+
+    # The setting set_target_rate would apply, without touching the
+    # registers; fine allows the inter-packet delay.
+    def target_setting(self, gbps=None, pps=None, trace_stats=None, fine=False):
+        if trace_stats is None:
+            raise ValueError("trace_stats is needed to compute the rate of a trace")
+        table = rate_table(trace_stats, DATAPATH_FREQUENCY)
+        bps = gbps*1e9 if gbps is not None else None
+        if isinstance(trace_stats, str):
+            calibration = load_calibration(trace_stats, DATAPATH_FREQUENCY)
+            return calibration.lookup(table, self.iface, pps=pps, bps=bps, fine=fine)
+        return table.lookup(pps=pps, bps=bps, fine=fine)
+
+    # Applies a rate setting: shift None disables the limiter, and with
+    # delay given a delay_ticks of 0 disables the inter-packet delay.
+    def apply_setting(self, shift, delay_ticks=0, delay=None):
+        if shift is None:
+            self.set_enable(False)
+        else:
+            self.set_rate(shift)
+            self.set_enable(True)
+        if delay is not None:
+            if delay_ticks:
+                delay.set_delay_ticks(delay_ticks)
+                delay.set_use_reg(True)
+                delay.set_enable(True)
+            else:
+                delay.set_enable(False)
+
     # rate is an interger value
     def set_rate(self, rate):
-        wraxi(self.reg_addr(self.rate_reg_offset), hex(rate))
-        self.get_rate()
+        t = self.device.transaction()
+        t.write(self.rate_reg, rate)
+        t.read(self.rate_reg)
+        self.rate = t.commit()[1]
 
     def get_enable(self):
-        value = rdaxi(self.reg_addr(self.enable_reg_offset))
-        value = int(value, 16)
+        value = self.device.read(self.enable_reg)
         if value == 0:
             self.enable = False
         else:
@@ -417,12 +726,13 @@ class OSNTRateLimiter:
             value = 1
         else:
             value = 0
-        wraxi(self.reg_addr(self.enable_reg_offset), hex(value))
-        self.get_enable()
+        t = self.device.transaction()
+        t.write(self.enable_reg, value)
+        t.read(self.enable_reg)
+        self.enable = (t.commit()[1] != 0)
 
     def get_reset(self):
-        value = rdaxi(self.reg_addr(self.reset_reg_offset))
-        value = int(value, 16)
+        value = self.device.read(self.reset_reg)
         if value == 0:
             self.reset = False;
         else:
@@ -433,26 +743,43 @@ class OSNTRateLimiter:
             value = 1
         else:
             value = 0
-        wraxi(self.reg_addr(self.reset_reg_offset), hex(value))
-        self.get_reset()
-        self.set_rate(0)
-        self.set_enable(False)
+        # reset, rate and enable are written and read back in one batch
+        t = self.device.transaction()
+        t.write(self.reset_reg, value)
+        t.read(self.reset_reg)
+        t.write(self.rate_reg, 0)
+        t.read(self.rate_reg)
+        t.write(self.enable_reg, 0)
+        t.read(self.enable_reg)
+        results = t.commit()
+        self.reset = (results[1] != 0)
+        self.rate = results[3]
+        self.enable = (results[5] != 0)
 
     def reg_addr(self, offset):
-        return add_hex(self.module_base_addr, offset)
+        return self.module_base_addr + to_int(offset)
 
     def print_status(self):
         print('iface: '+self.iface+' rate: '+str(self.rate)+' enable: '+str(self.enable)+' reset: '+str(self.reset))
 
 class OSNTDelay:
 
-    def __init__(self, iface):
+    def __init__(self, iface, device=None):
+        if device is None:
+            device = get_device()
+        self.device = device
         self.iface = iface
         self.module_base_addr = INTER_PKT_DELAY_BASE_ADDR[iface]
-        self.delay_reg_offset = "0xc"
-        self.reset_reg_offset = "0x0"
-        self.enable_reg_offset = "0x4"
-        self.use_reg_reg_offset = "0x8"
+        self.delay_reg_offset = 0xc
+        self.reset_reg_offset = 0x0
+        self.enable_reg_offset = 0x4
+        self.use_reg_reg_offset = 0x8
+
+        # absolute register addresses
+        self.delay_reg = self.reg_addr(self.delay_reg_offset)
+        self.reset_reg = self.reg_addr(self.reset_reg_offset)
+        self.enable_reg = self.reg_addr(self.enable_reg_offset)
+        self.use_reg_reg = self.reg_addr(self.use_reg_reg_offset)
 
         self.enable = False
         self.use_reg = False
@@ -460,14 +787,19 @@ class OSNTDelay:
         self.delay = 0
         self.reset = False
 
-        self.get_enable()
-        self.get_use_reg()
-        self.get_delay()
-        self.get_reset()
+        t = self.device.transaction()
+        t.read(self.enable_reg)
+        t.read(self.use_reg_reg)
+        t.read(self.delay_reg)
+        t.read(self.reset_reg)
+        enable, use_reg, delay, reset = t.commit()
+        self.enable = (enable != 0)
+        self.use_reg = (use_reg != 0)
+        self.delay = delay
+        self.reset = (reset != 0)
 
     def get_enable(self):
-        value = rdaxi(self.reg_addr(self.enable_reg_offset))
-        value = int(value, 16)
+        value = self.device.read(self.enable_reg)
         if value == 0:
             self.enable = False;
         else:
@@ -478,12 +810,13 @@ class OSNTDelay:
             value = 1
         else:
             value = 0
-        wraxi(self.reg_addr(self.enable_reg_offset), hex(value))
-        self.get_enable()
+        t = self.device.transaction()
+        t.write(self.enable_reg, value)
+        t.read(self.enable_reg)
+        self.enable = (t.commit()[1] != 0)
 
     def get_use_reg(self):
-        value = rdaxi(self.reg_addr(self.use_reg_reg_offset))
-        value = int(value, 16)
+        value = self.device.read(self.use_reg_reg)
         if value == 0:
             self.use_reg = False;
         else:
@@ -494,24 +827,28 @@ class OSNTDelay:
             value = 1
         else:
             value = 0
-        wraxi(self.reg_addr(self.use_reg_reg_offset), hex(value))
-        self.get_use_reg()
+        t = self.device.transaction()
+        t.write(self.use_reg_reg, value)
+        t.read(self.use_reg_reg)
+        self.use_reg = (t.commit()[1] != 0)
 
     def get_delay(self):
-        delay = rdaxi(self.reg_addr(self.delay_reg_offset))
-        self.delay = int(delay, 16)
+        self.delay = self.device.read(self.delay_reg)
 
     def to_string(self):
         return '{:,}'.format(int(self.delay*1000000000/DATAPATH_FREQUENCY))+'ns'
 
     # delay is an interger value
     def set_delay(self, delay):
-        wraxi(self.reg_addr(self.delay_reg_offset), hex(delay*DATAPATH_FREQUENCY//1000000000))
-        self.delay = delay*DATAPATH_FREQUENCY//1000000000
+        self.set_delay_ticks(delay*DATAPATH_FREQUENCY//1000000000)
+
+    # ticks is the delay in datapath clock ticks
+    def set_delay_ticks(self, ticks):
+        self.device.write(self.delay_reg, ticks)
+        self.delay = ticks
 
     def get_reset(self):
-        value = rdaxi(self.reg_addr(self.reset_reg_offset))
-        value = int(value, 16)
+        value = self.device.read(self.reset_reg)
         if value == 0:
             self.reset = False
         else:
@@ -522,18 +859,25 @@ class OSNTDelay:
             value = 1
         else:
             value = 0
-        wraxi(self.reg_addr(self.reset_reg_offset), hex(value))
+        self.device.write(self.reset_reg, value)
 
     def clear(self):
-        self.set_reset(True)
-        self.set_enable(False)
-        self.set_delay(0)
-        self.set_use_reg(False)
-        sleep(0.1)
+        t = self.device.transaction()
+        t.write(self.reset_reg, 1)
+        t.write(self.enable_reg, 0)
+        t.read(self.enable_reg)
+        t.write(self.delay_reg, 0)
+        t.write(self.use_reg_reg, 0)
+        t.read(self.use_reg_reg)
+        results = t.commit()
+        self.enable = (results[2] != 0)
+        self.delay = 0
+        self.use_reg = (results[5] != 0)
+        sleep(RESET_HOLD_TIME)
         self.set_reset(False)
 
     def reg_addr(self, offset):
-        return add_hex(self.module_base_addr, offset)
+        return self.module_base_addr + to_int(offset)
 
     def print_status(self):
         print('iface: '+self.iface+' delay: '+str(self.delay)+' enable: '+str(self.enable)+' reset: '+str(self.reset)+' use_reg: '+str(self.use_reg))
@@ -544,7 +888,6 @@ if __name__=="__main__":
     print("begin")
     rateLimiters = {}
     delays = {}
-    poissonEngines = {}
     pcaps = {}
     
     pcaps = {'nf0' : 'nf0.cap'#,
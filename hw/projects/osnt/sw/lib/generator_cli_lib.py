@@ -30,6 +30,7 @@
 import os, argparse, datetime, subprocess
 from libaxi import *
 from generator import *
+from rate_calibration import RateCalibrator, iface_counters
 
 #TARGET_BASE_ADDR = "0x79000000" # TO UPDATE (10g_axi_if)
 
@@ -46,7 +47,10 @@ from generator import *
 #INDI_ACC_TRIG_MASK = "0x00000001"
 
 class InitGCli:
-    def __init__(self):
+    def __init__(self, device=None):
+        if device is None:
+            device = get_device()
+        self.device = device
         self.average_pkt_len = {'nf0':1500, 'nf1':1500}
         #check 47.
         self.average_word_cnt = {'nf0':47, 'nf1':47}
@@ -66,11 +70,11 @@ class InitGCli:
         
         for i in range(2):
             iface = 'nf' + str(i)
-            self.rate_limiters[i] = OSNTRateLimiter(iface)
-            self.delays[i] = OSNTDelay(iface)
+            self.rate_limiters[i] = OSNTRateLimiter(iface, device)
+            self.delays[i] = OSNTDelay(iface, device)
     
-        self.pcap_engine = OSNTGeneratorPcapEngine()
-        self.delay_header_extractor = OSNTDelayHeaderExtractor()
+        self.pcap_engine = OSNTGeneratorPcapEngine(device)
+        self.delay_header_extractor = OSNTDelayHeaderExtractor(device)
     
         self.delay_header_extractor.set_reset(False)
         self.delay_header_extractor.set_enable(False)
@@ -101,6 +105,13 @@ def clear():
 #def if_indi_config():
 #    wraxi(add_hex(TARGET_BASE_ADDR, TIMESTAMP_TBL_OFFSET_CONFIG), TIMESTAMP_TBL_ACCESS_CONFIG) # config
 
+# Keeps the per-port averages used for rate reporting in step with the
+# loaded traces.
+def update_trace_stats(result):
+    initgcli.average_pkt_len.update(result['average_pkt_len'])
+    initgcli.average_word_cnt.update(result['average_word_cnt'])
+    initgcli.pkts_loaded.update(result['pkts_loaded'])
+
 def set_load_pcap(mypcaps):
     print("  ")
     print("[CLI: Loading Pcap File..]")    
@@ -108,15 +119,18 @@ def set_load_pcap(mypcaps):
         print((key, value))
     initgcli.pcaps = mypcaps
     result = initgcli.pcap_engine.load_pcap(initgcli.pcaps)
+    update_trace_stats(result)
     print(result)
 
-def set_load_pcap_ts(mypcaps):
+# schedules optionally maps ports to gap schedule specs, see gap_schedule.py
+def set_load_pcap_ts(mypcaps, schedules=None):
     print("  ")
     print("[CLI: Loading Pcap File with Timestamp..]")    
     for key, value in list(mypcaps.items()):
         print((key, value))
     initgcli.pcaps = mypcaps
-    result = initgcli.pcap_engine.load_pcap_ts(initgcli.pcaps)
+    result = initgcli.pcap_engine.load_pcap_ts(initgcli.pcaps, schedules=schedules)
+    update_trace_stats(result)
     print(result)
 
 def set_load_pcap_only(pcap_file):
@@ -152,6 +166,35 @@ def set_ipg_ts(interface, value):
    initgcli.delays[interface].set_enable(True)
    initgcli.delays[interface].set_use_reg(False)
 
+def set_target_rate(interface, gbps=None, pps=None, fine=False):
+    print("  ")
+    print("[CLI: Target rate setting... " + "nf" + str(interface) + ", " + (str(gbps)+"Gbps" if gbps is not None else str(pps)+"pps") + "]")
+    iface = "nf" + str(interface)
+    delay = initgcli.delays[interface] if fine else None
+    if iface in initgcli.pcaps:
+        trace_stats = initgcli.pcaps[iface]
+    else:
+        trace_stats = {'average_pkt_len': initgcli.average_pkt_len[iface]}
+    result = initgcli.rate_limiters[interface].set_target_rate(gbps=gbps, pps=pps, trace_stats=trace_stats, delay=delay)
+    print(result)
+    return result
+
+# Calibrates nf<interface> for a target rate on its loaded trace, reading
+# the counters of counter_iface; direction 'rx' for a looped-back port.
+def calibrate_rate(interface, counter_iface, gbps=None, pps=None, fine=False, direction='rx'):
+    print("  ")
+    print("[CLI: Rate calibration... " + "nf" + str(interface) + ", " + (str(gbps)+"Gbps" if gbps is not None else str(pps)+"pps") + ", counters " + counter_iface + "]")
+    iface = "nf" + str(interface)
+    if iface not in initgcli.pcaps:
+        raise ValueError("No trace loaded on "+iface)
+    calibrator = RateCalibrator(initgcli.pcap_engine, initgcli.rate_limiters[interface], initgcli.delays[interface],
+                                iface_counters(counter_iface, direction), DATAPATH_FREQUENCY)
+    result = calibrator.calibrate(initgcli.pcaps[iface], gbps=gbps, pps=pps, fine=fine)
+    for r in result['rounds']:
+        print("  shift: " + str(r['shift']) + " delay: " + str(r['delay_ticks']) + " measured: %.0fpps" % r['measured_pps'])
+    print("achieved: %.3fGbps error: %.2f%% converged: %s" % (result['achieved_bps']/1e9, result['error']*100, result['converged']))
+    return result
+
 def set_replay_cnt(values):
     print("  ")
     print("[CLI: Packet Replay counter setting ...]")    
@@ -0,0 +1,82 @@
+#
+# Copyright (c) 2016-2017 University of Cambridge
+# Copyright (c) 2016-2017 Jong Hun Han
+# Copyright (c) 2022 Gianni Antichi
+# All rights reserved.
+#
+# This software was developed by University of Cambridge Computer Laboratory
+# under the ENDEAVOUR project (grant agreement 644960) as part of
+# the European Union's Horizon 2020 research and innovation programme.
+#
+# @NETFPGA_LICENSE_HEADER_START@
+#
+# Licensed to NetFPGA Open Systems C.I.C. (NetFPGA) under one or more
+# contributor license agreements. See the NOTICE file distributed with this
+# work for additional information regarding copyright ownership. NetFPGA
+# licenses this file to you under the NetFPGA Hardware-Software License,
+# Version 1.0 (the License); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at:
+#
+# http://www.netfpga-cic.org
+#
+# Unless required by applicable law or agreed to in writing, Work distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# @NETFPGA_LICENSE_HEADER_END@
+################################################################################
+#
+#  Description:
+#        Client of the generator daemon (generator_daemon.py). Requests and
+#        replies are single JSON lines over a Unix domain socket. Only the
+#        standard library is imported, so a client starts in milliseconds;
+#        the generator modules and scapy are loaded by the daemon alone.
+
+import os, json, socket
+
+# The daemon runs as root and loads the traces clients name, so the socket
+# lives in a root-owned directory rather than /tmp.
+DAEMON_SOCKET = os.environ.get('OSNT_GEN_SOCKET', '/run/osnt/generator.sock')
+DAEMON_TIMEOUT = 600.0
+
+class DaemonError(Exception):
+    pass
+
+class GeneratorClient:
+
+    def __init__(self, path=DAEMON_SOCKET, timeout=DAEMON_TIMEOUT):
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(path)
+        except OSError:
+            self.sock.close()
+            raise
+        self.f = self.sock.makefile('rb')
+
+    # Sends cmd with keyword arguments and returns the daemon's result;
+    # a failure in the daemon raises DaemonError with its message.
+    def call(self, cmd, **args):
+        self.sock.sendall(json.dumps({'cmd':cmd, 'args':args}).encode()+b'\n')
+        line = self.f.readline()
+        if not line:
+            raise DaemonError("Generator daemon closed the connection")
+        reply = json.loads(line)
+        if not reply['ok']:
+            raise DaemonError(reply['error'])
+        return reply['result']
+
+    def close(self):
+        self.f.close()
+        self.sock.close()
+
+# A client of the daemon at path, or None when no daemon is listening.
+def connect_daemon(path=DAEMON_SOCKET, timeout=DAEMON_TIMEOUT):
+    if not os.path.exists(path):
+        return None
+    try:
+        return GeneratorClient(path, timeout)
+    except OSError:
+        return None
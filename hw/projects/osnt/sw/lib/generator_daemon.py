@@ -0,0 +1,175 @@
+#
+# Copyright (c) 2016-2017 University of Cambridge
+# Copyright (c) 2016-2017 Jong Hun Han
+# Copyright (c) 2022 Gianni Antichi
+# All rights reserved.
+#
+# This software was developed by University of Cambridge Computer Laboratory
+# under the ENDEAVOUR project (grant agreement 644960) as part of
+# the European Union's Horizon 2020 research and innovation programme.
+#
+# @NETFPGA_LICENSE_HEADER_START@
+#
+# Licensed to NetFPGA Open Systems C.I.C. (NetFPGA) under one or more
+# contributor license agreements. See the NOTICE file distributed with this
+# work for additional information regarding copyright ownership. NetFPGA
+# licenses this file to you under the NetFPGA Hardware-Software License,
+# Version 1.0 (the License); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at:
+#
+# http://www.netfpga-cic.org
+#
+# Unless required by applicable law or agreed to in writing, Work distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# @NETFPGA_LICENSE_HEADER_END@
+################################################################################
+#
+#  Description:
+#        Long-lived generator control daemon. It holds the register
+#        backend, the generator objects and a GeneratorSession, so commands
+#        from osnt-tool-cmd skip the imports, the module setup reads and
+#        the trace reloads a fresh process would do. Clients talk to it
+#        through generator_client.py.
+#
+#        Run it with: python3 generator_daemon.py [-socket <path>]
+#        The socket defaults to OSNT_GEN_SOCKET or /run/osnt/generator.sock.
+#        A missing directory is created private to the daemon's user and
+#        the socket is only accessible to that user unless -mode says
+#        otherwise (e.g. 0660 for a group).
+
+import os, sys, stat, json, socket, argparse, threading, socketserver
+from libaxi import *
+from generator import *
+from generator_session import GeneratorSession
+from generator_client import DAEMON_SOCKET
+
+DAEMON_SOCKET_MODE = 0o600
+
+# numpy scalars and other values json cannot encode
+def json_default(value):
+    if hasattr(value, 'item'):
+        return value.item()
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return str(value)
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                result = self.server.daemon.call(request['cmd'], request.get('args', {}))
+                reply = {'ok':True, 'result':result}
+            except Exception as e:
+                reply = {'ok':False, 'error':type(e).__name__+': '+str(e)}
+            self.wfile.write(json.dumps(reply, default=json_default).encode()+b'\n')
+            self.wfile.flush()
+
+class GeneratorDaemon:
+
+    def __init__(self, path=DAEMON_SOCKET, device=None, mode=DAEMON_SOCKET_MODE):
+        self.path = path
+        self.mode = mode
+        self.session = GeneratorSession(device)
+        # as InitGCli does, once for the daemon's lifetime
+        extractor = OSNTDelayHeaderExtractor(self.session.device)
+        extractor.set_reset(False)
+        extractor.set_enable(False)
+        self.commands = {'ping':self.ping,
+                         'apply':self.apply,
+                         'run':self.run,
+                         'stop':self.stop,
+                         'clear':self.clear,
+                         'forget':self.forget,
+                         'status':self.status,
+                         'shutdown':self.shutdown}
+        self.server = None
+
+    def call(self, cmd, args):
+        if cmd not in self.commands:
+            raise ValueError("Unknown command "+str(cmd))
+        return self.commands[cmd](**args)
+
+    def ping(self):
+        return {'pid':os.getpid()}
+
+    def apply(self, config):
+        return self.session.apply(config)
+
+    def run(self):
+        self.session.run()
+        return {}
+
+    def stop(self):
+        self.session.stop()
+        return {}
+
+    def clear(self):
+        self.session.engine.clear()
+        self.session.forget()
+        return {}
+
+    def forget(self):
+        self.session.forget()
+        return {}
+
+    def status(self):
+        session = self.session
+        return {'config':session.config,
+                'loads':session.loads,
+                'rates':session.rates,
+                'replay_cnt':session.engine.replay_cnt}
+
+    def shutdown(self):
+        # serve_forever runs in this thread, so stop it from another one
+        threading.Thread(target=self.server.shutdown).start()
+        return {}
+
+    # Serves until shutdown. A socket left by a daemon that died is
+    # replaced; one with a daemon behind it, or any other file at the path,
+    # is an error.
+    def serve(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        if os.path.lexists(self.path):
+            if not stat.S_ISSOCK(os.lstat(self.path).st_mode):
+                raise RuntimeError(self.path+" exists and is not a socket")
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+                probe.close()
+                raise RuntimeError("A generator daemon is already listening on "+self.path)
+            except OSError:
+                probe.close()
+                os.unlink(self.path)
+        # no one else may connect between bind and chmod
+        umask = os.umask(0o177)
+        try:
+            self.server = socketserver.UnixStreamServer(self.path, DaemonHandler)
+        finally:
+            os.umask(umask)
+        os.chmod(self.path, self.mode)
+        self.server.daemon = self
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            os.unlink(self.path)
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-socket", type=str, default=DAEMON_SOCKET, help="Unix socket to listen on. eg. -socket <path>")
+    parser.add_argument("-mode", type=lambda value: int(value, 8), default=DAEMON_SOCKET_MODE, help="Socket permissions in octal. eg. -mode 0660")
+    args = parser.parse_args()
+    daemon = GeneratorDaemon(args.socket, mode=args.mode)
+    print("[Generator daemon listening on "+args.socket+"]")
+    sys.stdout.flush()
+    try:
+        daemon.serve()
+    except KeyboardInterrupt:
+        pass
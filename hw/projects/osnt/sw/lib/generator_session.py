@@ -0,0 +1,240 @@
+#
+# Copyright (c) 2016-2017 University of Cambridge
+# Copyright (c) 2016-2017 Jong Hun Han
+# Copyright (c) 2022 Gianni Antichi
+# All rights reserved.
+#
+# This software was developed by University of Cambridge Computer Laboratory
+# under the ENDEAVOUR project (grant agreement 644960) as part of
+# the European Union's Horizon 2020 research and innovation programme.
+#
+# @NETFPGA_LICENSE_HEADER_START@
+#
+# Licensed to NetFPGA Open Systems C.I.C. (NetFPGA) under one or more
+# contributor license agreements. See the NOTICE file distributed with this
+# work for additional information regarding copyright ownership. NetFPGA
+# licenses this file to you under the NetFPGA Hardware-Software License,
+# Version 1.0 (the License); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at:
+#
+# http://www.netfpga-cic.org
+#
+# Unless required by applicable law or agreed to in writing, Work distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# @NETFPGA_LICENSE_HEADER_END@
+################################################################################
+#
+#  Description:
+#        Declarative generator configuration. A GeneratorSession takes the
+#        wanted per-port settings, works out the register values and trace
+#        loads they need, and applies only what differs from the state it
+#        applied last, with all register writes in one batch. In a sweep
+#        where only the rate changes, a step costs a few register writes.
+#
+#        A config maps ports to settings, every one optional:
+#            {'nf0' : {'pcap' : 'a.pcap', 'replay_cnt' : 10, 'rate_gbps' : 25}}
+#        pcap       trace to load, None for none
+#        ts         replay with the trace timestamps
+#        schedule   gap schedule spec replacing them, see gap_schedule.py
+#        replay_cnt times the trace is replayed
+#        ipg        fixed inter-packet gap in ns, or the delay with ts
+#        rate_gbps, rate_pps
+#                   target rate, see OSNTRateLimiter.set_target_rate
+#        rate_fine  use the inter-packet delay to get closer to the target
+#        rate_shift raw rate limiter setting instead of a target
+#
+#        The session only knows what it wrote itself, or what restore() told
+#        it; changes made to the card behind its back are not seen until
+#        forget() is called.
+
+from generator import *
+
+SESSION_PORTS = ('nf0', 'nf1')
+
+PORT_DEFAULTS = {'pcap' : None,
+                 'ts' : False,
+                 'schedule' : None,
+                 'replay_cnt' : 0,
+                 'ipg' : None,
+                 'rate_gbps' : None,
+                 'rate_pps' : None,
+                 'rate_fine' : False,
+                 'rate_shift' : None}
+
+# Port settings with the defaults filled in.
+def port_config(settings):
+    unknown = set(settings) - set(PORT_DEFAULTS)
+    if unknown:
+        raise ValueError("Unknown port settings: "+', '.join(sorted(unknown)))
+    port = dict(PORT_DEFAULTS)
+    port.update(settings)
+    return port
+
+class GeneratorSession:
+
+    def __init__(self, device=None):
+        if device is None:
+            device = get_device()
+        self.device = device
+        self.engine = OSNTGeneratorPcapEngine(device)
+        self.rate_limiters = dict((iface, OSNTRateLimiter(iface, device)) for iface in SESSION_PORTS)
+        self.delays = dict((iface, OSNTDelay(iface, device)) for iface in SESSION_PORTS)
+        self.config = {}
+        # last applied trace loads by port and register values by address;
+        # empty until the first apply, which then writes everything
+        self.loads = None
+        self.registers = {}
+        # rate lookups of the last apply, by port
+        self.rates = {}
+
+    # Trace loads wanted by config, by port, with the identity of each
+    # trace file.
+    def target_loads(self, config):
+        loads = {}
+        for iface in SESSION_PORTS:
+            port = port_config(config.get(iface, {}))
+            if port['schedule'] is not None and not port['ts']:
+                raise ValueError(iface+": a schedule needs ts")
+            if port['pcap'] is not None:
+                # a trace rewritten at the same path must be loaded again
+                index = trace_index(port['pcap'])
+                loads[iface] = {'pcap':port['pcap'], 'ts':bool(port['ts']), 'schedule':port['schedule'],
+                                'trace':[index.size, index.mtime_ns, index.digest]}
+        return loads
+
+    # Register values wanted by config, in write order, and the rate
+    # lookups made for it. Replay counts depend on the loaded traces, so
+    # this follows any load.
+    def target_registers(self, config):
+        registers = {}
+        rates = {}
+        for i, iface in enumerate(SESSION_PORTS):
+            port = port_config(config.get(iface, {}))
+            limiter = self.rate_limiters[iface]
+            delay = self.delays[iface]
+            shift = None
+            ticks = None
+            use_reg = not port['ts']
+            if port['ipg'] is not None:
+                ticks = port['ipg']*DATAPATH_FREQUENCY//1000000000
+            elif port['ts']:
+                ticks = 0
+
+            if port['rate_shift'] is not None:
+                shift = port['rate_shift']
+            elif port['rate_gbps'] is not None or port['rate_pps'] is not None:
+                if port['pcap'] is None:
+                    raise ValueError(iface+": a target rate needs a pcap")
+                if port['rate_fine'] and ticks is not None:
+                    raise ValueError(iface+": rate_fine sets the inter-packet delay, which ipg or ts already use")
+                rates[iface] = limiter.target_setting(port['rate_gbps'], port['rate_pps'], port['pcap'], port['rate_fine'])
+                shift = rates[iface]['shift']
+                if port['rate_fine'] and rates[iface]['delay_ticks']:
+                    ticks = rates[iface]['delay_ticks']
+
+            # the rate is only written while the limiter is in use
+            if shift is not None:
+                registers[limiter.rate_reg] = shift
+            registers[limiter.enable_reg] = int(shift is not None)
+            if ticks is not None:
+                registers[delay.delay_reg] = ticks
+                registers[delay.use_reg_reg] = int(use_reg)
+            registers[delay.enable_reg] = int(ticks is not None)
+            registers[self.engine.replay_cnt_regs[i]] = min(port['replay_cnt']*self.engine.replay_mult[i], 0xffffffff)
+        return registers, rates
+
+    # Brings the card to config. Returns the ports (re)loaded, the number
+    # of registers written, the rate lookups and the load result, if any.
+    def apply(self, config):
+        loads = self.target_loads(config)
+        load_result = None
+        if loads != self.loads:
+            load_result = self.load(loads)
+
+        registers, rates = self.target_registers(config)
+        writes = [(addr, value) for addr, value in registers.items() if self.registers.get(addr) != value]
+        if writes:
+            t = self.device.transaction()
+            for addr, value in writes:
+                t.write(addr, value)
+            try:
+                t.commit()
+            except BaseException:
+                self.registers = {}
+                raise
+            self.registers.update(writes)
+            self.sync(registers)
+
+        self.config = config
+        self.rates = rates
+        return {'loaded':sorted(loads) if load_result is not None else [],
+                'writes':len(writes),
+                'rates':rates,
+                'load':load_result}
+
+    # Loads the traces, resetting the pcap engine. Both ports go through
+    # one load call, so they must share the timestamp mode.
+    def load(self, loads):
+        modes = set(load['ts'] for load in loads.values())
+        if len(modes) > 1:
+            raise ValueError("Ports must share the timestamp mode")
+        # a failed load leaves the card in an unknown state
+        self.loads = None
+        # the engine reset touches the replay counters
+        for reg in self.engine.replay_cnt_regs:
+            self.registers.pop(reg, None)
+        if not loads:
+            self.engine.clear()
+            self.loads = loads
+            return {}
+        pcaps = dict((iface, load['pcap']) for iface, load in loads.items())
+        if modes.pop():
+            schedules = dict((iface, load['schedule']) for iface, load in loads.items() if load['schedule'] is not None)
+            result = self.engine.load_pcap_ts(pcaps, schedules=schedules)
+        else:
+            result = self.engine.load_pcap(pcaps)
+        self.loads = loads
+        return result
+
+    # Keeps the cached values of the module objects in step with registers.
+    def sync(self, registers):
+        for iface in SESSION_PORTS:
+            limiter = self.rate_limiters[iface]
+            delay = self.delays[iface]
+            limiter.enable = registers[limiter.enable_reg] != 0
+            limiter.rate = registers.get(limiter.rate_reg, limiter.rate)
+            delay.enable = registers[delay.enable_reg] != 0
+            delay.use_reg = registers.get(delay.use_reg_reg, delay.use_reg) != 0
+            delay.delay = registers.get(delay.delay_reg, delay.delay)
+        self.engine.replay_cnt = [registers[reg]//mult for reg, mult in zip(self.engine.replay_cnt_regs, self.engine.replay_mult)]
+
+    def run(self):
+        self.engine.run()
+
+    def stop(self):
+        self.engine.set_begin_replay(False)
+
+    # Drops the applied state, so the next apply writes and loads everything.
+    def forget(self):
+        self.loads = None
+        self.registers = {}
+
+    # Applied state as plain JSON values, for keeping across processes.
+    def state(self):
+        return {'device':self.device.name,
+                'loads':self.loads,
+                'registers':[list(item) for item in sorted(self.registers.items())],
+                'replay_mult':list(self.engine.replay_mult)}
+
+    # Takes over a state saved by state(), trusting that nothing else has
+    # touched the card since. A state from another device is ignored.
+    def restore(self, state):
+        if not state or state.get('device') != self.device.name:
+            self.forget()
+            return
+        self.loads = state['loads']
+        self.registers = dict((addr, value) for addr, value in state['registers'])
+        self.engine.replay_mult = list(state['replay_mult'])
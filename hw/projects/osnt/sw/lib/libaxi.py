@@ -59,29 +59,607 @@
 #
 #
 
-import os, binascii, time, subprocess
+import os, re, binascii, time, subprocess, socket, ctypes, mmap, threading
+from concurrent.futures import ThreadPoolExecutor
 from fcntl import *
 from struct import *
 from binascii import hexlify
+from axi_audit import *
 
-def rdaxi(addr):
-    value=subprocess.getoutput('../lib/axilib -i nf0 -a ' +str(addr))
-    read_data = int(value, 16);
-    value = hex(read_data & int("0xffffffff", 16))
-    
-    content = "read from "+str(addr)+" got "+str(value)+" \r\n"
-    f=open("axitrack.txt", "a")
-    f.write(content)
-    f.close()
+AXI_IFACE = "nf0"
+AXILIB_PATH = "../lib/axilib"
+
+# Register access backend, overridable with
+# OSNT_AXI_BACKEND=ioctl|subprocess|mmap|emulator
+AXI_BACKEND = os.environ.get("OSNT_AXI_BACKEND", "ioctl")
+# mmap backend: BAR resource file (e.g. /sys/bus/pci/devices/<bdf>/resource2)
+# and the register address that sits at offset 0 of that file
+AXI_BAR_PATH = os.environ.get("OSNT_AXI_BAR", "")
+AXI_BAR_BASE = int(os.environ.get("OSNT_AXI_BAR_BASE", "0"), 0)
+# Serve control register reads from a write-through shadow, OSNT_AXI_SHADOW=1
+AXI_SHADOW = os.environ.get("OSNT_AXI_SHADOW", "0") == "1"
+# Register audit trail: binary (axitrack.bin), text (axitrack.txt) or off
+AXI_AUDIT = os.environ.get("OSNT_AXI_AUDIT", "binary")
+
+# ioctl commands served by the open-nic driver, see osnt_nfplus_libaxi.c
+SIOCDEVPRIVATE = 0x89F0
+NFDP_IOCTL_CMD_WRITE_REG = SIOCDEVPRIVATE+1
+NFDP_IOCTL_CMD_READ_REG = SIOCDEVPRIVATE+2
+
+IFNAMSIZ = 16
+# struct ifreq is IFNAMSIZ bytes of name followed by a 24 byte union
+IFREQ_SIZE = 40
+
+def to_int(value):
+    if type(value) is int:
+        return value
+    if isinstance(value, str):
+        return int(value, 16)
+    return int(value)
+
+# Runs the axilib helper once per access. Kept as the fallback backend for
+# hosts where the driver ioctls cannot be issued from python.
+class AxiSubprocess:
+
+    def __init__(self, iface=AXI_IFACE, axilib=AXILIB_PATH):
+        self.iface = iface
+        self.axilib = axilib
+
+    def read(self, addr):
+        value = subprocess.getoutput(self.axilib+' -i '+self.iface+' -a '+hex(addr))
+        return int(value, 16) & 0xffffffff
+
+    def write(self, addr, value):
+        os.system(self.axilib+' -i '+self.iface+' -a '+hex(addr)+' -w '+hex(value))
+
+    # ops is a list of (op, addr, value) with op 'r' or 'w'. All accesses run
+    # from a single shell; reads print one value per line in order.
+    def batch(self, ops):
+        cmds = []
+        for op, addr, value in ops:
+            if op == 'r':
+                cmds.append(self.axilib+' -i '+self.iface+' -a '+hex(addr))
+            else:
+                cmds.append(self.axilib+' -i '+self.iface+' -a '+hex(addr)+' -w '+hex(value)+' >/dev/null')
+        output = iter(subprocess.getoutput('; '.join(cmds)).split())
+        results = []
+        for op, addr, value in ops:
+            if op == 'r':
+                results.append(int(next(output), 16) & 0xffffffff)
+            else:
+                results.append(None)
+        return results
+
+    def close(self):
+        pass
+
+# Issues the same SIOCDEVPRIVATE ioctls as axilib, through one socket kept
+# open for the lifetime of the backend.
+class AxiIoctl:
+
+    def __init__(self, iface=AXI_IFACE):
+        if len(iface) >= IFNAMSIZ:
+            raise ValueError("Interface name too long: "+iface)
+        # raises OSError when the interface does not exist
+        socket.if_nametoindex(iface)
+        self.iface = iface
+        try:
+            self.sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM, 0)
+        except OSError:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, 0)
+        self.fd = self.sock.fileno()
+        # struct xlni_ioctl_ifreq {uint32_t addr; uint32_t val;}
+        self.sifr = ctypes.create_string_buffer(8)
+        self.ifr = bytearray(IFREQ_SIZE)
+        pack_into('%dsP' % IFNAMSIZ, self.ifr, 0, iface.encode(), ctypes.addressof(self.sifr))
+
+    def read(self, addr):
+        pack_into('II', self.sifr, 0, addr, 0)
+        ioctl(self.fd, NFDP_IOCTL_CMD_READ_REG, self.ifr)
+        return unpack_from('II', self.sifr)[1]
+
+    def write(self, addr, value):
+        pack_into('II', self.sifr, 0, addr, value & 0xffffffff)
+        ioctl(self.fd, NFDP_IOCTL_CMD_WRITE_REG, self.ifr)
+
+    def batch(self, ops):
+        results = []
+        for op, addr, value in ops:
+            if op == 'r':
+                results.append(self.read(addr))
+            else:
+                self.write(addr, value)
+                results.append(None)
+        return results
+
+    def close(self):
+        self.sock.close()
+
+# Maps a PCIe BAR resource file and accesses registers with aligned 32-bit
+# loads and stores through a memoryview. Any file can stand in for the BAR,
+# e.g. a file under /dev/shm. base is the register address at offset 0.
+class AxiMmap:
+
+    def __init__(self, path, base=0, size=None):
+        self.path = path
+        self.base = base
+        self.fd = os.open(path, os.O_RDWR | os.O_SYNC)
+        if size is None:
+            size = os.fstat(self.fd).st_size
+        self.map = mmap.mmap(self.fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        self.regs = memoryview(self.map).cast('I')
+
+    # Register index of addr in the mapping. Out of range addresses are
+    # refused; a negative index would silently wrap to the end of the BAR.
+    def index(self, addr, count=1):
+        if addr & 0x3:
+            raise ValueError("Unaligned register address: "+hex(addr))
+        i = (addr - self.base) >> 2
+        if i < 0 or i + count > len(self.regs):
+            raise ValueError("Register address outside the mapping: "+hex(addr))
+        return i
+
+    def read(self, addr):
+        return self.regs[self.index(addr)]
+
+    def write(self, addr, value):
+        self.regs[self.index(addr)] = value & 0xffffffff
+
+    # count consecutive registers starting at addr, as a single slice
+    def read_block(self, addr, count):
+        i = self.index(addr, count)
+        return self.regs[i:i+count].tolist()
+
+    def batch(self, ops):
+        results = []
+        for op, addr, value in ops:
+            if op == 'r':
+                results.append(self.regs[self.index(addr)])
+            else:
+                self.regs[self.index(addr)] = value & 0xffffffff
+                results.append(None)
+        return results
+
+    def close(self):
+        self.regs.release()
+        self.map.close()
+        os.close(self.fd)
+
+# Control registers the shadow cache may serve, registered by the modules
+# that own them (see generator.py). Any other address, counters and status
+# registers included, is always read from the hardware.
+_shadow_registers = set()
+
+def add_shadow_registers(addrs):
+    _shadow_registers.update(to_int(addr) for addr in addrs)
+
+# Write-through shadow of register values in front of another backend.
+# Reads of a control register that was written or read before are served
+# from the shadow; every other address goes to the hardware. cached is the
+# allow-list of control registers, the registered ones by default. Call
+# invalidate() after the FPGA is reset or reprogrammed behind our back.
+class AxiShadowCache:
+
+    def __init__(self, backend, cached=None):
+        self.backend = backend
+        self.cached = _shadow_registers if cached is None else set(to_int(addr) for addr in cached)
+        self.shadow = {}
+        self.hits = 0
+        self.misses = 0
+
+    def cacheable(self, addr):
+        return addr in self.cached
+
+    def read(self, addr):
+        if addr in self.shadow:
+            self.hits += 1
+            return self.shadow[addr]
+        self.misses += 1
+        value = self.backend.read(addr)
+        if self.cacheable(addr):
+            self.shadow[addr] = value
+        return value
+
+    def write(self, addr, value):
+        self.backend.write(addr, value)
+        if self.cacheable(addr):
+            self.shadow[addr] = value & 0xffffffff
+
+    # Reads that hit are answered locally, everything else is forwarded to
+    # the backend as one batch with the original ordering preserved.
+    def batch(self, ops):
+        results = [None]*len(ops)
+        forward = []
+        missed = []
+        for i, (op, addr, value) in enumerate(ops):
+            if op == 'r':
+                if addr in self.shadow:
+                    self.hits += 1
+                    results[i] = self.shadow[addr]
+                    continue
+                self.misses += 1
+                missed.append((i, len(forward)))
+            elif self.cacheable(addr):
+                self.shadow[addr] = value & 0xffffffff
+            forward.append((op, addr, value))
+        if forward:
+            forwarded = self.backend.batch(forward)
+            for i, j in missed:
+                results[i] = forwarded[j]
+                addr = ops[i][1]
+                if self.cacheable(addr) and addr not in self.shadow:
+                    self.shadow[addr] = forwarded[j]
+        return results
+
+    def invalidate(self, addr=None):
+        if addr is None:
+            self.shadow.clear()
+        else:
+            self.shadow.pop(to_int(addr), None)
+
+    def stats(self):
+        return {'hits':self.hits, 'misses':self.misses}
+
+    def close(self):
+        self.backend.close()
+
+# Returns a backend for iface, falling back to the axilib subprocess when
+# the ioctl path cannot be opened.
+def open_backend(name=None, iface=AXI_IFACE, shadow=None, path=None, base=None):
+    if name is None:
+        name = AXI_BACKEND
+    if shadow is None:
+        shadow = AXI_SHADOW
+    if path is None:
+        path = AXI_BAR_PATH
+    if base is None:
+        base = AXI_BAR_BASE
+    if name == "ioctl":
+        try:
+            backend = AxiIoctl(iface)
+        except OSError:
+            backend = AxiSubprocess(iface)
+    elif name == "subprocess":
+        backend = AxiSubprocess(iface)
+    elif name == "mmap":
+        if not path:
+            raise ValueError("mmap backend needs a BAR path, set OSNT_AXI_BAR")
+        backend = AxiMmap(path, base)
+    elif name == "emulator":
+        from axi_emulator import generator_emulator
+        backend = generator_emulator()
+    else:
+        raise ValueError("Unknown register backend: "+str(name))
+    if shadow:
+        backend = AxiShadowCache(backend)
+    return backend
+
+_audit_mode = None
+_audit_log = None
+
+# Selects the audit trail for this session. mode is "binary", "text" or "off".
+def set_audit(mode, path=None):
+    global _audit_mode, _audit_log
+    if mode not in ("binary", "text", "off"):
+        raise ValueError("Unknown audit mode: "+str(mode))
+    if _audit_log is not None:
+        _audit_log.close()
+        _audit_log = None
+    if mode == "binary":
+        if path is None:
+            path = "axitrack.bin"
+        _audit_log = AxiAuditLog(path)
+    _audit_mode = mode
+
+def audit(op, addr, value):
+    if _audit_mode is None:
+        set_audit(AXI_AUDIT)
+    if _audit_mode == "binary":
+        _audit_log.record(op, addr, value)
+    elif _audit_mode == "text":
+        if op == AUDIT_OP_READ:
+            content = "read from "+hex(addr)+" got "+hex(value)+" \r\n"
+        else:
+            content = "write to "+hex(addr)+" with "+hex(value)+" \r\n"
+        f=open("axitrack.txt", "a")
+        f.write(content)
+        f.close()
+
+# Calls condition() until it returns true or timeout seconds pass. Polls
+# start interval seconds apart and back off exponentially to max_interval.
+# Returns whether the condition was met.
+def poll_until(condition, timeout=1.0, interval=1e-6, max_interval=0.01):
+    deadline = time.monotonic() + timeout
+    while True:
+        if condition():
+            return True
+        now = time.monotonic()
+        if now >= deadline:
+            return False
+        time.sleep(min(interval, deadline - now))
+        interval = min(interval*2, max_interval)
+
+# One card. name is the interface or PCI address the backend is bound to and
+# ports maps the generator ports (nf0, nf1) to the host interfaces used to
+# load them. Accesses are serialised by a per-device lock, so one device may
+# be shared by several threads (e.g. loading both ports at once).
+class AxiDevice:
+
+    def __init__(self, name, backend, ports=None):
+        self.name = name
+        self.backend = backend
+        if ports is None:
+            ports = {'nf0' : 'nf0', 'nf1' : 'nf1'}
+        self.ports = ports
+        self.lock = threading.RLock()
+
+    def port_iface(self, port):
+        return self.ports.get(port, port)
 
-    return value
+    # Integer native accessors: int address in, int value out.
+    def read(self, addr):
+        with self.lock:
+            value = self.backend.read(addr) & 0xffffffff
+        audit(AUDIT_OP_READ, addr, value)
+        return value
+
+    def write(self, addr, value):
+        with self.lock:
+            self.backend.write(addr, value)
+        audit(AUDIT_OP_WRITE, addr, value)
+
+    # String compatibility API: addresses and values may be hex strings,
+    # reads return a hex string.
+    def rdaxi(self, addr):
+        return hex(self.read(to_int(addr)))
+
+    def wraxi(self, addr, value):
+        self.write(to_int(addr), to_int(value))
+
+    # Reads count consecutive 32-bit registers starting at addr and returns
+    # a list of integers. The mmap backend serves this with one slice.
+    def rdaxi_block(self, addr, count):
+        addr = to_int(addr)
+        with self.lock:
+            if hasattr(self.backend, 'read_block'):
+                values = self.backend.read_block(addr, count)
+            else:
+                values = self.backend.batch([('r', addr+4*i, None) for i in range(count)])
+        for i in range(count):
+            audit(AUDIT_OP_READ, addr+4*i, values[i])
+        return values
+
+    # Reads addr from the hardware, bypassing any shadow cache.
+    def hw_read(self, addr):
+        with self.lock:
+            backend = self.backend
+            if isinstance(backend, AxiShadowCache):
+                backend = backend.backend
+            value = backend.read(addr)
+        audit(AUDIT_OP_READ, addr, value)
+        return value
+
+    # Waits until (register & mask) == expected, raises TimeoutError otherwise.
+    def wait_for(self, addr, mask, expected, timeout=1.0):
+        addr = to_int(addr)
+        value = [0]
+        def condition():
+            value[0] = self.hw_read(addr)
+            return (value[0] & mask) == expected
+        if not poll_until(condition, timeout):
+            raise TimeoutError(self.name+": register "+hex(addr)+" = "+hex(value[0])+", expected "+hex(expected)+" under mask "+hex(mask))
+        return value[0]
+
+    # Writes value to addr, waits until the hardware reflects it, then writes
+    # idle back and waits for that too.
+    def pulse(self, addr, value=1, idle=0, timeout=1.0):
+        addr = to_int(addr)
+        self.write(addr, value)
+        self.wait_for(addr, 0xffffffff, value, timeout)
+        self.write(addr, idle)
+        self.wait_for(addr, 0xffffffff, idle, timeout)
+
+    def transaction(self):
+        return AxiTransaction(self).begin()
+
+    # Puts a shadow cache in front of the backend, if not there already.
+    # cached replaces the registered control registers, see AxiShadowCache.
+    def enable_shadow_cache(self, cached=None):
+        with self.lock:
+            if not isinstance(self.backend, AxiShadowCache):
+                self.backend = AxiShadowCache(self.backend, cached)
+        return self.backend
+
+    # Drops shadowed values, e.g. after an FPGA reset. No-op without a cache.
+    def invalidate(self, addr=None):
+        with self.lock:
+            if isinstance(self.backend, AxiShadowCache):
+                self.backend.invalidate(addr)
+
+    def cache_stats(self):
+        if isinstance(self.backend, AxiShadowCache):
+            return self.backend.stats()
+        return {'hits':0, 'misses':0}
+
+    def close(self):
+        self.backend.close()
+
+# Queues register reads and writes between begin() and commit() and runs
+# them in one backend call. commit() returns one entry per queued access, in
+# order: the read value for reads and None for writes.
+class AxiTransaction:
+
+    def __init__(self, device=None):
+        self.device = device
+        self.ops = []
+
+    def begin(self):
+        self.ops = []
+        return self
+
+    def read(self, addr):
+        self.ops.append(('r', to_int(addr), None))
+        return len(self.ops)-1
+
+    def write(self, addr, value):
+        self.ops.append(('w', to_int(addr), to_int(value)))
+        return len(self.ops)-1
+
+    def commit(self):
+        ops = self.ops
+        self.ops = []
+        if not ops:
+            return []
+        device = self.device
+        if device is None:
+            device = get_device()
+        with device.lock:
+            results = device.backend.batch(ops)
+        for (op, addr, value), result in zip(ops, results):
+            if op == 'r':
+                audit(AUDIT_OP_READ, addr, result)
+            else:
+                audit(AUDIT_OP_WRITE, addr, value)
+        return results
+
+# Device registry. Cards are opened by interface (nf0) or PCI address
+# (0000:03:00.0) and kept open for the session.
+PCI_DEVICES_PATH = "/sys/bus/pci/devices"
+# BAR resource file mapped for a PCI address with the mmap backend
+AXI_BAR_RESOURCE = os.environ.get("OSNT_AXI_BAR_RESOURCE", "resource2")
+
+_devices = {}
+# Card used by the module level functions, overridable with OSNT_AXI_DEVICE
+_default_device = os.environ.get("OSNT_AXI_DEVICE", AXI_IFACE)
+
+def is_pci_address(name):
+    return re.match(r'^([0-9a-fA-F]{4}:)?[0-9a-fA-F]{2}:[0-9a-fA-F]{2}\.[0-7]$', name) is not None
+
+# Host interfaces of the card at a PCI address, in name order.
+def pci_ifaces(name):
+    if len(name) == 7:
+        name = "0000:"+name
+    try:
+        return sorted(os.listdir(os.path.join(PCI_DEVICES_PATH, name, "net")))
+    except OSError:
+        return []
+
+def open_device(name=None, backend=None, ports=None):
+    if name is None:
+        name = _default_device
+    if name in _devices:
+        return _devices[name]
+    if backend is None:
+        if is_pci_address(name):
+            ifaces = pci_ifaces(name)
+            if ports is None and len(ifaces) >= 2:
+                ports = {'nf0' : ifaces[0], 'nf1' : ifaces[1]}
+            if AXI_BACKEND == "mmap":
+                bdf = name if len(name) > 7 else "0000:"+name
+                backend = open_backend("mmap", path=os.path.join(PCI_DEVICES_PATH, bdf, AXI_BAR_RESOURCE))
+            elif ifaces:
+                backend = open_backend(iface=ifaces[0])
+            else:
+                raise ValueError("No network interface found for PCI device "+name)
+        else:
+            backend = open_backend(iface=name)
+    device = AxiDevice(name, backend, ports)
+    _devices[name] = device
+    return device
+
+def get_device(name=None):
+    return open_device(name)
+
+def close_device(name):
+    device = _devices.pop(name, None)
+    if device is not None:
+        device.close()
+
+def set_default_device(name):
+    global _default_device
+    _default_device = name
+
+# The module level functions below act on the default device.
+def get_backend():
+    return get_device().backend
+
+def set_backend(backend):
+    device = _devices.get(_default_device)
+    if device is None:
+        _devices[_default_device] = AxiDevice(_default_device, backend)
+        return
+    if device.backend is not backend:
+        device.backend.close()
+    device.backend = backend
+
+def enable_shadow_cache(cached=None):
+    return get_device().enable_shadow_cache(cached)
+
+def invalidate(addr=None):
+    get_device().invalidate(addr)
+
+def cache_stats():
+    return get_device().cache_stats()
+
+def axi_read(addr):
+    return get_device().read(addr)
+
+def axi_write(addr, value):
+    get_device().write(addr, value)
+
+def rdaxi(addr):
+    return get_device().rdaxi(addr)
 
 def wraxi(addr, value):
-    os.system("../lib/axilib -i nf0 -a "+str(addr)+" -w "+str(value))
-    content = "write to "+str(addr)+" with "+str(value)+" \r\n"
-    f=open("axitrack.txt", "a")
-    f.write(content)
-    f.close()
+    get_device().wraxi(addr, value)
+
+def rdaxi_block(addr, count):
+    return get_device().rdaxi_block(addr, count)
+
+def hw_read(addr):
+    return get_device().hw_read(addr)
+
+def wait_for(addr, mask, expected, timeout=1.0):
+    return get_device().wait_for(addr, mask, expected, timeout)
+
+def pulse(addr, value=1, idle=0, timeout=1.0):
+    get_device().pulse(addr, value, idle, timeout)
+
+# Runs work on several cards at once, one worker per card, so bringing up a
+# set of testers takes about as long as the slowest card.
+class AxiDevicePool:
+
+    def __init__(self, devices, max_workers=None):
+        self.devices = []
+        for device in devices:
+            if not isinstance(device, AxiDevice):
+                device = open_device(device)
+            self.devices.append(device)
+        if max_workers is None:
+            max_workers = max(1, len(self.devices))
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    # Calls func(device) for every device concurrently and returns the
+    # results keyed by device name. The first exception is re-raised.
+    def map(self, func):
+        futures = [(device.name, self.executor.submit(func, device)) for device in self.devices]
+        return dict((name, future.result()) for name, future in futures)
+
+    # batches maps a device name to a list of (op, addr, value) accesses.
+    # Each list runs as one transaction; results are keyed by device name.
+    def run(self, batches):
+        def commit(device):
+            t = AxiTransaction(device).begin()
+            for op, addr, value in batches.get(device.name, []):
+                if op == 'r':
+                    t.read(addr)
+                else:
+                    t.write(addr, value)
+            return t.commit()
+        return self.map(commit)
+
+    def close(self):
+        self.executor.shutdown()
 
 def add_hex(hex1, hex2):
     return hex(int(hex1, 16) + int(hex2, 16))
@@ -0,0 +1,271 @@
+#
+# Copyright (c) 2016-2017 University of Cambridge
+# Copyright (c) 2016-2017 Jong Hun Han
+# Copyright (c) 2022 Gianni Antichi
+# All rights reserved.
+#
+# This software was developed by University of Cambridge Computer Laboratory
+# under the ENDEAVOUR project (grant agreement 644960) as part of
+# the European Union's Horizon 2020 research and innovation programme.
+#
+# @NETFPGA_LICENSE_HEADER_START@
+#
+# Licensed to NetFPGA Open Systems C.I.C. (NetFPGA) under one or more
+# contributor license agreements. See the NOTICE file distributed with this
+# work for additional information regarding copyright ownership. NetFPGA
+# licenses this file to you under the NetFPGA Hardware-Software License,
+# Version 1.0 (the License); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at:
+#
+# http://www.netfpga-cic.org
+#
+# Unless required by applicable law or agreed to in writing, Work distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# @NETFPGA_LICENSE_HEADER_END@
+################################################################################
+#
+#  Description:
+#        Streams frames out of a pcap or pcapng file without dissecting
+#        them. Only the record being returned is held in memory, so memory
+#        use does not depend on the size of the trace. Timestamps are
+#        returned as integer nanoseconds. PcapWriter writes nanosecond pcaps.
+
+import os
+from struct import Struct
+
+PCAP_MAGIC_USEC = 0xa1b2c3d4
+PCAP_MAGIC_NSEC = 0xa1b23c4d
+LINKTYPE_ETHERNET = 1
+
+PCAP_GLOBAL_HEADER_LEN = 24
+PCAP_RECORD_HEADER_LEN = 16
+
+# pcapng block types and options used here
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+PCAPNG_IDB = 1
+PCAPNG_PB = 2
+PCAPNG_SPB = 3
+PCAPNG_EPB = 6
+PCAPNG_OPT_END = 0
+PCAPNG_OPT_TSRESOL = 9
+PCAPNG_OPT_TSOFFSET = 14
+# microseconds unless an interface says otherwise
+PCAPNG_DEFAULT_TSRESOL = 6
+
+class PcapReader:
+
+    def __init__(self, path, bufsize=1<<20):
+        self.path = path
+        self.f = open(path, "rb", buffering=bufsize)
+        header = self.f.read(PCAP_GLOBAL_HEADER_LEN)
+        if len(header) < PCAP_GLOBAL_HEADER_LEN:
+            self.f.close()
+            raise ValueError(path+": truncated pcap header")
+        for endian in ('<', '>'):
+            magic = Struct(endian+'I').unpack_from(header)[0]
+            if magic in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC):
+                break
+        else:
+            self.f.close()
+            raise ValueError(path+": not a pcap file")
+        # nanoseconds per unit of the sub-second timestamp field
+        self.ts_scale = 1 if magic == PCAP_MAGIC_NSEC else 1000
+        self.record = Struct(endian+'IIII')
+        self.snaplen, self.linktype = Struct(endian+'II').unpack_from(header, 16)
+        if self.linktype != LINKTYPE_ETHERNET:
+            self.f.close()
+            raise ValueError(path+": link type "+str(self.linktype)+" is not Ethernet")
+
+    # Yields (timestamp_ns, frame) with frame the captured bytes.
+    def __iter__(self):
+        read = self.f.read
+        unpack = self.record.unpack
+        scale = self.ts_scale
+        while True:
+            header = read(PCAP_RECORD_HEADER_LEN)
+            if len(header) < PCAP_RECORD_HEADER_LEN:
+                break
+            ts_sec, ts_frac, caplen, wirelen = unpack(header)
+            frame = read(caplen)
+            if len(frame) < caplen:
+                break
+            yield ts_sec*1000000000 + ts_frac*scale, frame
+
+    # Yields (timestamp_ns, caplen) for every record, seeking over the frame
+    # data instead of reading it. A truncated last record is skipped.
+    def headers(self):
+        read = self.f.read
+        seek = self.f.seek
+        unpack = self.record.unpack
+        scale = self.ts_scale
+        size = os.fstat(self.f.fileno()).st_size
+        pos = self.f.tell()
+        while True:
+            header = read(PCAP_RECORD_HEADER_LEN)
+            if len(header) < PCAP_RECORD_HEADER_LEN:
+                break
+            ts_sec, ts_frac, caplen, wirelen = unpack(header)
+            pos = pos + PCAP_RECORD_HEADER_LEN + caplen
+            if pos > size:
+                break
+            seek(caplen, 1)
+            yield ts_sec*1000000000 + ts_frac*scale, caplen
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Same interface as PcapReader for pcapng files. Each interface has its own
+# timestamp resolution and offset; all must be Ethernet. Simple packet
+# blocks carry no timestamp and reuse the previous one.
+class PcapngReader:
+
+    def __init__(self, path, bufsize=1<<20):
+        self.path = path
+        self.f = open(path, "rb", buffering=bufsize)
+        if self.f.read(4) != PCAPNG_SHB.to_bytes(4, 'little'):
+            self.f.close()
+            raise ValueError(path+": not a pcapng file")
+        self.f.seek(0)
+        self.endian = '<'
+        # (resolution, offset_ns, snaplen) per interface of the section
+        self.interfaces = []
+        self.linktype = LINKTYPE_ETHERNET
+        self.snaplen = 0
+
+    # Yields (block type, block body) for every block after a section header.
+    def blocks(self):
+        read = self.f.read
+        while True:
+            head = read(8)
+            if len(head) < 8:
+                return
+            if head[:4] == PCAPNG_SHB.to_bytes(4, 'little'):
+                bom = read(4)
+                if bom == PCAPNG_BYTE_ORDER_MAGIC.to_bytes(4, 'little'):
+                    self.endian = '<'
+                elif bom == PCAPNG_BYTE_ORDER_MAGIC.to_bytes(4, 'big'):
+                    self.endian = '>'
+                else:
+                    raise ValueError(self.path+": bad pcapng byte order magic")
+                total = Struct(self.endian+'I').unpack_from(head, 4)[0]
+                if len(read(total-12)) < total-12:
+                    return
+                self.interfaces = []
+                continue
+            btype, total = Struct(self.endian+'II').unpack(head)
+            if total < 12:
+                raise ValueError(self.path+": bad pcapng block length "+str(total))
+            body = read(total-8)
+            if len(body) < total-8:
+                return
+            yield btype, body[:-4]
+
+    def add_interface(self, body):
+        linktype, snaplen = Struct(self.endian+'HxxI').unpack_from(body)
+        if linktype != LINKTYPE_ETHERNET:
+            raise ValueError(self.path+": link type "+str(linktype)+" is not Ethernet")
+        resolution = PCAPNG_DEFAULT_TSRESOL
+        offset_ns = 0
+        option = Struct(self.endian+'HH')
+        pos = 8
+        while pos + 4 <= len(body):
+            code, length = option.unpack_from(body, pos)
+            pos = pos + 4
+            if code == PCAPNG_OPT_END:
+                break
+            if code == PCAPNG_OPT_TSRESOL and length >= 1:
+                resolution = body[pos]
+            elif code == PCAPNG_OPT_TSOFFSET and length >= 8:
+                offset_ns = Struct(self.endian+'q').unpack_from(body, pos)[0]*1000000000
+            pos = pos + (length+3)//4*4
+        if not self.interfaces:
+            self.snaplen = snaplen
+        self.interfaces.append((resolution, offset_ns, snaplen))
+
+    # Converts a 64-bit timestamp in interface units to nanoseconds.
+    def ts_ns(self, iface_id, units):
+        resolution, offset_ns, snaplen = self.interfaces[iface_id]
+        if resolution & 0x80:
+            return (units*1000000000 >> (resolution & 0x7f)) + offset_ns
+        if resolution <= 9:
+            return units*10**(9-resolution) + offset_ns
+        return units//10**(resolution-9) + offset_ns
+
+    # Yields (timestamp_ns, frame) as memoryviews over the block bodies.
+    def records(self):
+        ts_ns = 0
+        for btype, body in self.blocks():
+            if btype == PCAPNG_EPB:
+                iface_id, ts_high, ts_low, caplen = Struct(self.endian+'IIII').unpack_from(body)
+                ts_ns = self.ts_ns(iface_id, ts_high << 32 | ts_low)
+                yield ts_ns, memoryview(body)[20:20+caplen]
+            elif btype == PCAPNG_SPB:
+                # interface 0 captured min(wirelen, snaplen) bytes, the rest
+                # of the body is padding; snaplen 0 means no limit
+                wirelen = Struct(self.endian+'I').unpack_from(body)[0]
+                caplen = min(wirelen, self.snaplen) if self.snaplen else wirelen
+                yield ts_ns, memoryview(body)[4:4+min(caplen, len(body)-4)]
+            elif btype == PCAPNG_PB:
+                iface_id, drops, ts_high, ts_low, caplen = Struct(self.endian+'HHIII').unpack_from(body)
+                ts_ns = self.ts_ns(iface_id, ts_high << 32 | ts_low)
+                yield ts_ns, memoryview(body)[20:20+caplen]
+            elif btype == PCAPNG_IDB:
+                self.add_interface(body)
+
+    def __iter__(self):
+        for ts_ns, frame in self.records():
+            yield ts_ns, bytes(frame)
+
+    def headers(self):
+        for ts_ns, frame in self.records():
+            yield ts_ns, len(frame)
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Writes Ethernet frames to a nanosecond pcap file.
+class PcapWriter:
+
+    def __init__(self, path, snaplen=65535, bufsize=1<<20):
+        self.path = path
+        self.f = open(path, "wb", buffering=bufsize)
+        self.record = Struct('<IIII')
+        self.f.write(Struct('<IHHiIII').pack(PCAP_MAGIC_NSEC, 2, 4, 0, 0, snaplen, LINKTYPE_ETHERNET))
+
+    def write(self, ts_ns, frame):
+        self.f.write(self.record.pack(ts_ns//1000000000, ts_ns%1000000000, len(frame), len(frame)))
+        self.f.write(frame)
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Opens path with the reader matching its format.
+def open_trace(path, bufsize=1<<20):
+    f = open(path, "rb")
+    magic = f.read(4)
+    f.close()
+    if magic == PCAPNG_SHB.to_bytes(4, 'little'):
+        return PcapngReader(path, bufsize)
+    return PcapReader(path, bufsize)
@@ -0,0 +1,349 @@
+#
+# Copyright (c) 2016-2017 University of Cambridge
+# Copyright (c) 2016-2017 Jong Hun Han
+# Copyright (c) 2022 Gianni Antichi
+# All rights reserved.
+#
+# This software was developed by University of Cambridge Computer Laboratory
+# under the ENDEAVOUR project (grant agreement 644960) as part of
+# the European Union's Horizon 2020 research and innovation programme.
+#
+# @NETFPGA_LICENSE_HEADER_START@
+#
+# Licensed to NetFPGA Open Systems C.I.C. (NetFPGA) under one or more
+# contributor license agreements. See the NOTICE file distributed with this
+# work for additional information regarding copyright ownership. NetFPGA
+# licenses this file to you under the NetFPGA Hardware-Software License,
+# Version 1.0 (the License); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at:
+#
+# http://www.netfpga-cic.org
+#
+# Unless required by applicable law or agreed to in writing, Work distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# @NETFPGA_LICENSE_HEADER_END@
+################################################################################
+#
+#  Description:
+#        Batched frame transmit for loading the generator memory. Frames are
+#        written into a PACKET_TX_RING (TPACKET_V2) shared with the kernel and
+#        handed over a whole batch per send() call. Where the ring cannot be
+#        set up the frames are sent from a plain AF_PACKET socket instead.
+#
+#        Both transports count frames queued, sent and dropped. send()
+#        accepts any bytes-like frame and is done with it when it returns,
+#        so callers may reuse their buffers.
+#
+#        Test on a veth pair:
+#          ip link add vt0 type veth peer name vt1
+#          ip link set vt0 up; ip link set vt1 up
+#          python3 pkt_tx.py vt0 10000 64
+
+import os, sys, time, mmap, socket
+from struct import Struct
+
+SOL_PACKET = 263
+PACKET_VERSION = 10
+PACKET_TX_RING = 13
+PACKET_LOSS = 14
+TPACKET_V2 = 1
+
+TP_STATUS_AVAILABLE = 0x0
+TP_STATUS_SEND_REQUEST = 0x1
+TP_STATUS_SENDING = 0x2
+TP_STATUS_WRONG_FORMAT = 0x4
+
+# struct tpacket_req
+TPACKET_REQ = Struct('IIII')
+# frame data follows the 32 byte tpacket2_hdr, which starts with the 32-bit
+# tp_status and tp_len words
+TPACKET2_DATA_OFFSET = 32
+
+ETH_HLEN = 14
+VLAN_HLEN = 4
+ETH_P_8021Q = b'\x81\x00'
+
+TX_BATCH_SIZE = int(os.environ.get("OSNT_TX_BATCH", "64"))
+TX_RING = os.environ.get("OSNT_TX_RING", "1") == "1"
+TX_RING_FRAMES = 1024
+TX_FRAME_SIZE = 2048
+TX_TIMEOUT = 5.0
+
+class PacketTxRing:
+
+    def __init__(self, iface, batch_size=TX_BATCH_SIZE, frame_nr=TX_RING_FRAMES, frame_size=TX_FRAME_SIZE):
+        self.iface = iface
+        self.batch_size = max(1, batch_size)
+        self.frame_size = frame_size
+        self.max_frame = frame_size - TPACKET2_DATA_OFFSET
+        self.queued = 0
+        self.sent = 0
+        self.dropped = 0
+        # head is the next slot to fill, tail the oldest slot not yet
+        # reclaimed; pending counts slots between them
+        self.head = 0
+        self.tail = 0
+        self.pending = 0
+        self.unkicked = 0
+        self.ring = None
+        # plain socket for frames that do not fit a slot; a send() with data
+        # on the ring socket would only kick the ring
+        self.direct = None
+        self.mtu = iface_mtu(iface)
+
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+        try:
+            self.sock.bind((iface, 0))
+            self.sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V2)
+            # skip malformed frames instead of stalling the ring on them. The
+            # kernel then marks them available as if sent, so send() drops
+            # them before they reach the ring
+            self.sock.setsockopt(SOL_PACKET, PACKET_LOSS, 1)
+            block_size = -(-frame_size//mmap.PAGESIZE)*mmap.PAGESIZE
+            frames_per_block = block_size//frame_size
+            block_nr = -(-frame_nr//frames_per_block)
+            self.frame_nr = block_nr*frames_per_block
+            self.sock.setsockopt(SOL_PACKET, PACKET_TX_RING,
+                                 TPACKET_REQ.pack(block_size, block_nr, frame_size, self.frame_nr))
+            self.ring = mmap.mmap(self.sock.fileno(), block_size*block_nr)
+            self.buf = memoryview(self.ring)
+            self.words = self.buf.cast('I')
+        except OSError:
+            self.sock.close()
+            raise
+        # slot offsets; frames never straddle a block and are 16 byte aligned
+        self.offsets = [(i//frames_per_block)*block_size + (i%frames_per_block)*frame_size
+                        for i in range(self.frame_nr)]
+
+    def send(self, frame):
+        length = len(frame)
+        if not self.valid(frame, length):
+            self.queued = self.queued + 1
+            self.dropped = self.dropped + 1
+            return
+        if length > self.max_frame:
+            # does not fit a slot: drain the ring so order is kept
+            self.flush()
+            self._send_direct(frame)
+            return
+        if self.pending == self.frame_nr:
+            self._wait_slot()
+        off = self.offsets[self.head]
+        data = off + TPACKET2_DATA_OFFSET
+        self.buf[data:data+length] = frame
+        # tp_len, then tp_status last to hand the slot to the kernel
+        self.words[off//4 + 1] = length
+        self.words[off//4] = TP_STATUS_SEND_REQUEST
+        self.head = (self.head + 1) % self.frame_nr
+        self.pending = self.pending + 1
+        self.queued = self.queued + 1
+        self.unkicked = self.unkicked + 1
+        if self.unkicked >= self.batch_size:
+            self._kick(socket.MSG_DONTWAIT)
+
+    # The length checks tpacket_snd makes: at least the Ethernet header and
+    # at most the MTU plus header, plus a VLAN tag if the frame carries one.
+    def valid(self, frame, length):
+        if length < ETH_HLEN:
+            return False
+        if self.mtu is None or length <= self.mtu + ETH_HLEN:
+            return True
+        return length <= self.mtu + ETH_HLEN + VLAN_HLEN and frame[12:14] == ETH_P_8021Q
+
+    # Asks the kernel to transmit every frame marked for sending.
+    def _kick(self, flags=0):
+        self.unkicked = 0
+        try:
+            self.sock.send(b'', flags)
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError as e:
+            if e.errno != 105: # ENOBUFS, frames stay queued for the next kick
+                raise
+
+    # Returns slots the kernel has finished with to the producer.
+    def _reclaim(self):
+        words = self.words
+        offsets = self.offsets
+        while self.pending:
+            slot = offsets[self.tail]//4
+            status = words[slot]
+            if status == TP_STATUS_AVAILABLE:
+                self.sent = self.sent + 1
+            elif status & TP_STATUS_WRONG_FORMAT:
+                self.dropped = self.dropped + 1
+                words[slot] = TP_STATUS_AVAILABLE
+            else:
+                break
+            self.tail = (self.tail + 1) % self.frame_nr
+            self.pending = self.pending - 1
+
+    def _wait_slot(self):
+        self._wait(lambda: self.pending < self.frame_nr)
+
+    def _wait(self, condition):
+        self._kick()
+        deadline = time.monotonic() + TX_TIMEOUT
+        interval = 1e-6
+        while True:
+            self._reclaim()
+            if condition():
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(interval)
+            interval = min(interval*2, 0.01)
+            self._kick()
+
+    def _send_direct(self, frame):
+        self.queued = self.queued + 1
+        try:
+            if self.direct is None:
+                self.direct = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+                self.direct.bind((self.iface, 0))
+            self.direct.send(frame)
+            self.sent = self.sent + 1
+        except OSError:
+            self.dropped = self.dropped + 1
+
+    # Sends everything queued and waits for the kernel to release the ring.
+    # Frames still queued after TX_TIMEOUT are counted as dropped.
+    def flush(self):
+        if not self._wait(lambda: self.pending == 0):
+            print('Warning: '+self.iface+': '+str(self.pending)+' frames not sent before timeout')
+            self.dropped = self.dropped + self.pending
+            self.pending = 0
+            self.tail = self.head
+
+    def stats(self):
+        return {'queued':self.queued, 'sent':self.sent, 'dropped':self.dropped}
+
+    def close(self):
+        if self.ring is None:
+            return
+        self.flush()
+        self.words.release()
+        self.buf.release()
+        self.ring.close()
+        self.ring = None
+        self.sock.close()
+        if self.direct is not None:
+            self.direct.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Same interface as PacketTxRing on a plain AF_PACKET socket, for kernels or
+# interfaces without PACKET_TX_RING. Frames are still collected into batches
+# but go out with one send() each.
+class PacketSocketTx:
+
+    def __init__(self, iface, batch_size=TX_BATCH_SIZE):
+        self.iface = iface
+        self.batch_size = max(1, batch_size)
+        self.queued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.batch = []
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+        try:
+            self.sock.bind((iface, 0))
+        except OSError:
+            self.sock.close()
+            raise
+
+    def send(self, frame):
+        self.batch.append(bytes(frame))
+        self.queued = self.queued + 1
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        send = self.sock.send
+        for frame in self.batch:
+            deadline = None
+            while True:
+                try:
+                    send(frame)
+                    self.sent = self.sent + 1
+                    break
+                except OSError as e:
+                    # ENOBUFS: the qdisc is full, give it a moment
+                    if e.errno != 105:
+                        self.dropped = self.dropped + 1
+                        break
+                    if deadline is None:
+                        deadline = time.monotonic() + TX_TIMEOUT
+                    elif time.monotonic() >= deadline:
+                        self.dropped = self.dropped + 1
+                        break
+                    time.sleep(1e-4)
+        self.batch = []
+
+    def stats(self):
+        return {'queued':self.queued, 'sent':self.sent, 'dropped':self.dropped}
+
+    def close(self):
+        if self.sock is None:
+            return
+        self.flush()
+        self.sock.close()
+        self.sock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# MTU of iface, or None if it cannot be read.
+def iface_mtu(iface):
+    try:
+        f = open('/sys/class/net/'+iface+'/mtu')
+        value = int(f.read())
+        f.close()
+        return value
+    except (IOError, ValueError):
+        return None
+
+# Opens the fastest transport available on iface.
+def open_tx(iface, batch_size=TX_BATCH_SIZE, ring=None):
+    if ring is None:
+        ring = TX_RING
+    if ring:
+        try:
+            return PacketTxRing(iface, batch_size)
+        except OSError as e:
+            print('Warning: '+iface+': no PACKET_TX_RING ('+str(e)+'), using socket sends')
+    return PacketSocketTx(iface, batch_size)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print('usage: pkt_tx.py <iface> [count] [batch_size] [ring|socket]')
+        sys.exit(1)
+    iface = sys.argv[1]
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    batch_size = int(sys.argv[3]) if len(sys.argv) > 3 else TX_BATCH_SIZE
+    ring = (sys.argv[4] != 'socket') if len(sys.argv) > 4 else None
+
+    # broadcast frames with a sequence number, 60 to 1514 bytes long
+    frames = []
+    for i in range(count):
+        length = 60 + (i*97) % (1514-60)
+        frames.append(b'\xff'*6 + b'\x02\x00\x00\x00\x00\x01' + b'\x88\xb5' + i.to_bytes(4, 'big') + b'\x00'*(length-18))
+
+    tx = open_tx(iface, batch_size, ring)
+    start = time.monotonic()
+    for frame in frames:
+        tx.send(frame)
+    tx.close()
+    elapsed = time.monotonic() - start
+    stats = tx.stats()
+    print(type(tx).__name__+' '+iface+': queued '+str(stats['queued'])+' sent '+str(stats['sent'])+
+          ' dropped '+str(stats['dropped'])+' in '+'%.3f'%elapsed+'s ('+'%.0f'%(stats['sent']/max(elapsed, 1e-9))+' frames/s)')
@@ -0,0 +1,301 @@
+#
+# Copyright (c) 2016-2017 University of Cambridge
+# Copyright (c) 2016-2017 Jong Hun Han
+# Copyright (c) 2022 Gianni Antichi
+# All rights reserved.
+#
+# This software was developed by University of Cambridge Computer Laboratory
+# under the ENDEAVOUR project (grant agreement 644960) as part of
+# the European Union's Horizon 2020 research and innovation programme.
+#
+# @NETFPGA_LICENSE_HEADER_START@
+#
+# Licensed to NetFPGA Open Systems C.I.C. (NetFPGA) under one or more
+# contributor license agreements. See the NOTICE file distributed with this
+# work for additional information regarding copyright ownership. NetFPGA
+# licenses this file to you under the NetFPGA Hardware-Software License,
+# Version 1.0 (the License); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at:
+#
+# http://www.netfpga-cic.org
+#
+# Unless required by applicable law or agreed to in writing, Work distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# @NETFPGA_LICENSE_HEADER_END@
+################################################################################
+#
+#  Description:
+#        Closed-loop rate calibration. rate_table.py predicts the rate of a
+#        limiter setting from the HDL; the rate measured on the wire differs
+#        with packet size and MAC overhead. RateCalibrator replays a trace,
+#        samples packet counters over a measured interval and corrects the
+#        model by the ratio of measured to predicted rate until the measured
+#        rate is within the tolerance of the target.
+#
+#        The generator has no counters of its own, so the counters are read
+#        from an interface that sees its output, by default the sysfs
+#        statistics of a host interface (the rx side of a looped-back port
+#        or of the device under test). Any callable returning
+#        (packets, bytes) can stand in for it.
+#
+#        Results are kept per trace in a JSON sidecar, <pcap>.osntcal, and
+#        used by OSNTRateLimiter.set_target_rate on later runs.
+
+import os, json
+from time import sleep, monotonic
+from trace_index import trace_index
+from rate_table import rate_table
+
+CALIBRATION_VERSION = 1
+CALIBRATION_SUFFIX = '.osntcal'
+
+CAL_TOLERANCE = 0.01
+# seconds the counters are sampled over, after the replay has settled
+CAL_INTERVAL = 1.0
+CAL_WARMUP = 0.2
+CAL_MAX_ITER = 8
+# replay count used while measuring, long enough to outlast the interval
+CAL_REPLAY_CNT = 0xffffffff
+
+# Returns a callable reading (packets, bytes) of iface from sysfs, or None
+# from the callable when the statistics are not available. direction is
+# 'tx' or 'rx'.
+def iface_counters(iface, direction='tx'):
+    base = '/sys/class/net/'+iface+'/statistics/'+direction+'_'
+    def read():
+        try:
+            values = []
+            for name in ('packets', 'bytes'):
+                f = open(base+name)
+                values.append(int(f.read()))
+                f.close()
+            return tuple(values)
+        except (IOError, ValueError):
+            return None
+    return read
+
+def calibration_path(path):
+    return path+CALIBRATION_SUFFIX
+
+class CalibrationTable:
+
+    # entries are dicts of iface, fine, target_pps, shift, delay_ticks,
+    # measured_pps and scale, the ratio of measured to predicted rate.
+    def __init__(self, path, digest, frequency, entries=None):
+        self.path = path
+        self.digest = digest
+        self.frequency = frequency
+        self.entries = entries if entries is not None else []
+
+    def _entries(self, iface, fine):
+        return [e for e in self.entries if e['iface'] == iface and e['fine'] == fine]
+
+    # The entry calibrated for this target, or None.
+    def find(self, iface, pps, fine, tolerance=CAL_TOLERANCE):
+        for e in self._entries(iface, fine):
+            if abs(e['target_pps'] - pps) <= tolerance*pps:
+                return e
+        return None
+
+    # Model correction near a target: the scale of the closest calibrated
+    # rate, or 1 with nothing calibrated.
+    def scale(self, iface, pps, fine):
+        entries = self._entries(iface, fine)
+        if not entries:
+            entries = [e for e in self.entries if e['iface'] == iface]
+        if not entries:
+            return 1.0
+        return min(entries, key=lambda e: abs(e['target_pps'] - pps))['scale']
+
+    def add(self, entry):
+        old = self.find(entry['iface'], entry['target_pps'], entry['fine'], tolerance=0)
+        if old is not None:
+            self.entries.remove(old)
+        self.entries.append(entry)
+        self.entries.sort(key=lambda e: (e['iface'], e['fine'], e['target_pps']))
+
+    # Like RateTable.lookup, but a calibrated target returns its measured
+    # setting and any other target is looked up with the model corrected by
+    # the nearest calibration. 'calibrated' tells the two apart.
+    def lookup(self, table, iface, pps=None, bps=None, fine=False):
+        if pps is None:
+            if bps is None:
+                raise ValueError("Target rate missing")
+            pps = bps/table.pkt_bits
+        entry = self.find(iface, pps, fine)
+        if entry is not None:
+            measured = entry['measured_pps']
+            return {'shift':entry['shift'],
+                    'delay_ticks':entry['delay_ticks'],
+                    'target_pps':pps,
+                    'target_bps':table.bps(pps),
+                    'achieved_pps':measured,
+                    'achieved_bps':table.bps(measured),
+                    'error':(measured - pps)/pps,
+                    'calibrated':True}
+        scale = self.scale(iface, pps, fine)
+        result = table.lookup(pps=pps/scale, fine=fine)
+        achieved = result['achieved_pps']*scale
+        result.update({'target_pps':pps,
+                       'target_bps':table.bps(pps),
+                       'achieved_pps':achieved,
+                       'achieved_bps':table.bps(achieved),
+                       'error':(achieved - pps)/pps,
+                       'calibrated':False})
+        return result
+
+    def save(self, path=None):
+        if path is None:
+            path = self.path
+        tmp = path+'.tmp'+str(os.getpid())
+        f = open(tmp, "w")
+        try:
+            json.dump({'version':CALIBRATION_VERSION,
+                       'digest':self.digest,
+                       'frequency':self.frequency,
+                       'entries':self.entries}, f, indent=1, sort_keys=True)
+            f.close()
+            os.replace(tmp, path)
+        except BaseException:
+            f.close()
+            os.unlink(tmp)
+            raise
+
+# Calibration of a trace at a datapath frequency. A missing or stale file,
+# from another trace content or frequency, gives an empty table.
+def load_calibration(pcap, frequency):
+    digest = trace_index(pcap).digest
+    path = calibration_path(pcap)
+    try:
+        f = open(path)
+        try:
+            data = json.load(f)
+        finally:
+            f.close()
+    except (IOError, ValueError):
+        data = None
+    if (data is None or data.get('version') != CALIBRATION_VERSION
+            or data.get('digest') != digest or data.get('frequency') != frequency):
+        return CalibrationTable(path, digest, frequency)
+    return CalibrationTable(path, digest, frequency, data['entries'])
+
+class RateCalibrator:
+
+    # engine is the OSNTGeneratorPcapEngine with the trace loaded on the
+    # port of rate_limiter; delay the port's OSNTDelay, used when
+    # calibrating fine settings. counters returns (packets, bytes) of an
+    # interface seeing the port's output, see iface_counters.
+    def __init__(self, engine, rate_limiter, delay, counters, frequency,
+                 tolerance=CAL_TOLERANCE, interval=CAL_INTERVAL, max_iter=CAL_MAX_ITER):
+        self.engine = engine
+        self.rate_limiter = rate_limiter
+        self.delay = delay
+        self.counters = counters
+        self.frequency = frequency
+        self.tolerance = tolerance
+        self.interval = interval
+        self.max_iter = max_iter
+        self.port = int(rate_limiter.iface[2:])
+
+    # Replays the loaded trace on the port and returns the measured pps.
+    # The replay counters are restored afterwards.
+    def measure(self):
+        engine = self.engine
+        t = engine.device.transaction()
+        for reg in engine.replay_cnt_regs:
+            t.read(reg)
+        saved = t.commit()
+
+        t = engine.device.transaction()
+        for i, reg in enumerate(engine.replay_cnt_regs):
+            t.write(reg, CAL_REPLAY_CNT if i == self.port else 0)
+        # the replay starts on a rising edge
+        t.write(engine.begin_replay_reg, 0)
+        t.write(engine.begin_replay_reg, 1)
+        t.commit()
+        try:
+            sleep(CAL_WARMUP)
+            start = self.counters()
+            t0 = monotonic()
+            sleep(self.interval)
+            end = self.counters()
+            t1 = monotonic()
+        finally:
+            t = engine.device.transaction()
+            t.write(engine.begin_replay_reg, 0)
+            for reg, value in zip(engine.replay_cnt_regs, saved):
+                t.write(reg, value)
+            t.commit()
+            engine.begin_replay = False
+
+        if start is None or end is None:
+            raise ValueError("Counters of "+self.rate_limiter.iface+" are not available")
+        if end[0] <= start[0]:
+            raise RuntimeError("No packets counted from "+self.rate_limiter.iface)
+        return (end[0] - start[0])/(t1 - t0)
+
+    # Calibrates the port for a target rate in gbps or pps on pcap, the
+    # trace loaded on the port. Each round sets the limiter (and with fine
+    # the inter-packet delay), measures, and looks the target up again with
+    # the model scaled by measured/predicted. Stops within tolerance, or
+    # when the lookup repeats a setting, and stores the closest setting.
+    def calibrate(self, pcap, gbps=None, pps=None, fine=False, save=True):
+        table = rate_table(pcap, self.frequency)
+        if pps is None:
+            if gbps is None:
+                raise ValueError("Target rate missing")
+            pps = gbps*1e9/table.pkt_bits
+        iface = self.rate_limiter.iface
+        cal = load_calibration(pcap, self.frequency)
+        scale = cal.scale(iface, pps, fine)
+        delay = self.delay if fine else None
+
+        best = None
+        applied = None
+        tried = set()
+        rounds = []
+        for i in range(self.max_iter):
+            result = table.lookup(pps=pps/scale, fine=fine)
+            setting = (result['shift'], result['delay_ticks'])
+            if setting in tried:
+                break
+            tried.add(setting)
+            self.rate_limiter.apply_setting(result['shift'], result['delay_ticks'], delay)
+            applied = setting
+            measured = self.measure()
+            predicted = table.pps(table.interval(*setting))
+            scale = measured/predicted
+            entry = {'iface':iface,
+                     'fine':fine,
+                     'target_pps':pps,
+                     'shift':setting[0],
+                     'delay_ticks':setting[1],
+                     'measured_pps':measured,
+                     'scale':scale}
+            rounds.append(entry)
+            if best is None or abs(measured - pps) < abs(best['measured_pps'] - pps):
+                best = entry
+            if abs(measured - pps) <= self.tolerance*pps:
+                break
+
+        if (best['shift'], best['delay_ticks']) != applied:
+            self.rate_limiter.apply_setting(best['shift'], best['delay_ticks'], delay)
+        cal.add(best)
+        if save:
+            try:
+                cal.save()
+            except OSError as e:
+                print('Warning: could not save calibration for '+pcap+': '+str(e))
+        error = (best['measured_pps'] - pps)/pps
+        return {'shift':best['shift'],
+                'delay_ticks':best['delay_ticks'],
+                'target_pps':pps,
+                'target_bps':table.bps(pps),
+                'achieved_pps':best['measured_pps'],
+                'achieved_bps':table.bps(best['measured_pps']),
+                'error':error,
+                'converged':abs(error) <= self.tolerance,
+                'rounds':rounds}
@@ -0,0 +1,163 @@
+#
+# Copyright (c) 2016-2017 University of Cambridge
+# Copyright (c) 2016-2017 Jong Hun Han
+# Copyright (c) 2022 Gianni Antichi
+# All rights reserved.
+#
+# This software was developed by University of Cambridge Computer Laboratory
+# under the ENDEAVOUR project (grant agreement 644960) as part of
+# the European Union's Horizon 2020 research and innovation programme.
+#
+# @NETFPGA_LICENSE_HEADER_START@
+#
+# Licensed to NetFPGA Open Systems C.I.C. (NetFPGA) under one or more
+# contributor license agreements. See the NOTICE file distributed with this
+# work for additional information regarding copyright ownership. NetFPGA
+# licenses this file to you under the NetFPGA Hardware-Software License,
+# Version 1.0 (the License); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at:
+#
+# http://www.netfpga-cic.org
+#
+# Unless required by applicable law or agreed to in writing, Work distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# @NETFPGA_LICENSE_HEADER_END@
+################################################################################
+#
+#  Description:
+#        Achievable generator rates for a trace. The rate limiter sends a
+#        packet of W words in W ticks and then idles for W*2^shift ticks, so
+#        a packet takes W*(2^shift+1) ticks; disabled it takes W ticks. The
+#        inter-packet delay, with its register in use, starts packets no
+#        less than delay ticks apart. Together a packet takes
+#        max(delay, W*(2^shift+1)) ticks and the rate is the mean over the
+#        trace's word sizes, capped by the 100G line rate.
+#
+#        Rates in bps count every packet with its 4 byte FCS, as
+#        OSNTRateLimiter.to_string does.
+
+import bisect
+import numpy as np
+
+# 32 bit rate limiter shift; larger shifts idle for longer than any test
+RATE_MAX_SHIFT = 32
+RATE_DELAY_MAX = 0xffffffff
+LINE_RATE = 100000000000
+# FCS, IFG and preamble bits added to every frame on the wire
+FCS_BITS = 32
+WIRE_OVERHEAD_BITS = 32 + 96 + 64
+WORD_BYTES = 64
+
+class RateTable:
+
+    # lengths holds the frame lengths of the trace, frequency is the
+    # datapath clock in Hz.
+    def __init__(self, lengths, frequency, line_rate=LINE_RATE, max_shift=RATE_MAX_SHIFT):
+        lengths = np.asarray(lengths, dtype=np.int64)
+        if not len(lengths):
+            raise ValueError("Empty trace")
+        self.frequency = frequency
+        self.count = len(lengths)
+        self.mean_len = float(lengths.mean())
+        self.pkt_bits = self.mean_len*8 + FCS_BITS
+        self.max_pps = line_rate/(self.mean_len*8 + WIRE_OVERHEAD_BITS)
+        words = (lengths + (WORD_BYTES-1))//WORD_BYTES
+        self.words, self.counts = np.unique(words, return_counts=True)
+        self.mean_words = float((self.words*self.counts).sum())/self.count
+
+        # settings[i] is None for the limiter disabled, else the shift;
+        # intervals[i] its mean ticks per packet, ascending
+        self.settings = [None] + list(range(max_shift+1))
+        self.mults = [1] + [(1 << shift) + 1 for shift in range(max_shift+1)]
+        self.intervals = [self.mean_words*mult for mult in self.mults]
+
+    # Mean ticks per packet for a setting.
+    def interval(self, shift=None, delay=0):
+        mult = 1 if shift is None else (1 << shift) + 1
+        ticks = np.maximum(self.words*mult, delay)
+        return float((ticks*self.counts).sum())/self.count
+
+    def pps(self, interval):
+        return min(self.frequency/interval, self.max_pps)
+
+    def bps(self, pps):
+        return pps*self.pkt_bits
+
+    # Smallest delay that brings the mean interval of shift up to target
+    # ticks. The mean is piecewise linear in the delay, with knots at the
+    # packet sizes, so the segment is found by bisection and solved.
+    def solve_delay(self, shift, target):
+        mult = 1 if shift is None else (1 << shift) + 1
+        ticks = self.words*mult
+        counts = self.counts
+        if target <= self.interval(shift):
+            return 0
+        below = np.cumsum(counts)
+        above = ((ticks*counts)[::-1].cumsum())[::-1]
+        # mean interval with the delay at each knot
+        knots = [float(ticks[j]*(below[j-1] if j else 0) + above[j])/self.count for j in range(len(ticks))]
+        j = bisect.bisect_left(knots, target)
+        if j == len(ticks):
+            # the delay exceeds every packet
+            delay = target
+        else:
+            delay = (target*self.count - above[j])/float(below[j-1])
+        return int(min(max(round(delay), 0), RATE_DELAY_MAX))
+
+    # Best setting for a target rate, given in pps or in bps. With fine the
+    # delay may be added on top of a faster limiter setting. Returns a dict
+    # with the setting, the achieved rate and the relative error.
+    def lookup(self, pps=None, bps=None, fine=False):
+        if pps is None:
+            if bps is None:
+                raise ValueError("Target rate missing")
+            pps = bps/self.pkt_bits
+        if pps <= 0:
+            raise ValueError("Target rate must be positive")
+        target = self.frequency/pps
+        # intervals ascend, so the settings around the target are i-1 and i
+        i = bisect.bisect_left(self.intervals, target)
+        choices = [(self.settings[j], 0) for j in (i-1, i) if 0 <= j < len(self.intervals)]
+        if fine:
+            # any faster setting can be slowed down by the delay; a tick is
+            # coarse at high rates, so try the delays around the solution
+            for j in range(min(i+1, len(self.intervals))):
+                delay = self.solve_delay(self.settings[j], target)
+                for d in (delay-1, delay, delay+1):
+                    if 0 < d <= RATE_DELAY_MAX:
+                        choices.append((self.settings[j], d))
+        shift, delay = min(choices, key=lambda c: abs(self.pps(self.interval(c[0], c[1])) - pps))
+        achieved = self.pps(self.interval(shift, delay))
+        return {'shift':shift,
+                'delay_ticks':delay,
+                'target_pps':pps,
+                'target_bps':self.bps(pps),
+                'achieved_pps':achieved,
+                'achieved_bps':self.bps(achieved),
+                'error':(achieved - pps)/pps}
+
+    # Every rate the limiter alone can produce, fastest first, as
+    # (shift, pps, bps).
+    def rates(self):
+        return [(shift, self.pps(interval), self.bps(self.pps(interval))) for shift, interval in zip(self.settings, self.intervals)]
+
+# tables already built, by trace digest and frequency
+_tables = {}
+
+# RateTable for a trace given as a pcap path, a TraceIndex, or a dict with
+# average_pkt_len (taken as fixed size packets).
+def rate_table(trace, frequency):
+    if isinstance(trace, dict):
+        return RateTable([int(round(trace['average_pkt_len']))], frequency)
+    if isinstance(trace, str):
+        from trace_index import trace_index
+        trace = trace_index(trace)
+    key = (trace.digest, frequency)
+    table = _tables.get(key)
+    if table is None:
+        table = RateTable(trace.lengths, frequency)
+        _tables[key] = table
+    return table
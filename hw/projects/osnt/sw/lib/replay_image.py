@@ -0,0 +1,222 @@
+#
+# Copyright (c) 2016-2017 University of Cambridge
+# Copyright (c) 2016-2017 Jong Hun Han
+# Copyright (c) 2022 Gianni Antichi
+# All rights reserved.
+#
+# This software was developed by University of Cambridge Computer Laboratory
+# under the ENDEAVOUR project (grant agreement 644960) as part of
+# the European Union's Horizon 2020 research and innovation programme.
+#
+# @NETFPGA_LICENSE_HEADER_START@
+#
+# Licensed to NetFPGA Open Systems C.I.C. (NetFPGA) under one or more
+# contributor license agreements. See the NOTICE file distributed with this
+# work for additional information regarding copyright ownership. NetFPGA
+# licenses this file to you under the NetFPGA Hardware-Software License,
+# Version 1.0 (the License); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at:
+#
+# http://www.netfpga-cic.org
+#
+# Unless required by applicable law or agreed to in writing, Work distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# @NETFPGA_LICENSE_HEADER_END@
+################################################################################
+#
+#  Description:
+#        OSNT replay images. A pcap is compiled once into the exact frame
+#        sequence sent to load the generator, optionally with the timestamp
+#        frames interleaved, each frame padded to the 64 byte datapath word.
+#        Loading then maps the image and sends straight from it, without
+#        parsing the trace again.
+#
+#        Layout, little endian:
+#          IMAGE_HEADER, padded to IMAGE_HEADER_SIZE
+#          frame lengths, uint32 each, at lengths_offset
+#          frame data at data_offset (page aligned), every frame starting on
+#          a 64 byte boundary
+#
+#        content_hash covers the lengths and the frame data, so two images
+#        that load the same frames have the same hash whatever trace they
+#        came from.
+
+import os, sys, mmap, hashlib
+import numpy as np
+from struct import Struct
+from trace_index import trace_index, TRACE_WORD_BYTES
+
+IMAGE_MAGIC = b'OSNTIMG1'
+IMAGE_VERSION = 1
+IMAGE_SUFFIX = ".osntimg"
+IMAGE_TS_SUFFIX = ".ts.osntimg"
+# magic, version, flags, frames, pkts, total_len, total_words, duration_ns,
+# frequency, lengths_offset, data_offset, data_size, content_hash,
+# trace_digest
+IMAGE_HEADER = Struct('<8sHHIQQQQQQQQ16s16s')
+IMAGE_HEADER_SIZE = 128
+# timestamp frames are interleaved ahead of every packet
+IMAGE_FLAG_TS = 0x1
+
+# timestamp frame, see TS_SIGNATURE in generator.py
+IMAGE_TS_SIGNATURE = b'\xde\xad\xbe\xef\x00\x00\x00\x00'
+IMAGE_TS_FRAME = Struct('>8sQ')
+
+def image_path(pcap, ts=False):
+    return pcap+(IMAGE_TS_SUFFIX if ts else IMAGE_SUFFIX)
+
+class ReplayImage:
+
+    def __init__(self, path):
+        self.path = path
+        f = open(path, "rb")
+        try:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        if len(self.map) < IMAGE_HEADER_SIZE:
+            self.map.close()
+            raise ValueError(path+": truncated replay image")
+        (magic, version, self.flags, self.frame_count, self.pkts, self.total_len, self.total_words,
+         self.duration_ns, self.frequency, lengths_offset, data_offset, data_size,
+         content_hash, trace_digest) = IMAGE_HEADER.unpack_from(self.map)
+        if magic != IMAGE_MAGIC or version != IMAGE_VERSION:
+            self.map.close()
+            raise ValueError(path+": not an OSNT replay image of version "+str(IMAGE_VERSION))
+        if data_offset + data_size > len(self.map):
+            self.map.close()
+            raise ValueError(path+": truncated replay image")
+        self.ts = bool(self.flags & IMAGE_FLAG_TS)
+        self.content_hash = content_hash.hex()
+        self.trace_digest = trace_digest.hex()
+        self.lengths_offset = lengths_offset
+        self.data_offset = data_offset
+        self.data_size = data_size
+
+    # Yields every frame as a memoryview into the mapping. Each view is
+    # released when the next frame is taken, so it must be sent by then.
+    def frames(self):
+        lengths = np.frombuffer(self.map, dtype='<u4', count=self.frame_count, offset=self.lengths_offset)
+        slots = (lengths.astype(np.int64) + (TRACE_WORD_BYTES-1))//TRACE_WORD_BYTES*TRACE_WORD_BYTES
+        starts = self.data_offset + np.cumsum(slots) - slots
+        lengths = lengths.tolist()
+        starts = starts.tolist()
+        view = memoryview(self.map)
+        try:
+            for start, length in zip(starts, lengths):
+                with view[start:start+length] as frame:
+                    yield frame
+        finally:
+            view.release()
+
+    # Delay carried by the first timestamp frame, None without timestamps.
+    def first_gap_ticks(self):
+        if not self.ts or not self.frame_count:
+            return None
+        return IMAGE_TS_FRAME.unpack_from(self.map, self.data_offset)[1]
+
+    def stats(self):
+        return {'pkts':self.pkts,
+                'total_len':self.total_len,
+                'total_words':self.total_words,
+                'average_pkt_len':float(self.total_len)/max(self.pkts, 1),
+                'average_word_cnt':float(self.total_words)/max(self.pkts, 1),
+                'duration_ns':self.duration_ns}
+
+    def close(self):
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Compiles pcap into a replay image at path (by default next to the trace)
+# and returns the path. An existing image built from the same trace content
+# with the same settings is reused. With ts a timestamp frame carrying the
+# gap in ticks at frequency Hz, the datapath clock (DATAPATH_FREQUENCY in
+# generator.py), precedes every packet.
+def compile_image(pcap, path=None, ts=False, frequency=None, first_gap_ns=1000000000):
+    from pcap_reader import open_trace
+    if ts and frequency is None:
+        raise ValueError("frequency is needed for timestamp ticks")
+    if path is None:
+        path = image_path(pcap, ts)
+    index = trace_index(pcap)
+    try:
+        with ReplayImage(path) as image:
+            if image.trace_digest == index.digest and image.ts == ts and (not ts or
+                    (image.frequency == frequency and image.first_gap_ticks() == first_gap_ns*frequency//1000000000)):
+                return path
+    except (OSError, ValueError):
+        pass
+
+    pkts = index.count
+    if ts:
+        ticks, negative, oversized = index.gap_ticks(frequency, first_gap_ns)
+        if negative or oversized:
+            print('Warning: '+pcap+': clamped '+str(negative)+' negative and '+str(oversized)+' oversized packet gaps')
+        lengths = np.empty(2*pkts, dtype='<u4')
+        lengths[0::2] = IMAGE_TS_FRAME.size
+        lengths[1::2] = index.lengths
+    else:
+        lengths = index.lengths.astype('<u4')
+    slots = (lengths.astype(np.int64) + (TRACE_WORD_BYTES-1))//TRACE_WORD_BYTES*TRACE_WORD_BYTES
+    lengths_offset = IMAGE_HEADER_SIZE
+    data_offset = -(-(lengths_offset + lengths.nbytes)//mmap.PAGESIZE)*mmap.PAGESIZE
+    data_size = int(slots.sum())
+
+    h = hashlib.blake2b(digest_size=16)
+    h.update(lengths.tobytes())
+    padding = bytes(TRACE_WORD_BYTES)
+    tmp = path+'.tmp'+str(os.getpid())
+    f = open(tmp, "wb")
+    try:
+        f.write(bytes(IMAGE_HEADER_SIZE))
+        f.write(lengths.tobytes())
+        f.write(bytes(data_offset - lengths_offset - lengths.nbytes))
+        ts_frame = bytearray(IMAGE_TS_FRAME.size)
+        tick_list = ticks.tolist() if ts else None
+        reader = open_trace(pcap)
+        try:
+            for i, (ts_ns, frame) in enumerate(reader):
+                if ts:
+                    IMAGE_TS_FRAME.pack_into(ts_frame, 0, IMAGE_TS_SIGNATURE, tick_list[i])
+                    ts_slot = bytes(ts_frame) + padding[IMAGE_TS_FRAME.size:]
+                    f.write(ts_slot)
+                    h.update(ts_slot)
+                slot = bytes(frame) + padding[:-len(frame) % TRACE_WORD_BYTES]
+                f.write(slot)
+                h.update(slot)
+        finally:
+            reader.close()
+        f.seek(0)
+        f.write(IMAGE_HEADER.pack(IMAGE_MAGIC, IMAGE_VERSION, IMAGE_FLAG_TS if ts else 0,
+                                  len(lengths), pkts, index.total_len, index.total_words, index.duration_ns,
+                                  frequency if ts else 0, lengths_offset, data_offset, data_size,
+                                  h.digest(), bytes.fromhex(index.digest)))
+        f.close()
+        os.replace(tmp, path)
+    except BaseException:
+        f.close()
+        os.unlink(tmp)
+        raise
+    return path
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Compile pcap traces into OSNT replay images")
+    parser.add_argument("pcaps", nargs='+', help="pcap or pcapng traces")
+    parser.add_argument("--ts", action="store_true", help="interleave timestamp frames")
+    parser.add_argument("--frequency", type=int, help="datapath clock in Hz for timestamp ticks, needed with --ts")
+    args = parser.parse_args()
+    if args.ts and args.frequency is None:
+        parser.error("--ts needs --frequency")
+    for pcap in args.pcaps:
+        path = compile_image(pcap, ts=args.ts, frequency=args.frequency)
+        with ReplayImage(path) as image:
+            print(path+': '+str(image.frame_count)+' frames, '+str(image.data_size)+' bytes, hash '+image.content_hash)
@@ -0,0 +1,244 @@
+#
+# Copyright (c) 2016-2017 University of Cambridge
+# Copyright (c) 2016-2017 Jong Hun Han
+# Copyright (c) 2022 Gianni Antichi
+# All rights reserved.
+#
+# This software was developed by University of Cambridge Computer Laboratory
+# under the ENDEAVOUR project (grant agreement 644960) as part of
+# the European Union's Horizon 2020 research and innovation programme.
+#
+# @NETFPGA_LICENSE_HEADER_START@
+#
+# Licensed to NetFPGA Open Systems C.I.C. (NetFPGA) under one or more
+# contributor license agreements. See the NOTICE file distributed with this
+# work for additional information regarding copyright ownership. NetFPGA
+# licenses this file to you under the NetFPGA Hardware-Software License,
+# Version 1.0 (the License); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at:
+#
+# http://www.netfpga-cic.org
+#
+# Unless required by applicable law or agreed to in writing, Work distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# @NETFPGA_LICENSE_HEADER_END@
+################################################################################
+#
+#  Description:
+#        Sidecar index of a pcap trace. The first time a trace is used its
+#        record headers are scanned once and the frame lengths, timestamps
+#        and aggregates (mean length, mean 64B word count, length histogram,
+#        duration) are saved next to it as <trace>.osntidx. Later runs load
+#        the index instead of rescanning the trace.
+#
+#        An index is valid while the trace keeps its size and mtime. When only
+#        the mtime changed (touch, copy) the content hash decides.
+#
+#        Per-frame content hashes need the frame data, so they are only
+#        computed, and then saved in the index, when first asked for.
+
+import os, hashlib, threading
+from array import array
+import numpy as np
+from pcap_reader import open_trace
+
+TRACE_INDEX_SUFFIX = ".osntidx"
+TRACE_INDEX_VERSION = 2
+# width of the length histogram bins, one generator memory word
+TRACE_HIST_BIN = 64
+TRACE_WORD_BYTES = 64
+# the generator inter-packet delay is a 32-bit count of datapath clock ticks
+TS_TICK_MAX = 0xffffffff
+
+# indexes already loaded by this process, by real path
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+class TraceIndex:
+
+    def __init__(self, path, size, mtime_ns, digest, lengths, ts_ns, hashes=None):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.digest = digest
+        self.lengths = lengths
+        self.ts_ns = ts_ns
+        self.hashes = hashes
+
+        self.count = len(lengths)
+        lengths = lengths.astype(np.int64)
+        words = (lengths + (TRACE_WORD_BYTES-1))//TRACE_WORD_BYTES
+        self.total_len = int(lengths.sum())
+        self.total_words = int(words.sum())
+        self.mean_len = float(self.total_len)/max(self.count, 1)
+        self.mean_words = float(self.total_words)/max(self.count, 1)
+        # histogram[i] counts frames of TRACE_HIST_BIN*i to TRACE_HIST_BIN*(i+1)-1 bytes
+        self.histogram = np.bincount(lengths//TRACE_HIST_BIN)
+        self.duration_ns = int(ts_ns[-1] - ts_ns[0]) if len(ts_ns) else 0
+
+    def stats(self):
+        return {'pkts':self.count,
+                'total_len':self.total_len,
+                'total_words':self.total_words,
+                'average_pkt_len':self.mean_len,
+                'average_word_cnt':self.mean_words,
+                'duration_ns':self.duration_ns}
+
+    # Gap before every packet in clock ticks at frequency Hz, first_gap_ns
+    # before the first one. Ticks are taken from each timestamp relative to
+    # the first, so rounding does not accumulate over the trace. Gaps that
+    # are negative (out of order packets) become 0 and gaps beyond the 32-bit
+    # delay field become TS_TICK_MAX. Returns (ticks, negative, oversized)
+    # with ticks a uint32 array and the other two the clamped counts.
+    def gap_ticks(self, frequency, first_gap_ns=1000000000):
+        if not self.count:
+            return np.zeros(0, dtype=np.uint32), 0, 0
+        # split into seconds and nanoseconds to stay within 64 bits
+        offset = self.ts_ns - self.ts_ns[0]
+        ticks = (offset//1000000000)*frequency + (offset%1000000000)*frequency//1000000000
+        gaps = np.empty(self.count, dtype=np.int64)
+        gaps[0] = first_gap_ns*frequency//1000000000
+        np.subtract(ticks[1:], ticks[:-1], out=gaps[1:])
+        negative = int(np.count_nonzero(gaps < 0))
+        oversized = int(np.count_nonzero(gaps > TS_TICK_MAX))
+        np.clip(gaps, 0, TS_TICK_MAX, out=gaps)
+        return gaps.astype(np.uint32), negative, oversized
+
+    # 64-bit hash of every frame's bytes as a uint64 array. The first call
+    # reads the trace and stores the hashes in the index file.
+    def frame_hashes(self):
+        if self.hashes is not None:
+            return self.hashes
+        digests = []
+        reader = open_trace(self.path)
+        try:
+            for ts_ns, frame in reader:
+                digests.append(hashlib.blake2b(frame, digest_size=8).digest())
+        finally:
+            reader.close()
+        self.hashes = np.frombuffer(b''.join(digests[:self.count]), dtype=np.uint64)
+        try:
+            self.save()
+        except OSError as e:
+            print('Warning: could not save trace index for '+self.path+': '+str(e))
+        return self.hashes
+
+    def save(self, path=None):
+        if path is None:
+            path = index_path(self.path)
+        tmp = path+'.tmp'+str(os.getpid())
+        f = open(tmp, "wb")
+        arrays = {}
+        if self.hashes is not None:
+            arrays['hashes'] = self.hashes
+        try:
+            np.savez(f, version=np.int64(TRACE_INDEX_VERSION),
+                     size=np.int64(self.size),
+                     mtime_ns=np.int64(self.mtime_ns),
+                     digest=np.str_(self.digest),
+                     lengths=self.lengths,
+                     ts_ns=self.ts_ns,
+                     **arrays)
+            f.close()
+            os.replace(tmp, path)
+        except BaseException:
+            f.close()
+            os.unlink(tmp)
+            raise
+
+def index_path(path):
+    return path+TRACE_INDEX_SUFFIX
+
+# Hash of the file content, used to recognise a trace whose mtime changed.
+def file_digest(path, chunk=1<<20):
+    h = hashlib.blake2b(digest_size=16)
+    f = open(path, "rb")
+    while True:
+        data = f.read(chunk)
+        if not data:
+            break
+        h.update(data)
+    f.close()
+    return h.hexdigest()
+
+# Returns the index stored for path, or None if it is missing, unreadable
+# or from another index version.
+def load_index(path):
+    try:
+        data = np.load(index_path(path), allow_pickle=False)
+    except (OSError, ValueError):
+        return None
+    try:
+        if int(data['version']) != TRACE_INDEX_VERSION:
+            return None
+        hashes = data['hashes'] if 'hashes' in data.files else None
+        return TraceIndex(path, int(data['size']), int(data['mtime_ns']), str(data['digest']),
+                          data['lengths'], data['ts_ns'], hashes)
+    except (KeyError, ValueError, IndexError):
+        return None
+    finally:
+        data.close()
+
+# Scans the record headers of path and builds its index.
+def build_index(path):
+    st = os.stat(path)
+    lengths = array('I')
+    timestamps = array('q')
+    reader = open_trace(path)
+    for ts_ns, caplen in reader.headers():
+        timestamps.append(ts_ns)
+        lengths.append(caplen)
+    reader.close()
+    lengths = np.frombuffer(lengths, dtype=np.uint32)
+    # most traces fit 16 bit lengths, halving the index size
+    if len(lengths) and lengths.max() < (1<<16):
+        lengths = lengths.astype(np.uint16)
+    else:
+        lengths = lengths.copy()
+    ts_ns = np.frombuffer(timestamps, dtype=np.int64).copy()
+    return TraceIndex(path, st.st_size, st.st_mtime_ns, file_digest(path), lengths, ts_ns)
+
+# Returns the index of path, loading the sidecar file or building and saving
+# it as needed. A trace directory that is not writable only costs a rescan
+# per process.
+def trace_index(path, rebuild=False):
+    key = os.path.realpath(path)
+    st = os.stat(path)
+    with _indexes_lock:
+        index = _indexes.get(key)
+    if not rebuild and index is not None and index.size == st.st_size and index.mtime_ns == st.st_mtime_ns:
+        return index
+
+    index = None if rebuild else load_index(path)
+    save = False
+    if index is not None and index.size != st.st_size:
+        index = None
+    elif index is not None and index.mtime_ns != st.st_mtime_ns:
+        if file_digest(path) == index.digest:
+            index.mtime_ns = st.st_mtime_ns
+            save = True
+        else:
+            index = None
+    if index is None:
+        index = build_index(path)
+        save = True
+    if save:
+        try:
+            index.save()
+        except OSError as e:
+            print('Warning: could not save trace index for '+path+': '+str(e))
+
+    with _indexes_lock:
+        _indexes[key] = index
+    return index
+
+if __name__ == "__main__":
+    import sys
+    for path in sys.argv[1:]:
+        index = trace_index(path)
+        print(path)
+        for key, value in index.stats().items():
+            print('  '+key+': '+str(value))
@@ -0,0 +1,154 @@
+#
+# Copyright (c) 2016-2017 University of Cambridge
+# Copyright (c) 2016-2017 Jong Hun Han
+# Copyright (c) 2022 Gianni Antichi
+# All rights reserved.
+#
+# This software was developed by University of Cambridge Computer Laboratory
+# under the ENDEAVOUR project (grant agreement 644960) as part of
+# the European Union's Horizon 2020 research and innovation programme.
+#
+# @NETFPGA_LICENSE_HEADER_START@
+#
+# Licensed to NetFPGA Open Systems C.I.C. (NetFPGA) under one or more
+# contributor license agreements. See the NOTICE file distributed with this
+# work for additional information regarding copyright ownership. NetFPGA
+# licenses this file to you under the NetFPGA Hardware-Software License,
+# Version 1.0 (the License); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at:
+#
+# http://www.netfpga-cic.org
+#
+# Unless required by applicable law or agreed to in writing, Work distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# @NETFPGA_LICENSE_HEADER_END@
+################################################################################
+#
+#  Description:
+#        Finds the shortest packet sequence a trace repeats. Every frame is
+#        reduced to a 64-bit hash of its bytes and a polynomial rolling hash
+#        is built over that sequence, so testing whether the trace repeats
+#        with period p is one comparison of two window hashes. Matches are
+#        confirmed on the frame hashes before being reported.
+#
+#        The reduced trace holds one period; replaying it replay_cnt times
+#        reproduces the original:
+#          python3 trace_period.py trace.pcap -o reduced.pcap
+
+import numpy as np
+from trace_index import trace_index
+
+ROLL_MODULUS = (1 << 61) - 1
+ROLL_BASE = 0x5bd1e9955bd1e995 % ROLL_MODULUS
+
+# Prefix hashes of a sequence of integers, giving the hash of any window in
+# constant time.
+class RollingHash:
+
+    def __init__(self, values):
+        prefix = [0]*(len(values)+1)
+        powers = [1]*(len(values)+1)
+        h = 0
+        power = 1
+        for i, value in enumerate(values):
+            h = (h*ROLL_BASE + value) % ROLL_MODULUS
+            power = power*ROLL_BASE % ROLL_MODULUS
+            prefix[i+1] = h
+            powers[i+1] = power
+        self.prefix = prefix
+        self.powers = powers
+
+    # Hash of values[start:end].
+    def window(self, start, end):
+        return (self.prefix[end] - self.prefix[start]*self.powers[end-start]) % ROLL_MODULUS
+
+def divisors(n):
+    small = []
+    large = []
+    i = 1
+    while i*i <= n:
+        if n % i == 0:
+            small.append(i)
+            if i*i != n:
+                large.append(n//i)
+        i = i + 1
+    return small + large[::-1]
+
+# Shortest p dividing len(keys) such that keys is keys[:p] repeated. With
+# gaps (one per packet) the gaps after the first packet must repeat as well;
+# the first gap only sets when the trace starts.
+def find_period(keys, gaps=None):
+    n = len(keys)
+    if n == 0:
+        return 0
+    keys_hash = RollingHash(keys.tolist())
+    gaps_hash = RollingHash(gaps[1:].tolist()) if gaps is not None else None
+    for p in divisors(n):
+        if p == n:
+            break
+        if keys_hash.window(0, n-p) != keys_hash.window(p, n):
+            continue
+        if gaps_hash is not None and gaps_hash.window(0, n-1-p) != gaps_hash.window(p, n-1):
+            continue
+        # rule out hash collisions
+        if not np.array_equal(keys[p:], keys[:-p]):
+            continue
+        if gaps is not None and not np.array_equal(gaps[p+1:], gaps[1:-p]):
+            continue
+        return p
+    return n
+
+# Period of pcap. With ts the gaps, in ticks at frequency Hz (the datapath
+# clock, DATAPATH_FREQUENCY in generator.py), must repeat too. Returns a
+# dict with the packet count, the period, the replay_cnt that reproduces
+# the trace from one period and the gap between two periods (None when the
+# trace does not repeat).
+def analyze(pcap, ts=False, frequency=None):
+    if ts and frequency is None:
+        raise ValueError("frequency is needed to compare gaps in ticks")
+    index = trace_index(pcap)
+    gaps = index.gap_ticks(frequency)[0] if ts else None
+    period = find_period(index.frame_hashes(), gaps)
+    repeat_gap_ns = None
+    if 0 < period < index.count:
+        repeat_gap_ns = int(index.ts_ns[period] - index.ts_ns[period-1])
+    return {'pkts':index.count,
+            'period':period,
+            'replay_cnt':index.count//period if period else 0,
+            'repeat_gap_ns':repeat_gap_ns}
+
+# Writes the first period of pcap to path and returns the analysis.
+def reduce_trace(pcap, path, ts=False, frequency=None):
+    from pcap_reader import open_trace, PcapWriter
+    result = analyze(pcap, ts, frequency)
+    reader = open_trace(pcap)
+    writer = PcapWriter(path)
+    try:
+        for i, (ts_ns, frame) in enumerate(reader):
+            if i >= result['period']:
+                break
+            writer.write(ts_ns, frame)
+    finally:
+        reader.close()
+        writer.close()
+    return result
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Find the repeating packet sequence of a trace")
+    parser.add_argument("pcap", help="pcap or pcapng trace")
+    parser.add_argument("--ts", action="store_true", help="packet gaps must repeat too")
+    parser.add_argument("--frequency", type=int, help="datapath clock in Hz for gaps, needed with --ts")
+    parser.add_argument("-o", "--output", help="write one period here")
+    args = parser.parse_args()
+    if args.ts and args.frequency is None:
+        parser.error("--ts needs --frequency")
+    if args.output:
+        result = reduce_trace(args.pcap, args.output, args.ts, args.frequency)
+    else:
+        result = analyze(args.pcap, args.ts, args.frequency)
+    for key, value in result.items():
+        print(key+': '+str(value))
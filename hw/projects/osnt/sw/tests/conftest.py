@@ -0,0 +1,12 @@
+import os, sys
+import pytest
+
+# the library modules import each other by plain name, as the CLI does
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+# A device on the register emulator, without an audit trail.
+@pytest.fixture
+def device():
+    from libaxi import AxiDevice, open_backend, set_audit
+    set_audit('off')
+    return AxiDevice('emulator', open_backend('emulator'))
@@ -0,0 +1,57 @@
+import pytest
+from pcap_reader import PcapWriter
+from bram_planner import CapacityPlanner
+
+# 100 byte frames take two memory words each
+def frame(i):
+    return bytes([i])*100
+
+def trace(tmp_path, ids, name='t.pcap'):
+    path = str(tmp_path/name)
+    writer = PcapWriter(path)
+    for i, pkt in enumerate(ids):
+        writer.write(1000*i, frame(pkt))
+    writer.close()
+    return path
+
+def test_period(tmp_path):
+    pcap = trace(tmp_path, [1, 2, 3]*4)
+    plan = CapacityPlanner(10).plan(pcap)
+    assert plan.strategy == 'period'
+    assert plan.indices.tolist() == [0, 1, 2]
+    assert (plan.words, plan.replay_mult, plan.first_gap_ns) == (6, 4, 1000)
+
+def test_period_ts(tmp_path):
+    pcap = trace(tmp_path, [1, 2, 3]*4)
+    # with timestamps every packet takes one more word
+    plan = CapacityPlanner(10).plan(pcap, ts=True, frequency=250000000)
+    assert (plan.strategy, plan.words, plan.replay_mult) == ('period', 9, 4)
+    with pytest.raises(ValueError):
+        CapacityPlanner(10).plan(pcap, ts=True)
+
+def test_whole_when_it_fits(tmp_path):
+    pcap = trace(tmp_path, range(12))
+    plan = CapacityPlanner(100).plan(pcap)
+    assert (plan.strategy, len(plan.indices), plan.words) == ('whole', 12, 24)
+
+def test_sample(tmp_path):
+    pcap = trace(tmp_path, range(12))
+    plan = CapacityPlanner(10).plan(pcap)
+    assert plan.strategy == 'sample'
+    assert plan.indices.tolist() == [0, 2, 4, 7, 9]
+    assert plan.fits()
+
+def test_truncate(tmp_path):
+    pcap = trace(tmp_path, range(12))
+    plan = CapacityPlanner(11).plan(pcap, strategy='truncate')
+    assert (plan.strategy, plan.indices.tolist(), plan.words) == ('truncate', [0, 1, 2, 3, 4], 10)
+
+def test_period_strategy_without_period(tmp_path):
+    pcap = trace(tmp_path, range(12))
+    assert CapacityPlanner(10).plan(pcap, strategy='period') is None
+
+def test_write(tmp_path):
+    pcap = trace(tmp_path, range(12))
+    plan = CapacityPlanner(10).plan(pcap, strategy='truncate')
+    out = CapacityPlanner().whole(plan.write(str(tmp_path/'out.pcap')))
+    assert out.pkts == 5
@@ -0,0 +1,28 @@
+import numpy as np
+from gap_schedule import gaps_to_ticks, as_ticks
+from trace_index import TS_TICK_MAX
+import pytest
+
+def test_rounding_does_not_accumulate():
+    # 3 ns at 250 MHz is 0.75 ticks
+    ticks, oversized = gaps_to_ticks(np.full(8, 3.0), 250000000)
+    assert ticks.tolist() == [0, 1, 1, 1, 0, 1, 1, 1]
+    assert ticks.dtype == np.uint32
+    assert int(ticks.sum()) == 24*250000000//1000000000
+    assert oversized == 0
+
+def test_oversized():
+    ticks, oversized = gaps_to_ticks([4.0, 30e9, 8.0], 250000000)
+    assert ticks.tolist() == [1, TS_TICK_MAX, 2]
+    assert oversized == 1
+
+def test_empty():
+    ticks, oversized = gaps_to_ticks([], 250000000)
+    assert len(ticks) == 0 and oversized == 0
+
+def test_as_ticks():
+    assert as_ticks([0, TS_TICK_MAX]).tolist() == [0, TS_TICK_MAX]
+    with pytest.raises(ValueError):
+        as_ticks([-1])
+    with pytest.raises(ValueError):
+        as_ticks([TS_TICK_MAX+1])
@@ -0,0 +1,56 @@
+import pytest
+
+pytest.importorskip('scapy.all')
+from generator_session import GeneratorSession
+from config_store import ConfigStore
+
+CONFIG = {'nf0':{'replay_cnt':3, 'ipg':1000},
+          'nf1':{'replay_cnt':1, 'rate_shift':4}}
+
+def test_state_round_trip(device, tmp_path):
+    path = str(tmp_path/'osnt_config.json')
+    session = GeneratorSession(device)
+    session.apply(CONFIG)
+    store = ConfigStore(path)
+    store.applied = session.state()
+    store.save()
+
+    store = ConfigStore(path)
+    assert store.applied == session.state()
+    # nothing changed, so nothing is recorded again
+    store.applied = session.state()
+    assert store.pending == []
+
+    session = GeneratorSession(device)
+    session.restore(store.applied)
+    assert session.apply(CONFIG)['writes'] == 0
+
+def test_replay_cnt_without_period_multiplier(device):
+    session = GeneratorSession(device)
+    session.engine.replay_mult = [3, 1]
+    session.apply({'nf0':{'replay_cnt':2}, 'nf1':{'replay_cnt':5}})
+    assert device.read(session.engine.replay_cnt_regs[0]) == 6
+    assert session.engine.replay_cnt == [2, 5]
+    session.engine.get_replay_cnt()
+    assert session.engine.replay_cnt == [2, 5]
+
+def test_apply_writes_only_changes(device):
+    session = GeneratorSession(device)
+    first = session.apply(CONFIG)
+    assert first['writes'] == len(session.registers)
+    assert device.read(session.rate_limiters['nf1'].rate_reg) == 4
+
+    writes = device.backend.writes
+    assert session.apply(CONFIG)['writes'] == 0
+    assert device.backend.writes == writes
+
+    config = {'nf0':dict(CONFIG['nf0'], replay_cnt=7), 'nf1':CONFIG['nf1']}
+    assert session.apply(config)['writes'] == 1
+    assert device.backend.writes == writes + 1
+    assert device.read(session.engine.replay_cnt_regs[0]) == 7
+
+def test_forget_writes_everything(device):
+    session = GeneratorSession(device)
+    first = session.apply(CONFIG)['writes']
+    session.forget()
+    assert session.apply(CONFIG)['writes'] == first
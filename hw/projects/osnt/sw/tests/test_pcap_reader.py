@@ -0,0 +1,101 @@
+from struct import pack
+import pytest
+from pcap_reader import PcapReader, PcapngReader, open_trace
+
+FRAME = bytes(range(61))
+
+def pad(data):
+    return data + b'\x00'*(-len(data) % 4)
+
+def block(e, btype, body):
+    body = pad(body)
+    return pack(e+'II', btype, len(body)+12) + body + pack(e+'I', len(body)+12)
+
+def shb(e):
+    return block(e, 0x0A0D0D0A, pack(e+'IHHq', 0x1A2B3C4D, 1, 0, -1))
+
+def option(e, code, value):
+    return pack(e+'HH', code, len(value)) + pad(value)
+
+def idb(e, snaplen=65535, tsresol=None, tsoffset=None, linktype=1):
+    options = b''
+    if tsresol is not None:
+        options += option(e, 9, bytes([tsresol]))
+    if tsoffset is not None:
+        options += option(e, 14, pack(e+'q', tsoffset))
+    if options:
+        options += pack(e+'HH', 0, 0)
+    return block(e, 1, pack(e+'HHI', linktype, 0, snaplen) + options)
+
+def epb(e, units, frame=FRAME, iface=0):
+    return block(e, 6, pack(e+'IIIII', iface, units >> 32, units & 0xffffffff, len(frame), len(frame)) + frame)
+
+def pb(e, units, frame=FRAME, iface=0):
+    return block(e, 2, pack(e+'HHIIII', iface, 0, units >> 32, units & 0xffffffff, len(frame), len(frame)) + frame)
+
+def spb(e, frame=FRAME, wirelen=None):
+    return block(e, 3, pack(e+'I', len(frame) if wirelen is None else wirelen) + frame)
+
+def write(tmp_path, data, name='t.pcapng'):
+    path = tmp_path/name
+    path.write_bytes(data)
+    return str(path)
+
+def read(path):
+    with open_trace(path) as reader:
+        return list(reader)
+
+def test_epb_default_resolution_is_microseconds(tmp_path):
+    path = write(tmp_path, shb('<') + idb('<') + epb('<', 1500000) + epb('<', 1500001))
+    assert read(path) == [(1500000000, FRAME), (1500001000, FRAME)]
+    with PcapngReader(path) as reader:
+        assert list(reader.headers()) == [(1500000000, len(FRAME)), (1500001000, len(FRAME))]
+
+@pytest.mark.parametrize('e', ['<', '>'])
+def test_byte_order_resolution_and_offset(tmp_path, e):
+    path = write(tmp_path, shb(e) + idb(e, tsresol=9, tsoffset=2) + epb(e, 5) + pb(e, (1 << 32) + 7))
+    assert read(path) == [(2000000005, FRAME), (2000000000 + (1 << 32) + 7, FRAME)]
+
+def test_binary_resolution(tmp_path):
+    path = write(tmp_path, shb('<') + idb('<', tsresol=0x80 | 10) + epb('<', 1024) + epb('<', 1536))
+    assert [ts for ts, frame in read(path)] == [1000000000, 1500000000]
+
+def test_sub_nanosecond_resolution(tmp_path):
+    path = write(tmp_path, shb('<') + idb('<', tsresol=12) + epb('<', 7000))
+    assert read(path) == [(7, FRAME)]
+
+def test_interfaces_per_section(tmp_path):
+    data = shb('<') + idb('<', tsresol=9) + idb('<', tsresol=3) + epb('<', 4, iface=1)
+    # a new section drops the interfaces of the previous one
+    data += shb('>') + idb('>', tsresol=9) + epb('>', 4)
+    path = write(tmp_path, data)
+    assert [ts for ts, frame in read(path)] == [4000000, 4]
+
+def test_simple_packet_keeps_last_timestamp(tmp_path):
+    path = write(tmp_path, shb('<') + idb('<', tsresol=9) + epb('<', 10) + spb('<'))
+    assert read(path) == [(10, FRAME), (10, FRAME)]
+
+def test_simple_packet_cut_to_snaplen(tmp_path):
+    # 62 bytes captured of a 70 byte packet; the padding is not frame data
+    frame = bytes(range(62))
+    path = write(tmp_path, shb('<') + idb('<', snaplen=62) + spb('<', frame, wirelen=70))
+    assert read(path) == [(0, frame)]
+
+def test_not_ethernet(tmp_path):
+    path = write(tmp_path, shb('<') + idb('<', linktype=105) + epb('<', 1))
+    with pytest.raises(ValueError):
+        read(path)
+
+def test_truncated_block_ends_trace(tmp_path):
+    path = write(tmp_path, (shb('<') + idb('<') + epb('<', 1) + epb('<', 2))[:-8])
+    assert read(path) == [(1000, FRAME)]
+
+@pytest.mark.parametrize('e,magic,scale', [('<', 0xa1b2c3d4, 1000), ('>', 0xa1b2c3d4, 1000), ('<', 0xa1b23c4d, 1)])
+def test_pcap(tmp_path, e, magic, scale):
+    data = pack(e+'IHHiIII', magic, 2, 4, 0, 0, 65535, 1)
+    data += pack(e+'IIII', 3, 250, len(FRAME), len(FRAME)) + FRAME
+    path = write(tmp_path, data, 't.pcap')
+    reader = open_trace(path)
+    assert isinstance(reader, PcapReader)
+    assert list(reader) == [(3000000000 + 250*scale, FRAME)]
+    reader.close()
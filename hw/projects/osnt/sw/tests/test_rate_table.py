@@ -0,0 +1,31 @@
+from rate_table import RateTable, RATE_DELAY_MAX
+
+FREQUENCY = 250000000
+
+def test_delay_already_met():
+    table = RateTable([64, 640], FREQUENCY)
+    assert table.interval() == 5.5
+    assert table.solve_delay(None, 5.5) == 0
+    assert table.solve_delay(None, 2) == 0
+
+def test_delay_below_longest_frame():
+    # frames of 1 and 10 words: a delay of 6 only stretches the short one
+    table = RateTable([64, 640], FREQUENCY)
+    delay = table.solve_delay(None, 8)
+    assert delay == 6
+    assert table.interval(None, delay) == 8
+
+def test_delay_above_every_frame():
+    table = RateTable([64, 640, 100], FREQUENCY)
+    assert table.solve_delay(None, 40) == 40
+    assert table.interval(None, 40) == 40
+
+def test_delay_with_shift():
+    # shift 0 doubles every frame to 2 and 20 ticks
+    table = RateTable([64, 640], FREQUENCY)
+    assert table.solve_delay(0, 15) == 10
+    assert table.interval(0, 10) == 15
+
+def test_delay_capped():
+    table = RateTable([64], FREQUENCY)
+    assert table.solve_delay(None, 1e12) == RATE_DELAY_MAX
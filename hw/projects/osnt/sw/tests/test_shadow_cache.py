@@ -0,0 +1,32 @@
+from libaxi import AxiShadowCache
+from axi_emulator import AxiEmulator
+
+CONTROL = 0x12000
+COUNTER = 0x12040
+
+def cache():
+    emulator = AxiEmulator()
+    return emulator, AxiShadowCache(emulator, [CONTROL])
+
+def test_control_registers_cached():
+    emulator, shadow = cache()
+    shadow.write(CONTROL, 5)
+    reads = emulator.reads
+    assert shadow.read(CONTROL) == 5
+    assert shadow.batch([('r', CONTROL, None)]) == [5]
+    assert emulator.reads == reads
+    assert shadow.hits == 2
+
+def test_other_registers_read_through():
+    emulator, shadow = cache()
+    shadow.write(COUNTER, 1)
+    assert shadow.read(COUNTER) == 1
+    # the datapath moves the counter behind the cache
+    emulator.count(COUNTER, 2)
+    assert shadow.read(COUNTER) == 3
+    assert shadow.batch([('r', COUNTER, None), ('w', CONTROL, 7), ('r', CONTROL, None)]) == [3, None, 7]
+    assert COUNTER not in shadow.shadow
+
+def test_batch_keeps_order():
+    emulator, shadow = cache()
+    assert shadow.batch([('w', COUNTER, 1), ('r', COUNTER, None), ('w', COUNTER, 2), ('r', COUNTER, None)]) == [None, 1, None, 2]
@@ -0,0 +1,34 @@
+import numpy as np
+from trace_index import TraceIndex, TS_TICK_MAX
+
+def index(ts_ns):
+    ts_ns = np.array(ts_ns, dtype=np.int64)
+    return TraceIndex('t.pcap', 0, 0, '', np.full(len(ts_ns), 60, dtype=np.uint16), ts_ns)
+
+def test_rounding_does_not_accumulate():
+    # 3 ns at 250 MHz is 0.75 ticks; ticks are taken from the start of the
+    # trace, so the gaps sum to the whole duration
+    ticks, negative, oversized = index([0, 3, 6, 9, 12]).gap_ticks(250000000)
+    assert ticks.tolist() == [250000000, 0, 1, 1, 1]
+    assert ticks.dtype == np.uint32
+    assert (negative, oversized) == (0, 0)
+
+def test_large_timestamps():
+    start = 1700000000*1000000000
+    ticks = index([start, start + 1000000007]).gap_ticks(156250000, first_gap_ns=8)[0]
+    assert ticks.tolist() == [1, 156250001]
+
+def test_negative_gaps_clamped():
+    ticks, negative, oversized = index([100, 50, 200]).gap_ticks(1000000000, first_gap_ns=0)
+    assert ticks.tolist() == [0, 0, 150]
+    assert (negative, oversized) == (1, 0)
+
+def test_oversized_gaps_clamped():
+    ticks, negative, oversized = index([0, 30*1000000000]).gap_ticks(250000000)
+    assert ticks.tolist() == [250000000, TS_TICK_MAX]
+    assert (negative, oversized) == (0, 1)
+
+def test_empty():
+    ticks, negative, oversized = index([]).gap_ticks(250000000)
+    assert len(ticks) == 0
+    assert (negative, oversized) == (0, 0)
@@ -0,0 +1,24 @@
+import numpy as np
+from trace_period import find_period
+
+def keys(values):
+    return np.array(values, dtype=np.uint64)
+
+def test_repeating():
+    assert find_period(keys([1, 2, 3]*4)) == 3
+    assert find_period(keys([7]*5)) == 1
+
+def test_not_repeating():
+    assert find_period(keys([1, 2, 3, 1, 2, 4])) == 6
+    # a partial last period is not a repetition
+    assert find_period(keys([1, 2, 1, 2, 1])) == 5
+
+def test_empty():
+    assert find_period(keys([])) == 0
+
+def test_gaps_must_repeat():
+    gaps = np.array([9, 1, 2, 1, 2, 1, 2], dtype=np.uint32)
+    assert find_period(keys([5, 6]*3 + [5]), gaps) == 7
+    # the first gap only sets the start of the trace
+    assert find_period(keys([5, 6]*3), np.array([9, 1, 2, 1, 2, 1])) == 2
+    assert find_period(keys([5, 6]*3), np.array([9, 1, 2, 1, 3, 1])) == 6
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2017 University of Cambridge
+# Copyright (c) 2017 Jong Hun Han
+# All rights reserved.
+#
+# This software was developed by University of Cambridge Computer Laboratory
+# under the ENDEAVOUR project (grant agreement 644960) as part of
+# the European Union's Horizon 2020 research and innovation programme.
+#
+# @NETFPGA_LICENSE_HEADER_START@
+#
+# Licensed to NetFPGA Open Systems C.I.C. (NetFPGA) under one or more
+# contributor license agreements. See the NOTICE file distributed with this
+# work for additional information regarding copyright ownership. NetFPGA
+# licenses this file to you under the NetFPGA Hardware-Software License,
+# Version 1.0 (the License); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at:
+#
+# http://www.netfpga-cic.org
+#
+# Unless required by applicable law or agreed to in writing, Work distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# @NETFPGA_LICENSE_HEADER_END@
+################################################################################
+#
+#  Description:
+#        Register access benchmarks across the libaxi backends (subprocess,
+#        ioctl, mmap, emulator): single-op latency, batched throughput,
+#        read-after-write latency, generator init, pcap_engine.clear() and
+#        the osnt-tool-cmd -run configuration sequence. Results are written
+#        as JSON and can be checked against a stored baseline.
+#
+#        eg. axi_bench.py --output bench.json
+#            axi_bench.py --baseline bench.json --tolerance 0.2
+
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import platform
+import tempfile
+import contextlib
+
+script_dir = os.path.dirname(os.path.abspath(sys.argv[0]))
+sys.path.insert(0, os.path.join(script_dir, '..', 'lib'))
+import libaxi
+
+BENCH_ADDR = 0x14008 # nf0 rate limiter rate register, harmless to rewrite
+BENCH_TRACE_PKTS = 64
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--backends", type=str, default="subprocess,ioctl,mmap,emulator", help="Comma separated backends to try")
+parser.add_argument("--iface", type=str, default=libaxi.AXI_IFACE, help="Interface of the card")
+parser.add_argument("--bar", type=str, default=libaxi.AXI_BAR_PATH, help="BAR resource file for the mmap backend")
+parser.add_argument("--bar-base", type=lambda x: int(x, 0), default=libaxi.AXI_BAR_BASE, help="Register address at offset 0 of the BAR file")
+parser.add_argument("--iterations", type=int, default=2000, help="Iterations per register benchmark")
+parser.add_argument("--slow-iterations", type=int, default=50, help="Iterations for the subprocess backend and generator benchmarks")
+parser.add_argument("--batch", type=int, default=64, help="Accesses per batch")
+parser.add_argument("--output", type=str, help="Write JSON results to this file, stdout if not given")
+parser.add_argument("--baseline", type=str, help="Compare against a JSON file written by a previous run")
+parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown against the baseline, 0.2 = 20%%")
+
+# Returns the opened backend, or None with the reason it is not available.
+def probe(name, args):
+    try:
+        if name == "subprocess":
+            axilib = os.path.join(script_dir, '..', 'lib', 'axilib')
+            if not os.access(axilib, os.X_OK):
+                return None, "axilib not built"
+            backend = libaxi.AxiSubprocess(args.iface, axilib)
+        else:
+            backend = libaxi.open_backend(name, args.iface, False, args.bar, args.bar_base)
+            if name == "ioctl" and not isinstance(backend, libaxi.AxiIoctl):
+                return None, "ioctl backend not available"
+        backend.read(BENCH_ADDR)
+        return backend, None
+    except Exception as e:
+        return None, str(e)
+
+def summary(samples, ops_per_sample=1):
+    samples = sorted(samples)
+    n = len(samples)
+    total = sum(samples)
+    return {'n': n,
+            'mean_us': total/n*1e6,
+            'p50_us': samples[n//2]*1e6,
+            'p99_us': samples[min(n-1, int(n*0.99))]*1e6,
+            'ops_per_s': n*ops_per_sample/total if total > 0 else 0.0}
+
+def timeit(func, iterations, ops_per_sample=1):
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return summary(samples, ops_per_sample)
+
+def bench_registers(iterations, batch):
+    results = {}
+    value = [0]
+
+    def read():
+        libaxi.rdaxi(BENCH_ADDR)
+
+    def write():
+        value[0] = (value[0] + 1) & 0xff
+        libaxi.wraxi(BENCH_ADDR, value[0])
+
+    def read_after_write():
+        write()
+        libaxi.rdaxi(BENCH_ADDR)
+
+    def batched():
+        t = libaxi.AxiTransaction().begin()
+        for i in range(batch//2):
+            t.write(BENCH_ADDR, i)
+            t.read(BENCH_ADDR)
+        t.commit()
+
+    results['read'] = timeit(read, iterations)
+    results['write'] = timeit(write, iterations)
+    results['read_after_write'] = timeit(read_after_write, iterations)
+    results['batch'] = timeit(batched, max(1, iterations//batch), batch//2*2)
+    libaxi.wraxi(BENCH_ADDR, 0)
+    return results
+
+# Generator level timings need scapy through generator.py.
+def bench_generator(iterations):
+    with contextlib.redirect_stdout(io.StringIO()):
+        import generator_cli_lib as cli
+    results = {}
+    results['generator_init'] = timeit(cli.InitGCli, iterations)
+    results['pcap_engine_clear'] = timeit(cli.initgcli.pcap_engine.clear, iterations)
+    return results
+
+# Small trace of BENCH_TRACE_PKTS frames written to directory.
+def bench_trace(directory):
+    from pcap_reader import PcapWriter
+    path = os.path.join(directory, 'bench.pcap')
+    writer = PcapWriter(path)
+    for i in range(BENCH_TRACE_PKTS):
+        writer.write(i*1000, b'\xff'*6 + bytes(6) + b'\x08\x00' + bytes([i])*(46 + i))
+    writer.close()
+    return path
+
+# The osnt-tool-cmd -run sequence on a small trace loaded to nf0: a new
+# session takes over the stored state, applies the config, which loads
+# nothing and writes only what changed, and starts and stops the replay.
+# The one load before it needs the host interface of nf0.
+def bench_tool_cmd(iterations):
+    from generator_session import GeneratorSession
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        config = {'nf0': {'pcap': bench_trace(directory), 'replay_cnt': 1},
+                  'nf1': {'replay_cnt': 1}}
+        session = GeneratorSession()
+        with contextlib.redirect_stdout(io.StringIO()):
+            session.apply(config)
+        state = json.loads(json.dumps(session.state()))
+
+        def run_sequence():
+            session = GeneratorSession()
+            session.restore(state)
+            session.apply(config)
+            session.run()
+            session.stop()
+        results['tool_cmd_run'] = timeit(run_sequence, iterations)
+    return results
+
+# hwReg from NFTest, if it can be imported here
+def bench_hwreg(iterations):
+    from NFTest import hwReg
+    reg = BENCH_ADDR
+    results = {}
+    results['hwreg_read'] = timeit(lambda: hwReg.readReg(reg), iterations)
+    return results
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for backend, benches in results['backends'].items():
+        for bench, stats in benches.items():
+            try:
+                base = baseline['backends'][backend][bench]['mean_us']
+            except KeyError:
+                continue
+            if base > 0 and stats['mean_us'] > base*(1+tolerance):
+                regressions.append('%s/%s: %.2fus -> %.2fus (+%.0f%%)' % (backend, bench, base, stats['mean_us'], (stats['mean_us']/base-1)*100))
+    return regressions
+
+if __name__=="__main__":
+    args = parser.parse_args()
+    libaxi.set_audit("off")
+
+    results = {'meta': {'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+                        'host': platform.node(),
+                        'python': platform.python_version(),
+                        'iterations': args.iterations,
+                        'slow_iterations': args.slow_iterations,
+                        'batch': args.batch},
+               'backends': {},
+               'skipped': {}}
+
+    for name in args.backends.split(','):
+        backend, reason = probe(name, args)
+        if backend is None:
+            results['skipped'][name] = reason
+            continue
+        libaxi.set_backend(backend)
+        if name == "subprocess":
+            iterations = args.slow_iterations
+        else:
+            iterations = args.iterations
+        benches = bench_registers(iterations, args.batch)
+        try:
+            benches.update(bench_generator(args.slow_iterations))
+        except ImportError as e:
+            results['skipped'][name+'/generator'] = str(e)
+        try:
+            benches.update(bench_tool_cmd(args.slow_iterations))
+        except (ImportError, OSError) as e:
+            results['skipped'][name+'/tool_cmd'] = str(e)
+        results['backends'][name] = benches
+
+    try:
+        results['backends']['hwreg'] = bench_hwreg(args.iterations)
+    except Exception as e:
+        results['skipped']['hwreg'] = str(e)
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if (args.output):
+        f = open(args.output, "w")
+        f.write(text+"\n")
+        f.close()
+    else:
+        print(text)
+
+    if (args.baseline):
+        baseline = json.load(open(args.baseline))
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            sys.stderr.write("REGRESSION "+line+"\n")
+        if regressions:
+            sys.exit(1)
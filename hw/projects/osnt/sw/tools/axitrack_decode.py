@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2017 University of Cambridge
+# Copyright (c) 2017 Jong Hun Han
+# All rights reserved.
+#
+# This software was developed by University of Cambridge Computer Laboratory
+# under the ENDEAVOUR project (grant agreement 644960) as part of
+# the European Union's Horizon 2020 research and innovation programme.
+#
+# @NETFPGA_LICENSE_HEADER_START@
+#
+# Licensed to NetFPGA Open Systems C.I.C. (NetFPGA) under one or more
+# contributor license agreements. See the NOTICE file distributed with this
+# work for additional information regarding copyright ownership. NetFPGA
+# licenses this file to you under the NetFPGA Hardware-Software License,
+# Version 1.0 (the License); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at:
+#
+# http://www.netfpga-cic.org
+#
+# Unless required by applicable law or agreed to in writing, Work distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# @NETFPGA_LICENSE_HEADER_END@
+################################################################################
+#
+#  Description:
+#        Decodes the binary register audit file written by libaxi
+#        (axitrack.bin) into the axitrack.txt text format or into CSV.
+
+import os
+import sys
+import argparse
+
+script_dir = os.path.dirname(sys.argv[0])
+sys.path.insert(0, os.path.join(script_dir, '..', 'lib'))
+from axi_audit import read_audit, AUDIT_OP_READ
+
+parser = argparse.ArgumentParser()
+parser.add_argument("audit_file", nargs="?", default="axitrack.bin", help="Binary audit file. eg. axitrack.bin")
+parser.add_argument("--format", choices=["text", "csv"], default="text", help="Output format")
+parser.add_argument("--output", type=str, help="Output file, stdout if not given")
+
+args = parser.parse_args()
+
+if (args.output):
+   out = open(args.output, "w", newline="")
+else:
+   out = sys.stdout
+
+if args.format == "csv":
+   out.write("timestamp_ns,op,addr,value\n")
+
+for ts, op, addr, value in read_audit(args.audit_file):
+   if args.format == "csv":
+      out.write("%d,%s,0x%08x,0x%08x\n" % (ts, "read" if op == AUDIT_OP_READ else "write", addr, value))
+   elif op == AUDIT_OP_READ:
+      out.write("read from "+hex(addr)+" got "+hex(value)+" \r\n")
+   else:
+      out.write("write to "+hex(addr)+" with "+hex(value)+" \r\n")
+
+if (args.output):
+   out.close()
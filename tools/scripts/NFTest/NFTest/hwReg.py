@@ -28,24 +28,152 @@
 
 from NFTest import *
 import os
+import re
+import mmap
 from fcntl import *
 from ctypes import *
 
-# Loading the NFPLUS shared library
-print("loading libsume..")
-lib_path=os.path.join(os.environ['NFPLUS_FOLDER'],'sw','hwtestlib','libsume.so')
-libsume=cdll.LoadLibrary(lib_path)
+# Register backend, NF_REG_BACKEND=libsume (default), mmap or emulator.
+# The mmap backend maps the BAR resource file given in NF_REG_BAR, any file
+# (e.g. under /dev/shm) can stand in for it. NF_REG_BAR_BASE is the register
+# address found at offset 0 of that file.
+NF_REG_BACKEND = os.environ.get('NF_REG_BACKEND', 'libsume')
 
-# argtypes for the functions called from  C
-libsume.regread.argtypes = [c_uint]
-libsume.regread.restype = c_uint
-libsume.regwrite.argtypes= [c_uint, c_uint]
+class LibsumeBackend:
+
+	def __init__(self):
+		# Loading the NFPLUS shared library
+		print("loading libsume..")
+		lib_path=os.path.join(os.environ['NFPLUS_FOLDER'],'sw','hwtestlib','libsume.so')
+		self.libsume=cdll.LoadLibrary(lib_path)
+
+		# argtypes for the functions called from  C
+		self.libsume.regread.argtypes = [c_uint]
+		self.libsume.regread.restype = c_uint
+		self.libsume.regwrite.argtypes= [c_uint, c_uint]
+
+	def read(self, reg):
+		return self.libsume.regread(reg)
+
+	def write(self, reg, val):
+		return self.libsume.regwrite(reg, val)
+
+	def read_block(self, reg, count):
+		return [self.libsume.regread(reg+4*i) for i in range(count)]
+
+	def regread_expect(self, reg, val):
+		return self.libsume.regread_expect(reg, val)
+
+class MmapBackend:
+
+	def __init__(self, path, base=0):
+		self.base = base
+		self.fd = os.open(path, os.O_RDWR | os.O_SYNC)
+		size = os.fstat(self.fd).st_size
+		self.map = mmap.mmap(self.fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+		self.regs = memoryview(self.map).cast('I')
+
+	# a negative index would silently wrap to the end of the BAR
+	def index(self, reg, count=1):
+		if reg & 0x3:
+			raise ValueError("Unaligned register address: "+hex(reg))
+		i = (reg - self.base) >> 2
+		if i < 0 or i + count > len(self.regs):
+			raise ValueError("Register address outside the mapping: "+hex(reg))
+		return i
+
+	def read(self, reg):
+		return self.regs[self.index(reg)]
+
+	def write(self, reg, val):
+		self.regs[self.index(reg)] = val & 0xffffffff
+
+	# contiguous counter blocks are read with a single slice
+	def read_block(self, reg, count):
+		i = self.index(reg, count)
+		return self.regs[i:i+count].tolist()
+
+	def regread_expect(self, reg, val):
+		return self.read(reg) == val
+
+# In-memory register file built from the reg_defines functions visible in
+# the test script (NFPLUS_<MODULE>_<N>_<REG>()). Packet and byte counters are
+# cleared on read and writing a module's RESET register clears its counters,
+# as the run.py tests expect. count() stands in for the datapath.
+class EmulatorBackend:
+
+	COUNTER_RE = re.compile(r'^(PKT|BYTES)')
+
+	def __init__(self, namespace=None):
+		if namespace is None:
+			import __main__
+			namespace = vars(__main__)
+		self.regs = {}
+		self.counters = set()
+		self.resets = {}
+		modules = {}
+		for name, func in list(namespace.items()):
+			match = re.match(r'^NFPLUS_(.+_\d+)_([A-Z0-9]+)$', name)
+			if not match or not callable(func):
+				continue
+			try:
+				reg = int(func())
+			except Exception:
+				continue
+			module, field = match.groups()
+			default = namespace.get(name+'_DEFAULT')
+			self.regs[reg] = int(default()) if callable(default) else 0
+			if self.COUNTER_RE.match(field):
+				self.counters.add(reg)
+				modules.setdefault(module, []).append(reg)
+			elif field == 'RESET':
+				self.resets[reg] = module
+		self.module_counters = modules
+
+	def count(self, reg, n=1):
+		self.regs[reg] = (self.regs.get(reg, 0) + n) & 0xffffffff
+
+	def read(self, reg):
+		val = self.regs.get(reg, 0)
+		if reg in self.counters:
+			self.regs[reg] = 0
+		return val
+
+	def write(self, reg, val):
+		self.regs[reg] = val & 0xffffffff
+		if val and reg in self.resets:
+			for counter in self.module_counters.get(self.resets[reg], []):
+				self.regs[counter] = 0
+
+	def read_block(self, reg, count):
+		return [self.read(reg+4*i) for i in range(count)]
+
+	def regread_expect(self, reg, val):
+		return self.read(reg) == val
+
+backend = None
+
+def get_backend():
+	global backend
+	if backend is None:
+		if NF_REG_BACKEND == 'libsume':
+			backend = LibsumeBackend()
+		elif NF_REG_BACKEND == 'mmap':
+			backend = MmapBackend(os.environ['NF_REG_BAR'], int(os.environ.get('NF_REG_BAR_BASE', '0'), 0))
+		elif NF_REG_BACKEND == 'emulator':
+			backend = EmulatorBackend()
+		else:
+			raise ValueError('Unknown register backend: '+NF_REG_BACKEND)
+	return backend
 
 def readReg(reg):
-	return libsume.regread(reg)
+	return get_backend().read(reg)
+
+def readRegBlock(reg, count):
+	return get_backend().read_block(reg, count)
 
 def writeReg(reg, val):
-	return libsume.regwrite(reg, val)
+	return get_backend().write(reg, val)
 
 def regread_expect(reg, val):
-	return libsume.regread_expect(reg, val)
+	return get_backend().regread_expect(reg, val)
@@ -58,6 +58,14 @@ def regwrite(reg, val):
 def regread(reg):
 	return hwReg.readReg(reg)
 
+############################
+# Function: regread_block
+# Arguments: first register, number of consecutive registers
+# Description: reads a block of contiguous registers, e.g. counters
+############################
+def regread_block(reg, count):
+	return hwReg.readRegBlock(reg, count)
+
 ############################
 # Function: regread_expect
 # Arguments: nf2 interface to read from, register, expected value, (optional) mask